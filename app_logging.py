@@ -0,0 +1,163 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARNING': logging.WARNING,
+          'ERROR': logging.ERROR, 'CRITICAL': logging.CRITICAL}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+            'process': record.process,
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes at most 'burst' records per 'interval' seconds for each message template
+    below WARNING; the rest are dropped and counted. The next record passed for a
+    template carries the number dropped since in its 'suppressed' attribute.
+    """
+
+    def __init__(self, burst=20, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.burst:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, passed, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                started, passed = now, 0
+            if passed >= self.burst:
+                self._windows[key] = (started, passed, suppressed + 1)
+                return False
+            self._windows[key] = (started, passed + 1, 0)
+        record.suppressed = suppressed
+        if suppressed and isinstance(record.msg, str):
+            record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread and never blocks.
+
+    The stock QueueHandler formats every record in the logging thread so it can be
+    pickled; records only cross threads here, so message arguments are merged when the
+    listener writes them. A full queue drops the record and counts it instead.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def level(name, default):
+    return LEVELS.get((name or default).upper(), LEVELS[default])
+
+
+def configure_logging(logger, config):
+    """
+    Sets up the handlers of logger from config.conf settings:
+
+      log_level / log_file_level   console / file levels (INFO)
+      log_file                     path of the log file; '{pid}' is replaced by the process id (app.log)
+      log_format                   'text' or 'json' (text)
+      log_rotate                   'size' or 'time' (size)
+      log_max_bytes, log_backup_count, log_rotate_when
+      log_async                    write from a background thread through a queue (true)
+      log_queue_size               records buffered before new ones are dropped (10000)
+      log_sample_burst, log_sample_interval
+                                   per-call-site sampling of lines below WARNING (0 disables)
+
+    Returns the queue listener in async mode, otherwise None.
+    """
+    console_level = level(config.get('log_level'), 'INFO')
+    file_level = level(config.get('log_file_level'), 'INFO')
+    formatter = JsonFormatter() if config.get('log_format', 'text') == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    log_file = config.get('log_file', 'app.log').replace('{pid}', str(os.getpid()))
+    if config.get('log_rotate', 'size') == 'time':
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=config.get('log_rotate_when', 'midnight'),
+            backupCount=int(config.get('log_backup_count', 5)), encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=int(config.get('log_max_bytes', 10 * 1024 * 1024)),
+            backupCount=int(config.get('log_backup_count', 5)), encoding='utf-8'
+        )
+    file_handler.setLevel(file_level)
+    for handler in (console_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    # Records below every handler's level are never created, so disabled lines cost one comparison
+    logger.setLevel(min(console_level, file_level))
+    logger.propagate = False
+    sampler = SamplingFilter(
+        burst=int(config.get('log_sample_burst', 20)), interval=float(config.get('log_sample_interval', 10))
+    )
+
+    if config.get('log_async', 'true').lower() != 'true':
+        logger.addFilter(sampler)
+        logger.addHandler(console_handler)
+        logger.addHandler(file_handler)
+        return None
+
+    queue_handler = DeferredQueueHandler(queue.Queue(int(config.get('log_queue_size', 10000))))
+    queue_handler.addFilter(sampler)
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(
+        queue_handler.queue, console_handler, file_handler, respect_handler_level=True
+    )
+    listener.start()
+
+    def stop_listener():
+        # Flushes what is queued at exit; stop() fails if called twice
+        if listener._thread is not None:
+            listener.stop()
+
+    atexit.register(stop_listener)
+    return listener
@@ -0,0 +1,612 @@
+"""
+Asyncio serving mode for Prompter.
+
+Exposes the same routes as server.py, but streams completions with an async
+HTTP client and talks to MariaDB through an async connection pool, so a single
+process can hold hundreds of concurrent streams open.
+
+Run with:  uvicorn asgi_server:app --port 5000
+"""
+import asyncio
+from datetime import datetime
+
+import aiomysql
+import httpx
+from quart import Quart, request, jsonify, Response
+from quart_cors import cors
+
+import server
+from server import (
+    logger, API_KEY, API_BASE_URL, API_POOL_SIZE, API_CONNECT_TIMEOUT, API_READ_TIMEOUT,
+    API_MAX_RETRIES, API_RETRY_BACKOFF, MODEL, DEFAULT_WORKSPACE, WORKSPACES,
+    DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME, DB_POOL_SIZE,
+    MAX_OUTPUT_TOKENS, API_STREAM_USAGE, STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS, token_ledger, context_budgeter, codebase_jobs,
+    HISTORY_PAGE_SIZE, HISTORY_MESSAGE_PAGE_SIZE, history_cache, page_args,
+    MESSAGE_WRITE_WAIT, message_writer, response_cache, response_cache_key,
+    history_from_token_rows, budget_header, extract_keywords,
+    metrics_registry, tracer, tokens_total, stream_bytes_total, observe_completion, TRACE_SLOW_THRESHOLD, startup
+)
+from completion_client import AsyncCompletionClient, acoalesce_deltas
+
+app = cors(Quart(__name__), expose_headers=['X-Context-Budget', 'X-Response-Cache'])
+
+db_pool = None
+completion_client = None
+
+
+class TracedQueries:
+    """
+    Cursor mixin that times every query as a 'db.<verb>' span, like db_pool.TracedCursor.
+    """
+
+    async def execute(self, query, args=None):
+        with tracer.span(f"db.{query.split(None, 1)[0].lower()}"):
+            return await super().execute(query, args)
+
+
+class TracedCursor(TracedQueries, aiomysql.Cursor):
+    pass
+
+
+class TracedDictCursor(TracedQueries, aiomysql.DictCursor):
+    pass
+
+
+@app.before_serving
+async def open_pools():
+    global db_pool, completion_client
+    db_pool = await aiomysql.create_pool(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        db=DB_NAME,
+        minsize=0,  # Connect on demand, so serving starts even while the database is unreachable
+        maxsize=DB_POOL_SIZE,
+        pool_recycle=3600,
+        autocommit=True,
+        cursorclass=TracedCursor
+    )
+    completion_client = AsyncCompletionClient(
+        API_KEY,
+        base_url=API_BASE_URL,
+        pool_size=max(API_POOL_SIZE, 100),
+        connect_timeout=API_CONNECT_TIMEOUT,
+        read_timeout=API_READ_TIMEOUT,
+        max_retries=API_MAX_RETRIES,
+        backoff=API_RETRY_BACKOFF
+    )
+    logger.info("Async serving mode started.")
+
+
+@app.before_request
+async def start_trace():
+    tracer.start(request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+
+
+@app.after_request
+async def finish_trace(response):
+    trace = tracer.current()
+    if trace is not None and not trace.deferred:
+        trace.finish(response.status_code)
+    return response
+
+
+@app.after_serving
+async def shutdown():
+    await completion_client.aclose()
+    db_pool.close()
+    await db_pool.wait_closed()
+
+
+async def fetch_history_token_counts(cursor, chat_id):
+    """
+    Async counterpart of server.fetch_history_token_counts.
+    """
+    await cursor.execute(
+        "SELECT id, sender, token_count, IF(token_count IS NULL, content, NULL) "
+        "FROM messages WHERE chat_id = %s ORDER BY timestamp ASC, id ASC",
+        (chat_id,)
+    )
+    rows = await cursor.fetchall()
+    history, backfill = await asyncio.to_thread(history_from_token_rows, rows)
+    if backfill:
+        await cursor.executemany(*pyformat((server.BACKFILL_TOKEN_COUNTS, backfill)))
+        await cursor.connection.commit()
+    return history
+
+
+def id_placeholders(ids):
+    return ', '.join('%s' for _ in ids)
+
+
+def pyformat(query):
+    """
+    Converts a (query, params) pair built by server.py, with '?' placeholders, to aiomysql's '%s' style.
+    """
+    sql, params = query
+    return sql.replace('?', '%s'), params
+
+
+async def chat_codebase(cursor, chat_id, workspace):
+    """
+    Resolves the codebase snapshot a chat is pinned to, loading it off the event loop on a cache miss.
+    Returns None when the chat does not exist.
+    """
+    await cursor.execute("SELECT snapshot_id FROM chat_history WHERE id = %s", (chat_id,))
+    row = await cursor.fetchone()
+    if row is None:
+        return None
+    return await asyncio.to_thread(server.chat_codebase, row[0], workspace)
+
+
+async def wait_for_chat_writes(chat_id):
+    """
+    Waits off the event loop for queued messages of a chat to be written, if there are any.
+    """
+    if message_writer.pending(chat_id):
+        await asyncio.to_thread(message_writer.wait_for_chat, chat_id, MESSAGE_WRITE_WAIT)
+
+
+async def plan_chat_context(cursor, chat_id, draft, codebase):
+    """
+    Async counterpart of server.plan_chat_context.
+    """
+    history = await fetch_history_token_counts(cursor, chat_id) if chat_id else []
+    query = draft
+    if chat_id and context_budgeter.uses_index(codebase.index):
+        await cursor.execute(
+            "SELECT LEFT(content, 2000) FROM messages WHERE chat_id = %s ORDER BY timestamp DESC, id DESC LIMIT 2",
+            (chat_id,)
+        )
+        query = '\n'.join([draft] + [row[0] for row in await cursor.fetchall()])
+    plan = await asyncio.to_thread(
+        context_budgeter.plan, codebase.prompt, history, draft, codebase.index, query
+    )
+    if plan['dropped_ids'] and context_budgeter.summary_tokens:
+        await cursor.execute(
+            f"SELECT LEFT(content, 200) FROM messages WHERE sender = 'user' "
+            f"AND id IN ({id_placeholders(plan['dropped_ids'])}) ORDER BY timestamp ASC, id ASC",
+            tuple(plan['dropped_ids'])
+        )
+        snippets = [row[0] for row in await cursor.fetchall()]
+        await asyncio.to_thread(context_budgeter.add_summary, plan, snippets)
+    return plan
+
+
+async def fetch_messages_by_id(cursor, message_ids):
+    if not message_ids:
+        return []
+    await cursor.execute(
+        f"SELECT sender, content FROM messages WHERE id IN ({id_placeholders(message_ids)}) ORDER BY timestamp ASC, id ASC",
+        tuple(message_ids)
+    )
+    return [
+        {"role": 'user' if sender == 'user' else 'assistant', "content": content}
+        for sender, content in await cursor.fetchall()
+    ]
+
+
+async def count_tokens_response(endpoint):
+    """
+    Shared implementation of the token counting endpoints.
+    """
+    try:
+        data = await request.get_json()
+        chat_id = data.get('chat_id')
+        new_message = data.get('new_message', '').strip()
+        if not new_message:
+            return jsonify({'error': 'No new_message provided.'}), 400
+        workspace = data.get('workspace') or DEFAULT_WORKSPACE
+        if workspace not in WORKSPACES:
+            return jsonify({'error': f"Unknown workspace '{workspace}'."}), 400
+        try:
+            if chat_id:
+                await wait_for_chat_writes(chat_id)
+                async with db_pool.acquire() as connection:
+                    async with connection.cursor() as cursor:
+                        codebase = await chat_codebase(cursor, chat_id, workspace)
+                        if codebase is None:
+                            codebase = await asyncio.to_thread(server.workspace_codebase, workspace)
+                        plan = await plan_chat_context(cursor, chat_id, new_message, codebase)
+            else:
+                codebase = await asyncio.to_thread(server.workspace_codebase, workspace)
+                plan = await plan_chat_context(None, None, new_message, codebase)
+        except aiomysql.Error:
+            logger.exception("Database error while fetching messages for token counting.")
+            return jsonify({'error': 'Database error while fetching messages.'}), 500
+        token_count, breakdown = plan['breakdown']['total'], plan['breakdown']
+        return jsonify({'input_token_count': token_count, 'breakdown': breakdown}), 200
+    except Exception:
+        logger.exception("Error in %s endpoint.", endpoint)
+        return jsonify({'error': 'Failed to count tokens.'}), 500
+
+
+async def count_input_tokens_batch(items, workspace):
+    """
+    Async counterpart of server.count_input_tokens_batch, running the same queries.
+    """
+    draft_counts = await asyncio.to_thread(
+        token_ledger.count_texts, [draft for _, draft in items], server.COUNT_TOKENS_THREADS
+    )
+    chat_ids = sorted({chat_id for chat_id, _ in items if chat_id is not None})
+    histories, snapshots, recent = {}, {}, {}
+    if not chat_ids:
+        codebases, _ = await asyncio.to_thread(server.batch_codebases, items, snapshots, workspace)
+        return await asyncio.to_thread(server.plan_token_batch, items, draft_counts, histories, codebases, recent)
+    for chat_id in chat_ids:
+        await wait_for_chat_writes(chat_id)
+    async with db_pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(*pyformat(server.batch_history_query(chat_ids)))
+            histories, snapshots, backfill = await asyncio.to_thread(server.batch_histories, await cursor.fetchall())
+            if backfill:
+                await cursor.executemany(*pyformat((server.BACKFILL_TOKEN_COUNTS, backfill)))
+            codebases, indexed = await asyncio.to_thread(server.batch_codebases, items, snapshots, workspace)
+            if indexed:
+                await cursor.execute(*pyformat(server.batch_recent_query(indexed)))
+                recent = server.group_snippets(await cursor.fetchall())
+            plans = await asyncio.to_thread(server.plan_token_batch, items, draft_counts, histories, codebases, recent)
+            dropped = [message_id for plan in plans if plan for message_id in plan['dropped_ids']]
+            if dropped and context_budgeter.summary_tokens:
+                await cursor.execute(*pyformat(server.batch_summary_query(dropped)))
+                summaries = server.group_snippets(await cursor.fetchall())
+                await asyncio.to_thread(server.summarize_token_batch, items, plans, summaries)
+    return plans
+
+
+@app.route('/count_tokens_batch', methods=['POST'])
+async def count_tokens_batch_route():
+    try:
+        items, workspace, error = server.parse_token_batch(await request.get_json(silent=True) or {})
+        if error:
+            return jsonify({'error': error}), 400
+        try:
+            plans = await count_input_tokens_batch(items, workspace)
+        except aiomysql.Error:
+            logger.exception("Database error while fetching messages for batch token counting.")
+            return jsonify({'error': 'Database error while fetching messages.'}), 500
+        return jsonify(server.token_batch_result(items, plans)), 200
+    except Exception:
+        logger.exception("Error in /count_tokens_batch endpoint.")
+        return jsonify({'error': 'Failed to count tokens.'}), 500
+
+
+@app.route('/count_tokens', methods=['POST'])
+async def count_tokens_route():
+    return await count_tokens_response('/count_tokens')
+
+
+@app.route('/count_tokens_full', methods=['POST'])
+async def count_tokens_full_route():
+    return await count_tokens_response('/count_tokens_full')
+
+
+@app.route('/run_codecollector', methods=['POST'])
+async def run_codecollector():
+    """
+    Starts loading a workspace's codebase in the background and returns the job id immediately.
+    """
+    logger.info("Received request to run codecollector.")
+    data = await request.get_json(silent=True) or {}
+    workspace = data.get('workspace') or DEFAULT_WORKSPACE
+    if workspace not in WORKSPACES:
+        return jsonify({'error': f"Unknown workspace '{workspace}'."}), 400
+    try:
+        job, coalesced = await asyncio.to_thread(
+            codebase_jobs.submit, workspace, WORKSPACES[workspace], chat_id=data.get('chat_id')
+        )
+    except Exception as e:
+        # The job store uses server.py's blocking database connections
+        logger.exception("Error while starting a codebase load.")
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'coalesced': coalesced,
+        'status_url': f"/codebase_jobs/{job['job_id']}"
+    }), 202
+
+
+@app.route('/workspaces', methods=['GET'])
+async def list_workspaces():
+    return jsonify({'workspaces': server.workspace_summaries()}), 200
+
+
+@app.route('/codebase_jobs/<job_id>', methods=['GET'])
+async def codebase_job_status(job_id):
+    try:
+        job = await asyncio.to_thread(codebase_jobs.get, job_id)
+    except Exception as e:
+        logger.exception("Error while fetching codebase job %s.", job_id)
+        return jsonify({'error': str(e)}), 500
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job), 200
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    """
+    Endpoint to handle chat messages, streaming the completion back to the client.
+    """
+    logger.info("Received chat request.")
+    try:
+        return await chat_response()
+    except Exception as e:
+        logger.exception("An unexpected error occurred during chat processing.")
+        return jsonify({'error': str(e)}), 500
+
+
+async def chat_response():
+    """
+    Body of /chat; errors it does not handle itself become JSON 500s in chat().
+    """
+    trace = tracer.current()
+    data = await request.get_json()
+    user_message = data.get('message', '').strip()
+    chat_id = data.get('chat_id')
+    if not user_message:
+        return jsonify({'error': 'No message provided.'}), 400
+    if not message_writer.fits(user_message):
+        logger.warning("Message of %d characters is too long to store.", len(user_message))
+        return jsonify({'error': 'Message is too long.'}), 400
+    workspace = data.get('workspace') or DEFAULT_WORKSPACE
+    if workspace not in WORKSPACES:
+        return jsonify({'error': f"Unknown workspace '{workspace}'."}), 400
+    try:
+        if chat_id:
+            await wait_for_chat_writes(chat_id)
+        async with db_pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                if chat_id:
+                    codebase = await chat_codebase(cursor, chat_id, workspace)
+                    if codebase is None:
+                        logger.warning("Chat ID %s not found.", chat_id)
+                        return jsonify({'error': 'Chat history not found.'}), 404
+                else:
+                    codebase = await asyncio.to_thread(server.workspace_codebase, workspace)
+                    title = extract_keywords(user_message) or "Untitled Chat"
+                    await cursor.execute(
+                        "INSERT INTO chat_history (title, created_at, snapshot_id) VALUES (%s, %s, %s)",
+                        (title, datetime.utcnow(), codebase.snapshot_id)
+                    )
+                    chat_id = cursor.lastrowid
+                    history_cache.invalidate()
+                    logger.info("Created new chat history with ID: %s and title: '%s'", chat_id, title)
+                plan = await plan_chat_context(cursor, chat_id, user_message, codebase)
+                history_messages = await fetch_messages_by_id(cursor, plan['included_ids'])
+        with trace.span('tokenize'):
+            user_message_tokens = token_ledger.count_text(user_message)
+        message_writer.enqueue(chat_id, 'user', user_message, datetime.utcnow(), user_message_tokens)
+    except aiomysql.Error as e:
+        logger.exception("Database error during chat processing.")
+        return jsonify({'error': str(e)}), 500
+
+    messages = context_budgeter.build_messages(plan, history_messages, user_message, codebase.prefix_message)
+    cached_key = None
+    if response_cache is not None:
+        cached_key = response_cache_key(plan, codebase, messages)
+        cached = await asyncio.to_thread(response_cache.get, cached_key)
+        if cached is not None:
+            bot_response, output_token_count = cached
+            logger.info("Response cache hit for chat_id %s; replaying cached answer.", chat_id)
+            message_writer.enqueue(chat_id, 'bot', bot_response, datetime.utcnow(), output_token_count)
+
+            async def replay_cached():
+                try:
+                    stream_bytes_total.inc(len(bot_response.encode('utf-8')))
+                    yield bot_response
+                    with trace.span('db.persist'):
+                        await wait_for_chat_writes(chat_id)
+                    yield f"\n[TOKEN_COUNT: {output_token_count}]\n"
+                finally:
+                    trace.finish()
+
+            trace.defer()
+            return Response(
+                replay_cached(),
+                mimetype='text/plain',
+                headers={'X-Context-Budget': budget_header(plan['breakdown']), 'X-Response-Cache': 'hit'}
+            )
+
+    api_payload = {"model": MODEL, "messages": messages, "max_tokens": MAX_OUTPUT_TOKENS, "stream": True}
+    if API_STREAM_USAGE:
+        api_payload["stream_options"] = {"include_usage": True}
+    tokens_total.inc(plan['breakdown']['total'], direction='in')
+    try:
+        with trace.span('upstream.request'):
+            completion = await completion_client.stream_chat(api_payload)
+    except httpx.HTTPError as e:
+        logger.exception("OpenAI API request failed.")
+        return jsonify({'error': str(e)}), 502
+    if completion.status_code != 200:
+        error_message = await completion.error_message()
+        await completion.close()
+        logger.error("OpenAI API request failed: %s", error_message)
+        return jsonify({'error': error_message}), completion.status_code
+    logger.info("OpenAI API request successful. Streaming response to client.")
+
+    async def generate_and_store():
+        parts = []
+        failed = False
+        try:
+            with trace.span('upstream.stream'):
+                async for text in acoalesce_deltas(completion.iter_deltas(), STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS):
+                    if not parts and completion.timing['ttft'] is not None:
+                        trace.record('upstream.first_token', completion.timing['ttft'])
+                    parts.append(text)
+                    stream_bytes_total.inc(len(text.encode('utf-8')))
+                    yield text
+            observe_completion(completion)
+            bot_response = ''.join(parts)
+            if not bot_response.strip():
+                logger.warning("Bot response is empty. No insertion performed.")
+                yield "\n[TOKEN_COUNT: 0]\n"
+                return
+            output_token_count = completion.completion_tokens()
+            if not output_token_count:
+                with trace.span('tokenize'):
+                    output_token_count = await asyncio.to_thread(token_ledger.count_text, bot_response)
+            tokens_total.inc(output_token_count, direction='out')
+            with trace.span('db.persist'):
+                message_writer.enqueue(chat_id, 'bot', bot_response, datetime.utcnow(), output_token_count)
+                if cached_key:
+                    await asyncio.to_thread(response_cache.put, cached_key, bot_response, output_token_count)
+                await wait_for_chat_writes(chat_id)
+            yield f"\n[TOKEN_COUNT: {output_token_count}]\n"
+        except Exception as e:
+            failed = True
+            logger.exception("Error while streaming and storing bot response.")
+            yield f"\n[Error]: {str(e)}"
+        finally:
+            trace.finish(error=failed)
+
+    headers = {'X-Context-Budget': budget_header(plan['breakdown'])}
+    if cached_key:
+        headers['X-Response-Cache'] = 'miss'
+    trace.defer()
+    return Response(generate_and_store(), mimetype='text/plain', headers=headers)
+
+
+@app.route('/completion_stats', methods=['GET'])
+async def completion_stats():
+    return jsonify(completion_client.timings.stats()), 200
+
+
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    return jsonify({'status': 'ok'}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+async def readyz():
+    report = startup.report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/traces', methods=['GET'])
+async def slow_traces():
+    return jsonify({'threshold': TRACE_SLOW_THRESHOLD, 'traces': tracer.slow_traces()}), 200
+
+
+async def fetch_history_page(cursor, before, limit):
+    """
+    Async counterpart of server.fetch_history_page.
+    """
+    if before is None:
+        await cursor.execute(
+            "SELECT id, title, created_at FROM chat_history ORDER BY created_at DESC, id DESC LIMIT %s",
+            (limit + 1,)
+        )
+    else:
+        await cursor.execute("SELECT created_at FROM chat_history WHERE id = %s", (before,))
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        await cursor.execute(
+            "SELECT id, title, created_at FROM chat_history "
+            "WHERE created_at < %s OR (created_at = %s AND id < %s) "
+            "ORDER BY created_at DESC, id DESC LIMIT %s",
+            (row['created_at'], row['created_at'], before, limit + 1)
+        )
+    histories = await cursor.fetchall()
+    next_before = histories[limit - 1]['id'] if len(histories) > limit else None
+    return histories[:limit], next_before
+
+
+async def fetch_message_page(cursor, chat_id, before, limit):
+    """
+    Async counterpart of server.fetch_message_page.
+    """
+    if before is None:
+        await cursor.execute(
+            "SELECT id, sender, content, timestamp FROM messages WHERE chat_id = %s "
+            "ORDER BY timestamp DESC, id DESC LIMIT %s",
+            (chat_id, limit + 1)
+        )
+    else:
+        await cursor.execute("SELECT timestamp FROM messages WHERE id = %s AND chat_id = %s", (before, chat_id))
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        await cursor.execute(
+            "SELECT id, sender, content, timestamp FROM messages "
+            "WHERE chat_id = %s AND (timestamp < %s OR (timestamp = %s AND id < %s)) "
+            "ORDER BY timestamp DESC, id DESC LIMIT %s",
+            (chat_id, row['timestamp'], row['timestamp'], before, limit + 1)
+        )
+    messages = await cursor.fetchall()
+    next_before = messages[limit - 1]['id'] if len(messages) > limit else None
+    return messages[:limit][::-1], next_before
+
+
+@app.route('/response_cache', methods=['GET'])
+async def response_cache_stats():
+    if response_cache is None:
+        return jsonify({'backend': 'off'}), 200
+    return jsonify(await asyncio.to_thread(response_cache.stats)), 200
+
+
+@app.route('/message_writer', methods=['GET'])
+async def message_writer_stats():
+    return jsonify(message_writer.stats()), 200
+
+
+@app.route('/history', methods=['GET'])
+async def get_history():
+    """
+    Endpoint to retrieve a page of chat histories, newest first.
+    """
+    try:
+        before, limit = page_args(request.args, HISTORY_PAGE_SIZE)
+        page = history_cache.get((before, limit))
+        generation = history_cache.generation
+        if page is None:
+            async with db_pool.acquire() as connection:
+                async with connection.cursor(TracedDictCursor) as cursor:
+                    page = await fetch_history_page(cursor, before, limit)
+            if page is None:
+                return jsonify({'error': 'Unknown before cursor.'}), 400
+            history_cache.put((before, limit), page, generation)
+        histories, next_before = page
+        return jsonify({'histories': histories, 'next_before': next_before}), 200
+    except aiomysql.Error as e:
+        logger.exception("Error fetching chat histories.")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/history/<int:chat_id>', methods=['GET'])
+async def get_chat_history(chat_id):
+    """
+    Endpoint to retrieve a page of messages for a specific chat history.
+    """
+    try:
+        before, limit = page_args(request.args, HISTORY_MESSAGE_PAGE_SIZE)
+        await wait_for_chat_writes(chat_id)
+        async with db_pool.acquire() as connection:
+            async with connection.cursor(TracedDictCursor) as cursor:
+                await cursor.execute("SELECT id, title, created_at FROM chat_history WHERE id = %s", (chat_id,))
+                chat = await cursor.fetchone()
+                if not chat:
+                    logger.warning("Chat history with id %s not found.", chat_id)
+                    return jsonify({'error': 'Chat history not found.'}), 404
+                page = await fetch_message_page(cursor, chat_id, before, limit)
+        if page is None:
+            return jsonify({'error': 'Unknown before cursor.'}), 400
+        messages, next_before = page
+        return jsonify({'chat': chat, 'messages': messages, 'next_before': next_before}), 200
+    except aiomysql.Error as e:
+        logger.exception("Error fetching specific chat history.")
+        return jsonify({'error': str(e)}), 500
+
+
+if __name__ == '__main__':
+    import uvicorn
+    logger.info("Running async app on port 5000.")
+    uvicorn.run(app, port=5000)
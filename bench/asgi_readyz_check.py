@@ -0,0 +1,47 @@
+"""
+Checks that the asyncio serving mode reports readiness.
+
+Runs asgi_server's Quart app in process (its before_serving hooks included) with
+the config.conf named by PROMPTER_CONFIG, and polls /readyz until it answers 200.
+Exits non-zero if /readyz answers anything but JSON with 200 or 503, or is not
+ready within --timeout seconds (the database must be reachable and the tokenizer
+encoding downloadable or cached), naming the checks still pending.
+
+Run with:  PROMPTER_CONFIG=/path/to/config.conf python bench/asgi_readyz_check.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from asgi_server import app  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    deadline = time.monotonic() + args.timeout
+    async with app.test_app() as test_app:
+        client = test_app.test_client()
+        while True:
+            response = await client.get('/readyz')
+            if response.status_code not in (200, 503):
+                print(f"/readyz answered {response.status_code}: {await response.get_data(as_text=True)}")
+                sys.exit(1)
+            report = await response.get_json()
+            if response.status_code == 200:
+                print(f"Ready after {report['uptime']:.2f}s: {report['checks']}")
+                return
+            if time.monotonic() > deadline:
+                pending = {name: check['error'] for name, check in report['checks'].items() if not check['ready']}
+                print(f"Not ready after {args.timeout:.0f}s, pending checks: {pending}")
+                sys.exit(1)
+            await asyncio.sleep(0.2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
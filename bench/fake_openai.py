@@ -0,0 +1,133 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Streams a canned answer as server-sent events at a configurable token rate,
+so Prompter can be exercised without network access or API spend. Point the
+app at it with 'api_base_url=http://127.0.0.1:8089/v1' in config.conf.
+
+It also imitates provider prompt caching: the longest prefix a request shares
+with a recent request is reported as usage.prompt_tokens_details.cached_tokens
+(1024-token minimum, 128-token steps, ~4 characters per token), and with
+--prefill-rate only the uncached tokens add to the time to first byte.
+
+Run with:  python bench/fake_openai.py --port 8089 --tokens 200 --rate 50
+"""
+import argparse
+import asyncio
+import json
+import os
+from collections import deque
+
+WORDS = "The quick brown fox jumps over the lazy dog while the codebase compiles".split()
+
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n".encode('utf-8')
+
+
+class FakeCompletionServer:
+    """
+    Minimal HTTP/1.1 server answering POST /v1/chat/completions with a streamed completion.
+    """
+
+    def __init__(self, tokens=200, rate=50.0, latency=0.2, prefill_rate=0.0):
+        self.tokens = tokens
+        self.rate = rate
+        self.latency = latency
+        self.prefill_rate = prefill_rate
+        self.requests = []
+        self.prompts = deque(maxlen=64)
+
+    def prompt_usage(self, body):
+        """
+        Returns (prompt_tokens, cached_tokens) for a request body, remembering its prompt for later requests.
+        """
+        try:
+            messages = json.loads(body).get('messages', [])
+        except ValueError:
+            messages = []
+        prompt = ''.join(f"<{m.get('role')}>{m.get('content')}" for m in messages)
+        shared = max((len(os.path.commonprefix([prompt, seen])) for seen in self.prompts), default=0)
+        self.prompts.append(prompt)
+        prompt_tokens, shared_tokens = len(prompt) // 4, shared // 4
+        cached_tokens = 0 if shared_tokens < 1024 else 1024 + (shared_tokens - 1024) // 128 * 128
+        return prompt_tokens, cached_tokens
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.requests.append(body)
+                await self.stream_completion(writer, *self.prompt_usage(body))
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream_completion(self, writer, prompt_tokens=0, cached_tokens=0):
+        prefill = (prompt_tokens - cached_tokens) / self.prefill_rate if self.prefill_rate > 0 else 0.0
+        await asyncio.sleep(self.latency + prefill)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        for i in range(self.tokens):
+            delta = {'content': WORDS[i % len(WORDS)] + ' '}
+            self.write_chunk(writer, sse_event({'choices': [{'index': 0, 'delta': delta}]}))
+            await writer.drain()
+            if interval:
+                await asyncio.sleep(interval)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': self.tokens,
+            'total_tokens': prompt_tokens + self.tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        }
+        self.write_chunk(writer, sse_event({'choices': [], 'usage': usage}))
+        self.write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def write_chunk(writer, data):
+        writer.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+    async def start(self, host='127.0.0.1', port=8089):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--tokens', type=int, default=200, help='tokens streamed per completion')
+    parser.add_argument('--rate', type=float, default=50.0, help='tokens per second per stream (0 = unthrottled)')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds before the first byte')
+    parser.add_argument('--prefill-rate', type=float, default=0.0,
+                        help='uncached prompt tokens processed per second before the first byte (0 = instant)')
+    args = parser.parse_args()
+    fake = FakeCompletionServer(tokens=args.tokens, rate=args.rate, latency=args.latency,
+                                prefill_rate=args.prefill_rate)
+    server = await fake.start(args.host, args.port)
+    print(f"Fake completion server listening on http://{args.host}:{args.port}/v1/chat/completions")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+"""
+Retrieval benchmark for the codebase chunk index.
+
+Consolidates a sample repository the way codecollector does ('File: <path>' headers),
+builds the CodebaseIndex, then reports index build time, retrieval latency and how
+much smaller the retrieved prompt is than the full codebase prompt.
+
+Run with:  python bench/index_retrieval.py --repo /path/to/repo --budget 8000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from codebase_index import CodebaseIndex  # noqa: E402
+
+SOURCE_EXTENSIONS = {
+    '.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.kt', '.go', '.rs', '.c', '.h', '.cpp', '.hpp',
+    '.cs', '.rb', '.php', '.swift', '.scala', '.sh', '.html', '.css', '.sql', '.md', '.toml', '.yaml', '.yml',
+}
+SKIP_DIRS = {'.git', 'node_modules', '__pycache__', '.venv', 'venv', 'build', 'dist', 'target'}
+
+DEFAULT_QUERIES = [
+    "How are database connections created and closed?",
+    "Where is the streaming response parsed and stored?",
+    "Add a retry when the HTTP request fails",
+    "Explain how tokens are counted for a message",
+    "Fix the bug in the history endpoint pagination",
+    "Which function loads the configuration file?",
+    "Add logging to the error handler",
+    "How is the title of a new chat generated?",
+]
+
+
+def consolidate(repo):
+    parts = []
+    for root, dirs, files in os.walk(repo):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for name in sorted(files):
+            if os.path.splitext(name)[1] not in SOURCE_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            except (UnicodeDecodeError, OSError):
+                continue
+            parts.append(f"File: {os.path.relpath(path, repo)}\n{text}\n")
+    return ''.join(parts)
+
+
+def make_counter(approx):
+    if approx:
+        return lambda text: max(1, len(text) // 4)
+    import tiktoken
+    encoding = tiktoken.get_encoding('cl100k_base')
+    return lambda text: len(encoding.encode_ordinary(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repo', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument('--budget', type=int, default=8000, help='retrieval token budget')
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--queries', help='file with one query per line')
+    parser.add_argument('--repeat', type=int, default=20, help='retrievals per query for latency figures')
+    parser.add_argument('--approx', action='store_true', help='approximate tokens as chars/4 (no tiktoken)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    count_text = make_counter(args.approx)
+    content = consolidate(args.repo)
+    full_tokens = count_text(content)
+
+    started = time.perf_counter()
+    index = CodebaseIndex.build(content, count_text)
+    build_time = time.perf_counter() - started
+
+    latencies = []
+    prompt_tokens = []
+    for query in queries:
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            chunks = index.select(query, args.budget, args.top_k)
+            prompt = index.render(chunks)
+            latencies.append(time.perf_counter() - started)
+        prompt_tokens.append(count_text(prompt))
+
+    latencies.sort()
+    report = {
+        'repo': os.path.abspath(args.repo),
+        'codebase_bytes': len(content.encode('utf-8')),
+        'codebase_tokens': full_tokens,
+        'chunks': len(index.chunks),
+        'terms': len(index.postings),
+        'build_seconds': build_time,
+        'retrieval_ms_p50': latencies[len(latencies) // 2] * 1000,
+        'retrieval_ms_p95': latencies[int(len(latencies) * 0.95)] * 1000,
+        'prompt_tokens_mean': statistics.mean(prompt_tokens),
+        'reduction_factor': full_tokens / statistics.mean(prompt_tokens) if prompt_tokens else None,
+        'approximate_tokens': args.approx,
+    }
+    for key, value in report.items():
+        print(f"{key:>20}: {value:.3f}" if isinstance(value, float) else f"{key:>20}: {value}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,553 @@
+"""
+End-to-end load test of Prompter against local stand-ins for OpenAI and MariaDB.
+
+Starts the fake completion server (bench/fake_openai.py) and a throwaway MariaDB
+instance in a temporary directory, writes a config.conf pointing the app at both
+and at temporary snapshot, journal and log paths, then starts the app (gunicorn,
+the Flask development server or uvicorn) with PROMPTER_CONFIG set to it.
+
+Once /readyz answers, it loads the codebase through /run_codecollector, seeds
+--chats conversations, then drives each scenario with --requests requests at
+--concurrency simultaneous clients:
+
+  run_codecollector  POST /run_codecollector and poll the job until it finishes
+  chat               streamed POST /chat continuing a seeded chat (time to first token measured)
+  count_tokens       POST /count_tokens for a draft in a seeded chat
+  history            GET /history
+
+Per scenario it reports throughput, p50/p95/p99 latency and, for chat, time to
+first token; for the run it reports startup time and the peak resident memory
+of the app's process tree. Results are written as JSON with --output, and a
+previous result given with --baseline is compared scenario by scenario; the
+exit status is 1 when a metric regressed by more than --threshold.
+
+Use --db-host (with --db-user, --db-password, --db-name) to run against an
+existing database instead of spawning one. The tokenizer encoding is cached in
+--tokenizer-cache, so only the first run needs network access.
+
+Run with:
+
+    python bench/load_test.py --server gunicorn --workers 4 --concurrency 32 \\
+        --requests 500 --output results/$(git rev-parse --short HEAD).json \\
+        --baseline results/main.json
+
+Each serving mode is compared only against baselines recorded in the same mode:
+
+    python bench/load_test.py --server asgi --workers 4 --concurrency 32 \\
+        --requests 500 --output results/$(git rev-parse --short HEAD)-asgi.json \\
+        --baseline results/main-asgi.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+from stream_capacity import percentile  # noqa: E402
+
+SCENARIOS = ('run_codecollector', 'chat', 'count_tokens', 'history')
+# Metrics compared against the baseline; higher is worse for all but throughput
+COMPARED = ('throughput', 'latency_p50', 'latency_p95', 'latency_p99', 'ttft_p50', 'ttft_p95', 'ttft_p99')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with status {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout:.0f}s")
+
+
+def spawn(args, log_path, env=None):
+    log = open(log_path, 'ab')
+    # A session of its own, so stopping it also stops the workers it forks
+    return subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, env=env, cwd=REPO_DIR,
+                            start_new_session=True)
+
+
+def stop(process, timeout=10):
+    if process is None or process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def start_mariadb(workdir, port):
+    """
+    Initializes a data directory under workdir and starts a MariaDB server on port
+    with grant tables disabled. Returns the server process.
+    """
+    install_db = shutil.which('mariadb-install-db') or shutil.which('mysql_install_db')
+    server = shutil.which('mariadbd') or shutil.which('mysqld')
+    if not install_db or not server:
+        raise RuntimeError("MariaDB binaries not found; install MariaDB or pass --db-host.")
+    datadir = os.path.join(workdir, 'mariadb')
+    user = ['--user=root'] if os.geteuid() == 0 else []
+    subprocess.run(
+        [install_db, '--no-defaults', f'--datadir={datadir}', '--auth-root-authentication-method=normal'] + user,
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    process = spawn([
+        server, '--no-defaults', f'--datadir={datadir}', f'--port={port}', '--bind-address=127.0.0.1',
+        f'--socket={os.path.join(workdir, "mariadb.sock")}', f'--pid-file={os.path.join(workdir, "mariadb.pid")}',
+        '--skip-grant-tables', '--skip-name-resolve', '--max-connections=1000',
+    ] + user, os.path.join(workdir, 'mariadb.log'))
+    wait_for_port(port, 60, process)
+    return process
+
+
+def create_database(host, port, user, password, name):
+    import mariadb
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            connection = mariadb.connect(host=host, port=port, user=user, password=password)
+            break
+        except mariadb.Error:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+    finally:
+        connection.close()
+
+
+def write_config(path, settings):
+    with open(path, 'w') as f:
+        for key, value in settings.items():
+            f.write(f"{key}={value}\n")
+
+
+def app_command(args, port):
+    if args.server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    if args.server == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi_server:app', '--port', str(port),
+                '--workers', str(args.workers), '--no-access-log']
+    return [sys.executable, '-m', 'flask', '--app', 'server', 'run', '--port', str(port), '--with-threads']
+
+
+def process_tree_rss(root_pid):
+    """
+    Returns the summed resident set size, in bytes, of root_pid and its descendants (Linux /proc).
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after its closing parenthesis
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class RssMonitor:
+    """
+    Samples the resident memory of a process tree on a background thread and keeps the peak.
+    """
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-monitor', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.peak
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._stopped.wait(self.interval)
+
+
+async def wait_ready(base_url, timeout, process):
+    start = time.perf_counter()
+    report = {}
+    async with httpx.AsyncClient(timeout=5) as client:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"App exited with status {process.returncode}; see its log.")
+            try:
+                response = await client.get(f"{base_url}/readyz")
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+                continue
+            if response.status_code == 200:
+                return time.perf_counter() - start, response.json()
+            if response.status_code != 503:
+                # 503 means still starting; anything else is a broken readiness endpoint
+                raise RuntimeError(f"/readyz answered {response.status_code}: {response.text[:500]}")
+            report = response.json()
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"App not ready after {timeout:.0f}s ({report.get('checks')}); see its log.")
+
+
+async def request_run_codecollector(client, base_url, state, i):
+    response = await client.post(f"{base_url}/run_codecollector", json={})
+    if response.status_code != 202:
+        return {'ok': False, 'status': response.status_code}
+    job_url = f"{base_url}{response.json()['status_url']}"
+    while True:
+        job = (await client.get(job_url)).json()
+        if job.get('status') == 'succeeded':
+            return {'ok': True}
+        if job.get('status') not in ('queued', 'running'):
+            return {'ok': False, 'status': job.get('status')}
+        await asyncio.sleep(0.05)
+
+
+async def request_chat(client, base_url, state, i):
+    start = time.perf_counter()
+    payload = {'message': f"Explain how module {i} handles errors."}
+    if state['chat_ids']:
+        payload['chat_id'] = random.choice(state['chat_ids'])
+    first_token = None
+    async with client.stream('POST', f"{base_url}/chat", json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {'ok': False, 'status': response.status_code}
+        async for chunk in response.aiter_bytes():
+            if first_token is None and chunk:
+                first_token = time.perf_counter() - start
+            if b'[Error]' in chunk:
+                return {'ok': False, 'status': 'stream-error'}
+    return {'ok': True, 'ttft': first_token}
+
+
+async def request_count_tokens(client, base_url, state, i):
+    payload = {'new_message': f"Draft question {i} about the request handlers and their tests."}
+    if state['chat_ids']:
+        payload['chat_id'] = random.choice(state['chat_ids'])
+    response = await client.post(f"{base_url}/count_tokens", json=payload)
+    return {'ok': response.status_code == 200, 'status': response.status_code}
+
+
+async def request_history(client, base_url, state, i):
+    response = await client.get(f"{base_url}/history")
+    return {'ok': response.status_code == 200, 'status': response.status_code}
+
+
+REQUESTS = {
+    'run_codecollector': request_run_codecollector,
+    'chat': request_chat,
+    'count_tokens': request_count_tokens,
+    'history': request_history,
+}
+
+
+async def run_scenario(base_url, name, state, total, concurrency, timeout):
+    send = REQUESTS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def one(client, i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await send(client, base_url, state, i)
+            except httpx.HTTPError as e:
+                result = {'ok': False, 'status': type(e).__name__}
+            result['latency'] = time.perf_counter() - start
+            return result
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[one(client, i) for i in range(total)])
+        wall = time.perf_counter() - start
+
+    ok = [r for r in results if r['ok']]
+    latencies = [r['latency'] for r in ok]
+    ttft = [r['ttft'] for r in ok if r.get('ttft') is not None]
+    errors = {}
+    for r in results:
+        if not r['ok']:
+            errors[str(r.get('status'))] = errors.get(str(r.get('status')), 0) + 1
+    report = {
+        'requests': total,
+        'concurrency': concurrency,
+        'ok': len(ok),
+        'errors': errors,
+        'wall_time': wall,
+        'throughput': len(ok) / wall if wall else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_p99': percentile(latencies, 99),
+    }
+    if name == 'chat':
+        report.update(ttft_p50=percentile(ttft, 50), ttft_p95=percentile(ttft, 95), ttft_p99=percentile(ttft, 99))
+    return report
+
+
+async def seed_chats(base_url, count, timeout):
+    """
+    Starts 'count' chats with one exchange each and returns their ids.
+    """
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        for i in range(count):
+            async with client.stream('POST', f"{base_url}/chat",
+                                     json={'message': f"Benchmark chat {i}: summarize the codebase."}) as response:
+                await response.aread()
+                if response.status_code != 200:
+                    raise RuntimeError(f"Seeding chat {i} failed with status {response.status_code}")
+        response = await client.get(f"{base_url}/history", params={'limit': max(count, 1)})
+        response.raise_for_status()
+        return [history['id'] for history in response.json()['histories']]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    """
+    Prints each compared metric next to its baseline value and returns the regressions beyond threshold.
+    """
+    regressions = []
+    for name, scenario in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for metric in COMPARED:
+            new, old = scenario.get(metric), before.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            worse = -change if metric == 'throughput' else change
+            flag = '  REGRESSION' if worse > threshold else ''
+            print(f"  {name:<18} {metric:<12} {old:>10.4f} -> {new:>10.4f} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append((name, metric, change))
+    old_rss, new_rss = baseline.get('peak_rss_bytes'), report.get('peak_rss_bytes')
+    if old_rss and new_rss:
+        change = (new_rss - old_rss) / old_rss
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"  {'process':<18} {'peak_rss_mb':<12} {old_rss / 2 ** 20:>10.1f} -> {new_rss / 2 ** 20:>10.1f} "
+              f"({change:+.1%}){flag}")
+        if flag:
+            regressions.append(('process', 'peak_rss_bytes', change))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('gunicorn', 'flask', 'asgi'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='app worker processes (gunicorn and asgi)')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, run in this order')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--codecollector-requests', type=int, default=5,
+                        help='requests for run_codecollector, which reloads the whole codebase each time')
+    parser.add_argument('--chats', type=int, default=20, help='chats seeded before the scenarios run')
+    parser.add_argument('--codebase', default=REPO_DIR, help='directory the app collects as its codebase')
+    parser.add_argument('--tokens', type=int, default=100, help='tokens per fake completion')
+    parser.add_argument('--rate', type=float, default=200.0, help='fake tokens per second per stream (0 = unthrottled)')
+    parser.add_argument('--latency', type=float, default=0.1, help='fake seconds before the first byte')
+    parser.add_argument('--db-host', help='use this database server instead of spawning MariaDB')
+    parser.add_argument('--db-port', type=int, default=3306)
+    parser.add_argument('--db-user', default='root')
+    parser.add_argument('--db-password', default='bench',
+                        help='any value works against the spawned server, which skips authentication')
+    parser.add_argument('--db-name', default='prompter_bench')
+    parser.add_argument('--tokenizer-cache', default=os.path.expanduser('~/.cache/prompter-bench/tiktoken'))
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra config.conf setting for the app, repeatable')
+    parser.add_argument('--ready-timeout', type=float, default=120.0)
+    parser.add_argument('--timeout', type=float, default=120.0, help='per-request timeout')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative change against the baseline reported as a regression')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory with logs and data')
+    return parser.parse_args()
+
+
+async def run(args, workdir, processes):
+    fake_port = free_port()
+    processes['fake_openai'] = spawn([
+        sys.executable, os.path.join(BENCH_DIR, 'fake_openai.py'), '--port', str(fake_port),
+        '--tokens', str(args.tokens), '--rate', str(args.rate), '--latency', str(args.latency),
+    ], os.path.join(workdir, 'fake_openai.log'))
+    wait_for_port(fake_port, 10, processes['fake_openai'])
+
+    if args.db_host:
+        db_host, db_port = args.db_host, args.db_port
+    else:
+        db_host, db_port = '127.0.0.1', free_port()
+        processes['mariadb'] = start_mariadb(workdir, db_port)
+    create_database(db_host, db_port, args.db_user, args.db_password, args.db_name)
+
+    os.makedirs(args.tokenizer_cache, exist_ok=True)
+    settings = {
+        'api_key': 'bench',
+        'api_base_url': f'http://127.0.0.1:{fake_port}/v1',
+        'db_host': db_host,
+        'db_port': db_port,
+        'db_user': args.db_user,
+        'db_password': args.db_password,
+        'db_name': args.db_name,
+        'collector_mode': 'native',
+        'codecollector_directory': os.path.abspath(args.codebase),
+        'codecollector_output': os.path.join(workdir, 'codebase.prompt'),
+        'collector_manifest': os.path.join(workdir, 'codebase.manifest.json'),
+        'snapshot_dir': os.path.join(workdir, 'snapshots'),
+        'message_journal': os.path.join(workdir, 'messages.journal'),
+        'response_cache_path': os.path.join(workdir, 'responses.sqlite'),
+        'metrics_dir': os.path.join(workdir, 'metrics'),
+        'tokenizer_cache_dir': args.tokenizer_cache,
+        'log_file': os.path.join(workdir, 'app.log'),
+        'log_level': 'WARNING',
+    }
+    for setting in args.set:
+        key, _, value = setting.partition('=')
+        settings[key.strip()] = value.strip()
+    config_path = os.path.join(workdir, 'config.conf')
+    write_config(config_path, settings)
+
+    app_port = free_port()
+    env = dict(os.environ, PROMPTER_CONFIG=config_path, PROMPTER_BIND=f'127.0.0.1:{app_port}',
+               PROMPTER_WORKERS=str(args.workers), PROMPTER_THREADS=str(args.threads))
+    base_url = f'http://127.0.0.1:{app_port}'
+    processes['app'] = spawn(app_command(args, app_port), os.path.join(workdir, 'server.log'), env)
+    monitor = RssMonitor(processes['app'].pid).start()
+    try:
+        startup_seconds, readiness = await wait_ready(base_url, args.ready_timeout, processes['app'])
+        print(f"App ready after {startup_seconds:.2f}s ({args.server}, {args.workers} workers)")
+
+        scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise RuntimeError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        state = {'chat_ids': []}
+        # Chats and token counts need a codebase snapshot; load one unless the scenario measures it
+        if 'run_codecollector' not in scenarios:
+            await run_scenario(base_url, 'run_codecollector', state, 1, 1, args.timeout)
+        results = {}
+        for name in scenarios:
+            if name != 'run_codecollector' and not state['chat_ids'] and args.chats:
+                state['chat_ids'] = await seed_chats(base_url, args.chats, args.timeout)
+            total = args.codecollector_requests if name == 'run_codecollector' else args.requests
+            concurrency = min(args.concurrency, total)
+            results[name] = await run_scenario(base_url, name, state, total, concurrency, args.timeout)
+            result = results[name]
+            print(f"{name:>18}: {result['ok']}/{total} ok, {result['throughput']:.1f} req/s, "
+                  f"p50={result['latency_p50']} p95={result['latency_p95']} p99={result['latency_p99']}"
+                  + (f" ttft_p95={result['ttft_p95']}" if 'ttft_p95' in result else ''))
+    finally:
+        peak_rss = monitor.stop()
+
+    return {
+        'version': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'settings': {
+            'server': args.server, 'workers': args.workers, 'threads': args.threads,
+            'concurrency': args.concurrency, 'requests': args.requests, 'chats': args.chats,
+            'fake_tokens': args.tokens, 'fake_rate': args.rate, 'fake_latency': args.latency,
+            'database': 'external' if args.db_host else 'spawned',
+        },
+        'startup_seconds': startup_seconds,
+        'startup': readiness,
+        'peak_rss_bytes': peak_rss,
+        'scenarios': results,
+    }
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='prompter-bench-')
+    processes = {}
+    try:
+        report = asyncio.run(run(args, workdir, processes))
+    finally:
+        for name in ('app', 'fake_openai', 'mariadb'):
+            stop(processes.get(name))
+        if args.keep:
+            print(f"Logs and data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Peak RSS of the app: {report['peak_rss_bytes'] / 2 ** 20:.1f} MiB")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        settings = {key: baseline.get('settings', {}).get(key) for key in ('server', 'workers', 'concurrency')}
+        current = {key: report['settings'][key] for key in settings}
+        if settings != current:
+            # Sync and async modes differ by design; comparing them would report noise as regressions
+            print(f"Baseline {args.baseline} was run with {settings}, this run with {current}; not comparing.")
+            sys.exit(2)
+        print(f"Compared with {args.baseline} ({baseline.get('version') or 'unknown version'}):")
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
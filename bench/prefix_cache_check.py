@@ -0,0 +1,182 @@
+"""
+Verifies the prompt-prefix caching layout against the local stand-in server.
+
+Plays a multi-turn chat over a large codebase prompt through ContextBudgeter and
+CompletionClient, once per prompt layout, against bench/fake_openai.py with prompt
+caching and prefill latency simulated. Checks that every request body starts with
+the byte-identical codebase prefix, and reports the bytes shared with the previous
+turn, the cached tokens reported in usage and time to first token.
+
+The two layouts only differ once older turns no longer fit, so by default the
+context window leaves --history-room tokens beside the codebase and history starts
+being dropped after a few turns. From then on the 'default' layout puts the changing
+summary right after the codebase, while 'prefix_cache' keeps the history in place.
+
+Exits non-zero if the 'prefix_cache' layout does not keep the prefix byte-identical,
+the stand-in reports no cached tokens after the first turn, or, once history is
+dropped, 'prefix_cache' does not share more bytes with the previous request beyond
+the codebase prefix than 'default' does.
+
+Run with:  python bench/prefix_cache_check.py --turns 12 --approx
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_openai import FakeCompletionServer  # noqa: E402
+from index_retrieval import consolidate  # noqa: E402
+from completion_client import CompletionClient  # noqa: E402
+from context_budget import ContextBudgeter  # noqa: E402
+from token_ledger import TokenLedger  # noqa: E402
+
+CODEBASE_PROMPT_PREFIX = "You have access to the following codebase:\n\n"  # as server.LoadedCodebase builds it
+MODEL = 'gpt-4o'
+RESERVED_OUTPUT = 1024
+
+
+class ApproxLedger(TokenLedger):
+    """
+    TokenLedger counting ~4 characters per token, for machines without tiktoken encodings.
+    """
+
+    def count_text(self, text):
+        return len(text) // 4
+
+
+def start_fake_server(port, prefill_rate, tokens):
+    fake = FakeCompletionServer(tokens=tokens, rate=0, latency=0.01, prefill_rate=prefill_rate)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(fake.start(port=port))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return fake
+
+
+def common_prefix(a, b):
+    return len(os.path.commonprefix([a, b]))
+
+
+def play_chat(layout, args, ledger, codebase_prompt, port):
+    fake = start_fake_server(port, args.prefill_rate, args.answer_tokens)
+    client = CompletionClient('test-key', base_url=f'http://127.0.0.1:{port}/v1', max_retries=0)
+    budgeter = ContextBudgeter(
+        ledger, args.context_window, reserved_output=RESERVED_OUTPUT, codebase_share=1.0, summary_tokens=256,
+        codebase_mode='full', prompt_layout=layout, history_drop_block=args.drop_block
+    )
+    prefix_message = {"role": "assistant", "content": codebase_prompt}
+    history, contents = [], {}
+    turns = []
+    for turn in range(args.turns):
+        draft = f"Question {turn}: how does the code handle case number {turn}? " + "Explain in detail. " * 40
+        plan = budgeter.plan(codebase_prompt, history, draft)
+        if plan['dropped_ids']:
+            snippets = [contents[i]['content'][:200] for i in plan['dropped_ids'] if contents[i]['role'] == 'user']
+            budgeter.add_summary(plan, snippets)
+        history_messages = [contents[i] for i in plan['included_ids']]
+        messages = budgeter.build_messages(plan, history_messages, draft, prefix_message)
+        completion = client.stream_chat({"model": MODEL, "messages": messages, "max_tokens": 1024, "stream": True})
+        answer = ''.join(completion.iter_deltas())
+        turns.append({
+            'turn': turn,
+            'history_included': plan['breakdown']['history_included'],
+            'history_dropped': plan['breakdown']['history_dropped'],
+            'summary': bool(plan['summary']),
+            'ttft': completion.timing['ttft'],
+            'prompt_tokens': completion.timing['prompt_tokens'],
+            'cached_tokens': completion.timing['cached_tokens'],
+        })
+        for role, content in (('user', draft), ('assistant', answer)):
+            message_id = len(contents) + 1
+            contents[message_id] = {"role": role, "content": content}
+            history.append({'id': message_id, 'role': role, 'content_tokens': ledger.count_text(content)})
+
+    expected_prefix = json.dumps({"model": MODEL, "messages": [prefix_message]})[:-2].encode('utf-8')
+    bodies = fake.requests
+    for entry, body, previous in zip(turns, bodies, [None] + bodies[:-1]):
+        entry['prefix_identical'] = body.startswith(expected_prefix)
+        entry['shared_bytes'] = common_prefix(body, previous) if previous else 0
+    later = turns[1:]
+    dropping = [entry for entry in later if entry['history_dropped']]
+    return {
+        'layout': layout,
+        'prefix_bytes': len(expected_prefix),
+        'prefix_identical': all(entry['prefix_identical'] for entry in turns),
+        'shared_beyond_prefix_mean': statistics.mean(
+            max(0, entry['shared_bytes'] - len(expected_prefix)) for entry in later
+        ) if later else 0,
+        'turns_dropping_history': len(dropping),
+        'shared_beyond_prefix_dropping_mean': statistics.mean(
+            max(0, entry['shared_bytes'] - len(expected_prefix)) for entry in dropping
+        ) if dropping else 0,
+        'cached_ratio': sum(e['cached_tokens'] or 0 for e in later) / max(1, sum(e['prompt_tokens'] or 0 for e in later)),
+        'ttft_first': turns[0]['ttft'],
+        'ttft_later_p50': statistics.median(e['ttft'] for e in later) if later else None,
+        'turns': turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repo', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument('--turns', type=int, default=12)
+    parser.add_argument('--context-window', type=int,
+                        help='model context window (default: the codebase plus --history-room)')
+    parser.add_argument('--history-room', type=int, default=3000,
+                        help='tokens left for history and the draft when --context-window is not given')
+    parser.add_argument('--drop-block', type=int, default=4, help="history_drop_block of the 'prefix_cache' layout")
+    parser.add_argument('--answer-tokens', type=int, default=300, help='deltas per streamed answer')
+    parser.add_argument('--prefill-rate', type=float, default=50000, help='simulated uncached prompt tokens/s')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--approx', action='store_true', help='approximate tokens as chars/4 (no tiktoken)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    ledger = ApproxLedger(MODEL) if args.approx else TokenLedger(MODEL)
+    codebase_prompt = CODEBASE_PROMPT_PREFIX + consolidate(args.repo)
+    if args.context_window is None:
+        codebase_tokens = ledger.message_tokens('assistant', ledger.prompt_tokens(codebase_prompt))
+        args.context_window = codebase_tokens + args.history_room + RESERVED_OUTPUT
+    reports = [
+        play_chat(layout, args, ledger, codebase_prompt, args.port + offset)
+        for offset, layout in enumerate(('default', 'prefix_cache'))
+    ]
+    for report in reports:
+        print(f"[{report['layout']}]")
+        for key, value in report.items():
+            if key not in ('layout', 'turns'):
+                print(f"{key:>34}: {value:.3f}" if isinstance(value, float) else f"{key:>34}: {value}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+    default_layout, prefix_layout = reports
+    if not prefix_layout['prefix_identical'] or (args.turns > 1 and prefix_layout['cached_ratio'] == 0):
+        print("FAIL: prompt prefix is not stable across turns.")
+        sys.exit(1)
+    if not prefix_layout['turns_dropping_history']:
+        print("OK: prompt prefix is byte-identical across turns. No history was dropped, so the layouts "
+              "were not compared; lower --history-room or add --turns.")
+        return
+    if prefix_layout['shared_beyond_prefix_dropping_mean'] <= default_layout['shared_beyond_prefix_dropping_mean']:
+        print("FAIL: the 'prefix_cache' layout shares no more of the previous request than 'default' "
+              "once history is dropped.")
+        sys.exit(1)
+    print("OK: prompt prefix is byte-identical across turns, and 'prefix_cache' keeps more of the previous "
+          "request stable than 'default' once history is dropped.")
+
+
+if __name__ == '__main__':
+    main()
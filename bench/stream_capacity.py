@@ -0,0 +1,132 @@
+"""
+Concurrent-stream capacity benchmark for the sync (Flask) and async (ASGI) serving modes.
+
+Starts the local fake completion server, then opens increasing numbers of
+simultaneous /chat streams against each target and reports how many complete,
+time to first byte and stream duration at every concurrency level.
+
+Both apps must be configured with api_base_url pointing at the fake server, e.g.
+
+    python server.py                                  # sync mode on :5000
+    uvicorn asgi_server:app --port 5001               # async mode on :5001
+    python bench/stream_capacity.py --target sync=http://127.0.0.1:5000 \\
+        --target async=http://127.0.0.1:5001 --levels 10,50,100,200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_openai import FakeCompletionServer  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def one_stream(client, base_url, message):
+    start = time.perf_counter()
+    first_byte = None
+    try:
+        async with client.stream('POST', f"{base_url}/chat", json={'message': message}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return {'ok': False, 'status': response.status_code}
+            async for chunk in response.aiter_bytes():
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter() - start
+                if b'[Error]' in chunk:
+                    return {'ok': False, 'status': 'stream-error'}
+    except httpx.HTTPError as e:
+        return {'ok': False, 'status': type(e).__name__}
+    return {'ok': True, 'ttfb': first_byte, 'duration': time.perf_counter() - start}
+
+
+async def run_level(base_url, concurrency, timeout):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            one_stream(client, base_url, f"benchmark question {i}") for i in range(concurrency)
+        ])
+        wall = time.perf_counter() - start
+    ok = [r for r in results if r['ok']]
+    ttfb = [r['ttfb'] for r in ok if r['ttfb'] is not None]
+    durations = [r['duration'] for r in ok]
+    return {
+        'concurrency': concurrency,
+        'completed': len(ok),
+        'failed': len(results) - len(ok),
+        'wall_time': wall,
+        'ttfb_p50': percentile(ttfb, 50),
+        'ttfb_p95': percentile(ttfb, 95),
+        'duration_p50': statistics.median(durations) if durations else None,
+        'duration_p95': percentile(durations, 95),
+    }
+
+
+def capacity(levels, ideal_duration, slowdown):
+    """
+    Highest concurrency level at which every stream completed within 'slowdown' times the ideal duration.
+    """
+    best = 0
+    for level in levels:
+        if level['failed'] == 0 and level['duration_p95'] is not None \
+                and level['duration_p95'] <= ideal_duration * slowdown:
+            best = max(best, level['concurrency'])
+    return best
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, help='label=base_url of a running app')
+    parser.add_argument('--levels', default='10,50,100,200', help='comma separated concurrency levels')
+    parser.add_argument('--fake-port', type=int, default=8089)
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=50.0)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--slowdown', type=float, default=1.5,
+                        help='p95 stream duration allowed relative to an uncontended stream')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    fake = FakeCompletionServer(tokens=args.tokens, rate=args.rate, latency=args.latency)
+    server = await fake.start(port=args.fake_port)
+    ideal_duration = args.latency + args.tokens / args.rate if args.rate > 0 else args.latency
+    levels = [int(level) for level in args.levels.split(',')]
+
+    report = {'ideal_duration': ideal_duration, 'targets': {}}
+    async with server:
+        for target in args.target:
+            label, _, base_url = target.partition('=')
+            results = []
+            for level in levels:
+                result = await run_level(base_url.rstrip('/'), level, args.timeout)
+                results.append(result)
+                print(f"{label:>8} c={level:<5} completed={result['completed']:<5} failed={result['failed']:<5} "
+                      f"ttfb_p95={result['ttfb_p95']} duration_p95={result['duration_p95']}")
+            report['targets'][label] = {
+                'levels': results,
+                'capacity': capacity(results, ideal_duration, args.slowdown),
+            }
+
+    for label, data in report['targets'].items():
+        print(f"{label}: sustained {data['capacity']} concurrent streams")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
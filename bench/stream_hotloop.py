@@ -0,0 +1,183 @@
+"""
+Micro-benchmark of the /chat streaming hot loop.
+
+Replays a recorded completion stream (server-sent event lines, e.g. captured with
+'curl -N' from the API or bench/fake_openai.py) through the previous per-delta loop
+and through the current pipeline, writing the client output to /dev/null, and
+reports per-chunk overhead, client writes and the resulting output token counts.
+
+  before: parse each line, 'bot_response += delta', encode every delta, one write per delta
+  after:  CompletionStream parsing, list buffer, coalesced writes, usage field or one encode
+
+Run with:  python bench/stream_hotloop.py --tokens 2000
+           python bench/stream_hotloop.py --stream recorded.sse --flush-interval 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_openai import WORDS  # noqa: E402
+from completion_client import CompletionStream, CompletionTimings, coalesce_deltas  # noqa: E402
+
+
+class ReplayedResponse:
+    """
+    Stands in for a streaming requests.Response, yielding recorded lines at an optional rate.
+    """
+
+    status_code = 200
+
+    def __init__(self, lines, rate=0.0):
+        self.lines = lines
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+
+    def iter_lines(self):
+        for line in self.lines:
+            if self.interval:
+                time.sleep(self.interval)
+            yield line
+
+    def close(self):
+        pass
+
+
+def synthesize_stream(tokens, with_usage=True):
+    lines = []
+    for i in range(tokens):
+        event = {'choices': [{'index': 0, 'delta': {'content': WORDS[i % len(WORDS)] + ' '}}]}
+        lines += [f"data: {json.dumps(event)}".encode('utf-8'), b'']
+    if with_usage:
+        usage = {'prompt_tokens': 0, 'completion_tokens': tokens, 'total_tokens': tokens}
+        lines += [f"data: {json.dumps({'choices': [], 'usage': usage})}".encode('utf-8'), b'']
+    lines.append(b'data: [DONE]')
+    return lines
+
+
+def load_stream(path):
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\r\n') for line in f]
+
+
+def make_encoder(approx):
+    if approx:
+        class Approx:
+            @staticmethod
+            def encode(text):
+                return range(max(1, len(text) // 4))
+        return Approx()
+    import tiktoken
+    return tiktoken.get_encoding('cl100k_base')
+
+
+def loop_before(lines, encoding, out_fd, rate):
+    """
+    The previous generate_and_store loop.
+    """
+    bot_response = ""
+    output_token_count = 0
+    writes = 0
+    for line in ReplayedResponse(lines, rate).iter_lines():
+        if not line:
+            continue
+        chunk = line.decode('utf-8')
+        if chunk.startswith('data: '):
+            chunk = chunk[len('data: '):]
+        if chunk == '[DONE]':
+            break
+        data = json.loads(chunk)
+        delta = data['choices'][0]['delta'].get('content', '') if data.get('choices') else ''
+        os.write(out_fd, delta.encode('utf-8'))
+        writes += 1
+        if delta:
+            bot_response += delta
+            output_token_count += len(encoding.encode(delta))
+    return bot_response, output_token_count, writes
+
+
+def loop_after(lines, encoding, out_fd, rate, flush_interval, flush_chars):
+    """
+    The current generate_and_store loop.
+    """
+    completion = CompletionStream(ReplayedResponse(lines, rate), time.perf_counter(), 0.0, 0, CompletionTimings())
+    parts = []
+    writes = 0
+    for text in coalesce_deltas(completion.iter_deltas(), flush_interval, flush_chars):
+        parts.append(text)
+        os.write(out_fd, text.encode('utf-8'))
+        writes += 1
+    bot_response = ''.join(parts)
+    output_token_count = completion.completion_tokens() or len(encoding.encode(bot_response))
+    return bot_response, output_token_count, writes
+
+
+def measure(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stream', help='recorded SSE stream to replay (default: synthesized)')
+    parser.add_argument('--save', help='write the synthesized stream to this file and exit')
+    parser.add_argument('--tokens', type=int, default=2000, help='deltas in the synthesized stream')
+    parser.add_argument('--no-usage', action='store_true', help='synthesize a stream without a usage chunk')
+    parser.add_argument('--rate', type=float, default=0.0, help='replay lines per second (0 = as fast as possible)')
+    parser.add_argument('--flush-interval', type=float, default=0.05)
+    parser.add_argument('--flush-chars', type=int, default=512)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--approx', action='store_true', help='approximate tokens as chars/4 (no tiktoken)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    lines = load_stream(args.stream) if args.stream else synthesize_stream(args.tokens, not args.no_usage)
+    if args.save:
+        with open(args.save, 'wb') as f:
+            f.write(b'\n'.join(lines) + b'\n')
+        return
+    chunks = sum(1 for line in lines if line and line != b'data: [DONE]')
+    encoding = make_encoder(args.approx)
+    repeat = 1 if args.rate else args.repeat
+
+    out_fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        before_time, (before_text, before_tokens, before_writes) = measure(
+            lambda: loop_before(lines, encoding, out_fd, args.rate), repeat
+        )
+        after_time, (after_text, after_tokens, after_writes) = measure(
+            lambda: loop_after(lines, encoding, out_fd, args.rate, args.flush_interval, args.flush_chars), repeat
+        )
+    finally:
+        os.close(out_fd)
+
+    report = {
+        'chunks': chunks,
+        'response_chars': len(after_text),
+        'identical_output': before_text == after_text,
+        'before_us_per_chunk': before_time / chunks * 1e6,
+        'after_us_per_chunk': after_time / chunks * 1e6,
+        'speedup': before_time / after_time if after_time else None,
+        'before_writes': before_writes,
+        'after_writes': after_writes,
+        'before_output_tokens': before_tokens,
+        'after_output_tokens': after_tokens,
+        'whole_text_tokens': len(encoding.encode(after_text)),
+        'approximate_tokens': args.approx,
+    }
+    for key, value in report.items():
+        print(f"{key:>22}: {value:.3f}" if isinstance(value, float) else f"{key:>22}: {value}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
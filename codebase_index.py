@@ -0,0 +1,173 @@
+import logging
+import math
+import re
+import time
+from collections import Counter, defaultdict
+
+logger = logging.getLogger('PrompterApp')
+
+# Lines that start a new file in the consolidated codebase prompt.
+FILE_HEADER_PATTERNS = [
+    r'^(?:#+\s*|//\s*)?(?:File|Path|Filename)\s*:\s*(?P<path>\S.*?)\s*$',
+    r'^[=\-#]{3,}\s*(?P<path>[\w./\\-]+\.\w+)\s*[=\-#]{3,}$',
+    r'^<file path="(?P<path>[^"]+)">\s*$',
+]
+
+# Top-level definitions that start a new symbol chunk inside a large file.
+SYMBOL_PATTERN = re.compile(
+    r'^(?:async\s+def|def|class|function|async\s+function|export\s+(?:default\s+)?(?:async\s+)?(?:function|class|const)'
+    r'|(?:public|private|protected)\s+(?:static\s+)?[\w<>\[\]]+\s+\w+\s*\(|fun|func|fn|impl|struct|interface|enum)\b'
+)
+
+TOKEN_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|\d+')
+CAMEL_PATTERN = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'for', 'from', 'how', 'i', 'if', 'in',
+    'is', 'it', 'me', 'my', 'of', 'on', 'or', 'please', 'so', 'that', 'the', 'this', 'to', 'what', 'with',
+    'you', 'your', 'self', 'return', 'import', 'none', 'true', 'false',
+}
+
+SELECTION_HEADER = "You have access to the following excerpts of the codebase, selected for relevance:\n\n"
+
+
+def lexical_terms(text):
+    """
+    Splits text into lowercase search terms. Identifiers are indexed whole and by their
+    snake_case / camelCase parts, so 'count_tokens' and 'countTokens' both match 'tokens'.
+    """
+    terms = []
+    for word in TOKEN_PATTERN.findall(text):
+        lower = word.lower()
+        if lower not in STOPWORDS and len(lower) > 1:
+            terms.append(lower)
+        parts = [p.lower() for piece in word.split('_') for p in CAMEL_PATTERN.findall(piece)]
+        if len(parts) > 1:
+            terms.extend(p for p in parts if p not in STOPWORDS and len(p) > 1)
+    return terms
+
+
+def split_files(content, header_patterns=None):
+    """
+    Splits a consolidated codebase prompt into (path, text) pairs using its file header lines.
+    Falls back to a single unnamed file when no headers are recognised.
+    """
+    patterns = [re.compile(p, re.IGNORECASE) for p in (header_patterns or FILE_HEADER_PATTERNS)]
+    files = []
+    path = None
+    lines = []
+    for line in content.splitlines(keepends=True):
+        match = None
+        for pattern in patterns:
+            match = pattern.match(line.rstrip('\r\n'))
+            if match:
+                break
+        if match:
+            if lines and (path is not None or ''.join(lines).strip()):
+                files.append((path or '(preamble)', ''.join(lines)))
+            path = match.group('path')
+            lines = []
+        else:
+            lines.append(line)
+    if lines:
+        files.append((path or '(codebase)', ''.join(lines)))
+    return files
+
+
+def split_symbols(text, max_lines=80, window_lines=200):
+    """
+    Splits a file into chunks at top-level definitions when it is longer than max_lines.
+    Chunks longer than window_lines are further cut into fixed windows.
+    """
+    lines = text.splitlines(keepends=True)
+    if len(lines) <= max_lines:
+        return [(1, text)]
+    starts = [0] + [i for i, line in enumerate(lines) if i > 0 and SYMBOL_PATTERN.match(line)]
+    chunks = []
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        for window_start in range(start, end, window_lines):
+            window_end = min(end, window_start + window_lines)
+            chunk = ''.join(lines[window_start:window_end])
+            if chunk.strip():
+                chunks.append((window_start + 1, chunk))
+    return chunks
+
+
+class CodebaseIndex:
+    """
+    BM25 index over per-file and per-symbol chunks of a consolidated codebase prompt.
+
+    Built once when a codebase is loaded; select() then returns the chunks most relevant
+    to a query within a token budget, with no network access required.
+    """
+
+    def __init__(self, chunks, k1=1.2, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for position, chunk in enumerate(chunks):
+            terms = Counter(lexical_terms(chunk['path'] + '\n' + chunk['text']))
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings[term].append((position, frequency))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        count = len(chunks)
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    @classmethod
+    def build(cls, content, count_text, header_patterns=None, max_lines=80):
+        """
+        Chunks and indexes a codebase prompt. count_text(text) supplies token counts per chunk.
+        """
+        started = time.perf_counter()
+        chunks = []
+        for path, text in split_files(content, header_patterns):
+            for line, chunk_text in split_symbols(text, max_lines=max_lines):
+                rendered = f"File: {path} (line {line})\n{chunk_text.rstrip()}\n"
+                chunks.append({'path': path, 'line': line, 'text': rendered, 'tokens': count_text(rendered)})
+        index = cls(chunks)
+        logger.info(
+            "Indexed codebase into %s chunks (%s terms) in %.2fs.",
+            len(chunks), len(index.postings), time.perf_counter() - started
+        )
+        return index
+
+    def search(self, query, top_k=20):
+        """
+        Returns up to top_k (score, position) pairs for the query, best first.
+        """
+        scores = defaultdict(float)
+        for term, query_frequency in Counter(lexical_terms(query)).items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / (self.average_length or 1))
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm) * min(query_frequency, 3)
+        return sorted(((score, position) for position, score in scores.items()), reverse=True)[:top_k]
+
+    def select(self, query, max_tokens, top_k=20):
+        """
+        Returns the most relevant chunks that fit in max_tokens, in codebase order.
+        Falls back to the leading chunks when nothing in the query matches.
+        """
+        ranked = [position for _, position in self.search(query, top_k)]
+        if not ranked:
+            ranked = list(range(len(self.chunks)))
+        selected = []
+        used = 0
+        for position in ranked:
+            tokens = self.chunks[position]['tokens'] + 1
+            if used + tokens > max_tokens:
+                continue
+            selected.append(position)
+            used += tokens
+        return [self.chunks[position] for position in sorted(selected)]
+
+    @staticmethod
+    def render(chunks):
+        return SELECTION_HEADER + '\n'.join(chunk['text'] for chunk in chunks)
@@ -0,0 +1,318 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('PrompterApp')
+
+
+class CodebaseJob:
+    """
+    A background codebase load. 'progress' is updated by the job while it runs.
+    """
+
+    def __init__(self, workspace, directory, store=None):
+        self.id = uuid.uuid4().hex
+        self.workspace = workspace
+        self.directory = directory
+        self.store = store
+        self.on_update = None
+        self.status = 'queued'
+        self.progress = {'files_scanned': 0, 'bytes': 0, 'tokens': None}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def chat_ids(self):
+        """
+        Ids of the chats to pin to this job's snapshot, including those of coalesced requests.
+        """
+        return self.store.chat_ids(self.id) if self.store else set()
+
+    def update(self, **progress):
+        self.progress = dict(self.progress, **progress)
+        if self.on_update:
+            self.on_update(self)
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            'job_id': self.id,
+            'workspace': self.workspace,
+            'directory': self.directory,
+            'status': self.status,
+            'progress': dict(self.progress, elapsed=end - (self.started_at or end)),
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class MemoryJobStore:
+    """
+    Keeps job state in this process. Suitable when a single process serves the app.
+    """
+
+    def __init__(self, retention=3600):
+        self.retention = retention
+        self._jobs = {}
+        self._active = {}
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def claim(self, job):
+        """
+        Registers job as the active load of its workspace's directory. Returns None on success,
+        or the state of the job already loading the directory for the workspace.
+        """
+        with self._lock:
+            self._expire()
+            active = self._active.get((job.workspace, job.directory))
+            if active is not None and active.active:
+                return active.to_dict()
+            self._jobs[job.id] = job
+            self._active[(job.workspace, job.directory)] = job
+            return None
+
+    def add_chat(self, job_id, chat_id):
+        with self._lock:
+            self._chats.setdefault(job_id, set()).add(chat_id)
+
+    def chat_ids(self, job_id):
+        with self._lock:
+            return set(self._chats.get(job_id, ()))
+
+    def save(self, job):
+        with self._lock:
+            if not job.active and self._active.get((job.workspace, job.directory)) is job:
+                del self._active[(job.workspace, job.directory)]
+
+    def load(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if not job.active and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+            self._chats.pop(job_id, None)
+
+
+class DatabaseJobStore:
+    """
+    Keeps job state in the codebase_jobs table, so every worker process can report on,
+    and coalesce into, loads started by any other.
+
+    While a job is queued or running its row holds an 'active_key' derived from the
+    workspace and directory under a unique index; a second claim for the same pair fails
+    on that index and is coalesced into the existing job. Running jobs heartbeat 'updated_at'; a job
+    whose worker stopped updating it for 'stale_after' seconds is marked failed.
+    """
+
+    def __init__(self, connect, integrity_error, retention=3600, stale_after=300):
+        self.connect = connect
+        self.integrity_error = integrity_error
+        self.retention = retention
+        self.stale_after = stale_after
+
+    def claim(self, job):
+        now = time.time()
+        for _ in range(2):
+            connection = self.connect()
+            cursor = connection.cursor()
+            try:
+                cursor.execute(
+                    "UPDATE codebase_jobs SET status = 'failed', error = 'Worker stopped responding.', "
+                    "active_key = NULL, finished_at = ? WHERE active_key IS NOT NULL AND updated_at < ?",
+                    (now, now - self.stale_after)
+                )
+                cursor.execute("DELETE FROM codebase_jobs WHERE finished_at < ?", (now - self.retention,))
+                connection.commit()
+                try:
+                    cursor.execute(
+                        "INSERT INTO codebase_jobs (id, workspace, directory, active_key, status, progress, chat_ids, "
+                        "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job.id, job.workspace, job.directory, self._active_key(job.workspace, job.directory), job.status,
+                         json.dumps(job.progress), '[]', job.created_at, now)
+                    )
+                    connection.commit()
+                    return None
+                except self.integrity_error:
+                    connection.rollback()
+                cursor.execute(
+                    f"SELECT {self.COLUMNS} FROM codebase_jobs WHERE active_key = ?",
+                    (self._active_key(job.workspace, job.directory),)
+                )
+                row = cursor.fetchone()
+                if row is not None:
+                    return self._row_to_dict(row)
+            finally:
+                cursor.close()
+                connection.close()
+        raise RuntimeError(f"Could not claim a codebase load of '{job.directory}'.")
+
+    def add_chat(self, job_id, chat_id):
+        connection = self.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT chat_ids FROM codebase_jobs WHERE id = ? FOR UPDATE", (job_id,))
+            row = cursor.fetchone()
+            if row is not None:
+                chat_ids = set(json.loads(row[0] or '[]')) | {chat_id}
+                cursor.execute(
+                    "UPDATE codebase_jobs SET chat_ids = ? WHERE id = ?", (json.dumps(sorted(chat_ids)), job_id)
+                )
+            connection.commit()
+        finally:
+            cursor.close()
+            connection.close()
+
+    def chat_ids(self, job_id):
+        connection = self.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT chat_ids FROM codebase_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return set(json.loads(row[0] or '[]')) if row else set()
+        finally:
+            cursor.close()
+            connection.close()
+
+    def save(self, job):
+        connection = self.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "UPDATE codebase_jobs SET status = ?, progress = ?, result = ?, error = ?, started_at = ?, "
+                "finished_at = ?, updated_at = ?, active_key = IF(?, active_key, NULL) WHERE id = ?",
+                (job.status, json.dumps(job.progress), json.dumps(job.result), job.error, job.started_at,
+                 job.finished_at, time.time(), job.active, job.id)
+            )
+            connection.commit()
+        finally:
+            cursor.close()
+            connection.close()
+
+    def load(self, job_id):
+        connection = self.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"SELECT {self.COLUMNS} FROM codebase_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return self._row_to_dict(row) if row else None
+        finally:
+            cursor.close()
+            connection.close()
+
+    COLUMNS = 'id, workspace, directory, status, progress, result, error, created_at, started_at, finished_at'
+
+    @staticmethod
+    def _active_key(workspace, directory):
+        return hashlib.sha256(f"{workspace}\0{directory}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _row_to_dict(row):
+        job_id, workspace, directory, status, progress, result, error, created_at, started_at, finished_at = row
+        end = finished_at or time.time()
+        return {
+            'job_id': job_id,
+            'workspace': workspace,
+            'directory': directory,
+            'status': status,
+            'progress': dict(json.loads(progress or '{}'), elapsed=end - (started_at or end)),
+            'result': json.loads(result) if result else None,
+            'error': error,
+            'created_at': created_at,
+            'finished_at': finished_at,
+        }
+
+
+class CodebaseJobManager:
+    """
+    Runs codebase loads on background threads.
+
+    Requests to load a workspace whose directory already has a queued or running job
+    for that workspace are coalesced into that job. Workspaces sharing a directory get
+    jobs of their own, since each job installs its snapshot for one workspace. Job state lives in 'store' (MemoryJobStore by default),
+    so finished jobs can still be read for the store's retention period.
+    """
+
+    def __init__(self, run_job, store=None, save_interval=0.5, heartbeat=30):
+        self.run_job = run_job
+        self.store = store or MemoryJobStore()
+        self.save_interval = save_interval
+        self.heartbeat = heartbeat
+        self._last_saved = {}
+
+    def submit(self, workspace, directory, chat_id=None):
+        """
+        Starts a load of a workspace directory, or joins the job already loading it.
+        chat_id, if given, is recorded on the job for pinning to the result.
+        Returns (job state dict, coalesced).
+        """
+        job = CodebaseJob(workspace, directory, store=self.store)
+        active = self.store.claim(job)
+        if active is not None:
+            if chat_id:
+                self.store.add_chat(active['job_id'], chat_id)
+            logger.info("Coalesced codebase load of '%s' for workspace '%s' into job %s.",
+                        directory, workspace, active['job_id'])
+            return active, True
+        if chat_id:
+            self.store.add_chat(job.id, chat_id)
+        job.on_update = self._save_throttled
+        threading.Thread(target=self._run, args=(job,), name=f'codebase-job-{job.id[:8]}', daemon=True).start()
+        logger.info("Started codebase load job %s for '%s'.", job.id, directory)
+        return job.to_dict(), False
+
+    def get(self, job_id):
+        """
+        Returns the state dict of a job, or None if it is unknown or expired.
+        """
+        return self.store.load(job_id)
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        self.store.save(job)
+        done = threading.Event()
+        threading.Thread(target=self._beat, args=(job, done), daemon=True).start()
+        try:
+            job.result = self.run_job(job)
+            job.status = 'succeeded'
+        except Exception as e:
+            logger.exception("Codebase load job %s failed.", job.id)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            done.set()
+            job.finished_at = time.time()
+            self._last_saved.pop(job.id, None)
+            self.store.save(job)
+
+    def _beat(self, job, done):
+        while not done.wait(self.heartbeat):
+            self._save(job)
+
+    def _save_throttled(self, job):
+        if time.monotonic() - self._last_saved.get(job.id, 0) >= self.save_interval:
+            self._save(job)
+
+    def _save(self, job):
+        self._last_saved[job.id] = time.monotonic()
+        try:
+            self.store.save(job)
+        except Exception:
+            logger.warning("Could not save progress of codebase load job %s.", job.id, exc_info=True)
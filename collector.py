@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('PrompterApp')
+
+DEFAULT_EXTENSIONS = {
+    '.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.kt', '.go', '.rs', '.c', '.h', '.cpp', '.hpp',
+    '.cs', '.rb', '.php', '.swift', '.scala', '.sh', '.html', '.css', '.sql', '.md', '.toml', '.yaml',
+    '.yml', '.json', '.conf', '.txt',
+}
+DEFAULT_EXCLUDE_DIRS = {'.git', 'node_modules', '__pycache__', '.venv', 'venv', 'build', 'dist', 'target', '.idea'}
+
+
+def render_file(path, text):
+    """
+    Renders one file as a section of the consolidated codebase prompt.
+    """
+    return f"File: {path}\n{text.rstrip(chr(10))}\n"
+
+
+class IncrementalCollector:
+    """
+    Native replacement for the external 'codecollector' script.
+
+    Keeps a manifest of path, mtime, size, content hash and token count for every
+    collected file. A refresh only stats the tree and re-reads files whose mtime or
+    size changed; files whose hash is unchanged keep their cached token count. The
+    manifest is persisted so token counts survive restarts.
+    """
+
+    def __init__(self, root, manifest_path=None, extensions=None, exclude_dirs=None,
+                 max_file_bytes=1_000_000, count_text=None):
+        self.root = os.path.abspath(root)
+        self.manifest_path = manifest_path
+        self.extensions = extensions or DEFAULT_EXTENSIONS
+        self.exclude_dirs = exclude_dirs or DEFAULT_EXCLUDE_DIRS
+        self.max_file_bytes = max_file_bytes
+        self.count_text = count_text
+        self.manifest = {}
+        self._sections = {}
+        self._content = None
+        self._lock = threading.RLock()
+        self.load_manifest()
+
+    def load_manifest(self):
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('root') == self.root:
+                self.manifest = data.get('files', {})
+                logger.debug("Loaded collector manifest with %s files.", len(self.manifest))
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable collector manifest '%s'.", self.manifest_path)
+
+    def save_manifest(self):
+        if not self.manifest_path:
+            return
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'root': self.root, 'files': self.manifest}, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def scan(self):
+        """
+        Returns {relative_path: (mtime_ns, size)} for all collectable files under the root.
+        """
+        found = {}
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d not in self.exclude_dirs and not d.startswith('.')]
+            for name in files:
+                if os.path.splitext(name)[1] not in self.extensions:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_size > self.max_file_bytes:
+                    continue
+                found[os.path.relpath(path, self.root)] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def refresh(self, progress=None):
+        """
+        Brings the collected codebase up to date with the tree.
+        Returns stats with 'changed' set when the consolidated content differs from before.
+        progress(files_scanned=..., bytes=...) is called periodically while files are read.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            found = self.scan()
+            added, modified, removed, read_bytes = [], [], [], 0
+            for path in set(self.manifest) - set(found):
+                removed.append(path)
+                del self.manifest[path]
+                self._sections.pop(path, None)
+            for scanned, (path, (mtime_ns, size)) in enumerate(found.items(), 1):
+                if progress and scanned % 200 == 0:
+                    progress(files_scanned=scanned, bytes=read_bytes)
+                entry = self.manifest.get(path)
+                if entry and path in self._sections and entry['mtime_ns'] == mtime_ns and entry['size'] == size:
+                    continue
+                try:
+                    with open(os.path.join(self.root, path), 'rb') as f:
+                        data = f.read()
+                    text = data.decode('utf-8')
+                except (OSError, UnicodeDecodeError):
+                    continue
+                read_bytes += len(data)
+                digest = hashlib.sha256(data).hexdigest()
+                section = render_file(path, text)
+                unchanged = entry is not None and entry['hash'] == digest
+                if unchanged and (entry.get('tokens') is not None or not self.count_text):
+                    tokens = entry.get('tokens')
+                else:
+                    tokens = self.count_text(section) if self.count_text else None
+                if not unchanged:
+                    (modified if entry else added).append(path)
+                elif path not in self._sections:
+                    added.append(path)
+                self._sections[path] = section
+                self.manifest[path] = {'mtime_ns': mtime_ns, 'size': size, 'hash': digest, 'tokens': tokens}
+            changed = bool(added or modified or removed) or self._content is None
+            if changed:
+                self._content = ''.join(self._sections[path] for path in sorted(self._sections))
+                self.save_manifest()
+        stats = {
+            'files': len(self._sections),
+            'added': len(added),
+            'modified': len(modified),
+            'removed': len(removed),
+            'bytes_read': read_bytes,
+            'bytes': len(self._content),
+            'tokens': self.token_count(),
+            'elapsed': time.perf_counter() - started,
+            'changed': changed,
+        }
+        if progress:
+            progress(files_scanned=len(found), bytes=stats['bytes'], tokens=stats['tokens'])
+        log = logger.info if changed else logger.debug
+        log(
+            "Collected %s files from '%s' (%s added, %s modified, %s removed) in %.3fs.",
+            stats['files'], self.root, stats['added'], stats['modified'], stats['removed'], stats['elapsed']
+        )
+        return stats
+
+    def content(self):
+        """
+        Returns the consolidated codebase prompt content.
+        """
+        with self._lock:
+            return self._content or ''
+
+    def token_count(self):
+        """
+        Returns the token count of content() summed from the per-file counts, or None without a counter.
+        Sections start on a line boundary, so the sum closely tracks encoding the whole content.
+        """
+        if not self.count_text:
+            return None
+        with self._lock:
+            return sum(self.manifest[path]['tokens'] or 0 for path in self._sections)
+
+
+class CollectorWatcher:
+    """
+    Background thread that polls the tree and calls on_change(stats) whenever the collected content changes.
+    Polling only stats files, so an idle tree costs one directory walk per interval.
+    """
+
+    def __init__(self, collector, on_change, interval=2.0):
+        self.collector = collector
+        self.on_change = on_change
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='codebase-watcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stats = self.collector.refresh()
+                if stats['changed']:
+                    self.on_change(stats)
+            except Exception:
+                logger.exception("Codebase watcher refresh failed.")
@@ -0,0 +1,364 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('PrompterApp')
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_stream_event(chunk):
+    """
+    Parses one line of an OpenAI streaming response into its event dict.
+    Returns None once the stream reports [DONE].
+    """
+    if isinstance(chunk, str):
+        chunk = chunk.encode('utf-8')
+    if chunk.startswith(b'data: '):
+        chunk = chunk[6:]
+    if chunk == b'[DONE]':
+        return None
+    return json.loads(chunk)
+
+
+def event_delta(event):
+    """
+    Returns the content delta of a streaming event, or '' for events without content (e.g. usage).
+    """
+    choices = event.get('choices')
+    if not choices:
+        return ''
+    return choices[0]['delta'].get('content') or ''
+
+
+def parse_stream_chunk(chunk):
+    """
+    Parses one line of an OpenAI streaming response.
+    Returns the content delta, or None once the stream reports [DONE].
+    """
+    event = parse_stream_event(chunk)
+    return None if event is None else event_delta(event)
+
+
+def coalesce_deltas(deltas, flush_interval=0.05, flush_chars=512):
+    """
+    Joins small content deltas into fewer, larger writes to the client.
+
+    The first delta is passed through immediately so time-to-first-token is unchanged;
+    afterwards buffered deltas are flushed once flush_interval seconds have passed since
+    the last write or flush_chars characters are buffered, and at the end of the stream.
+    A flush_interval of 0 passes every delta through unchanged.
+
+    Flushes happen only as deltas arrive, so flush_interval is the minimum gap between
+    writes: text buffered before an upstream pause is held until the next delta or the
+    end of the stream. acoalesce_deltas flushes during pauses too.
+    """
+    if flush_interval <= 0:
+        yield from deltas
+        return
+    buffer, buffered = [], 0
+    last_flush = None
+    for delta in deltas:
+        if not delta:
+            continue
+        buffer.append(delta)
+        buffered += len(delta)
+        now = time.perf_counter()
+        if last_flush is None or buffered >= flush_chars or now - last_flush >= flush_interval:
+            yield ''.join(buffer)
+            buffer, buffered = [], 0
+            last_flush = now
+    if buffer:
+        yield ''.join(buffer)
+
+
+async def acoalesce_deltas(deltas, flush_interval=0.05, flush_chars=512):
+    """
+    Async counterpart of coalesce_deltas. The next delta is awaited only until the flush
+    interval runs out, so buffered text is also flushed while the upstream pauses.
+    """
+    if flush_interval <= 0:
+        async for delta in deltas:
+            if delta:
+                yield delta
+        return
+    deltas = deltas.__aiter__()
+    buffer, buffered = [], 0
+    last_flush = None
+    next_delta = None
+    try:
+        while True:
+            if next_delta is None:
+                next_delta = asyncio.ensure_future(deltas.__anext__())
+            timeout = max(0.0, last_flush + flush_interval - time.perf_counter()) if buffer else None
+            done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+            if not done:
+                # The delta keeps being awaited; only the buffer goes out
+                yield ''.join(buffer)
+                buffer, buffered = [], 0
+                last_flush = time.perf_counter()
+                continue
+            finished, next_delta = next_delta, None
+            try:
+                delta = finished.result()
+            except StopAsyncIteration:
+                break
+            if not delta:
+                continue
+            buffer.append(delta)
+            buffered += len(delta)
+            now = time.perf_counter()
+            if last_flush is None or buffered >= flush_chars or now - last_flush >= flush_interval:
+                yield ''.join(buffer)
+                buffer, buffered = [], 0
+                last_flush = now
+    finally:
+        if next_delta is not None:
+            next_delta.cancel()
+    if buffer:
+        yield ''.join(buffer)
+
+
+def retry_delay(attempt, backoff, retry_after=None):
+    """
+    Returns the seconds to wait before retry number 'attempt', honouring a Retry-After header.
+    """
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt)
+
+
+def error_message_from_body(body):
+    """
+    Extracts the API error message from an error response body.
+    """
+    try:
+        return json.loads(body).get('error', {}).get('message', 'API request failed.')
+    except (ValueError, AttributeError):
+        return 'API request failed.'
+
+
+class CompletionTimings:
+    """
+    Keeps the most recent per-request latency samples of the completion API.
+    """
+
+    def __init__(self, max_samples=500):
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, sample):
+        with self._lock:
+            self._samples.append(sample)
+
+    def stats(self):
+        """
+        Returns request count, retries, prompt and provider-cached prompt tokens, and p50/p95 of
+        time-to-first-byte, time-to-first-token and duration.
+        """
+        with self._lock:
+            samples = list(self._samples)
+        summary = {'requests': len(samples), 'retries': sum(s['retries'] for s in samples)}
+        prompt_tokens = sum(s.get('prompt_tokens') or 0 for s in samples)
+        cached_tokens = sum(s.get('cached_tokens') or 0 for s in samples)
+        summary['prompt_tokens'] = prompt_tokens
+        summary['cached_tokens'] = cached_tokens
+        summary['cached_ratio'] = cached_tokens / prompt_tokens if prompt_tokens else None
+        for key in ('ttfb', 'ttft', 'duration'):
+            values = sorted(s[key] for s in samples if s.get(key) is not None)
+            summary[f'{key}_p50'] = values[len(values) // 2] if values else None
+            summary[f'{key}_p95'] = values[min(len(values) - 1, int(len(values) * 0.95))] if values else None
+        summary['recent'] = samples[-10:]
+        return summary
+
+
+class CompletionStream:
+    """
+    A streamed chat completion. Iterate iter_deltas() to consume the content deltas.
+    'usage' holds the token usage reported by the API, if the stream included it.
+    """
+
+    def __init__(self, response, started, ttfb, retries, timings):
+        self.response = response
+        self.status_code = response.status_code
+        self.usage = None
+        self.timing = {'ttfb': ttfb, 'ttft': None, 'duration': None, 'retries': retries}
+        self._started = started
+        self._timings = timings
+
+    def error_message(self):
+        return error_message_from_body(self.response.content)
+
+    def iter_deltas(self):
+        try:
+            for line in self.response.iter_lines():
+                if not line:
+                    continue
+                event = parse_stream_event(line)
+                if event is None:
+                    logger.debug("Received [DONE] from OpenAI stream.")
+                    break
+                if event.get('usage'):
+                    self.usage = event['usage']
+                delta = event_delta(event)
+                if delta and self.timing['ttft'] is None:
+                    self.timing['ttft'] = time.perf_counter() - self._started
+                yield delta
+        finally:
+            self.close()
+
+    def close(self):
+        if self._finish():
+            self.response.close()
+
+    def _finish(self):
+        """
+        Records the request's timing and prompt cache usage once. Returns False if already finished.
+        """
+        if self.timing['duration'] is not None:
+            return False
+        self.timing['duration'] = time.perf_counter() - self._started
+        usage = self.usage or {}
+        self.timing['prompt_tokens'] = usage.get('prompt_tokens')
+        self.timing['cached_tokens'] = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+        self._timings.record(self.timing)
+        return True
+
+    def completion_tokens(self):
+        """
+        Returns the completion token count reported by the API, or None if the stream had no usage.
+        """
+        return (self.usage or {}).get('completion_tokens')
+
+
+class CompletionClient:
+    """
+    Chat completion client with a persistent, pooled keep-alive session.
+
+    Requests that fail with 429/5xx or a connection error before streaming starts
+    are retried with exponential backoff.
+    """
+
+    def __init__(self, api_key, base_url='https://api.openai.com/v1', pool_size=20,
+                 connect_timeout=5.0, read_timeout=300.0, max_retries=3, backoff=0.5):
+        self.url = base_url.rstrip('/') + '/chat/completions'
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timings = CompletionTimings()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}'
+        })
+
+    def stream_chat(self, payload):
+        """
+        Posts a streaming chat completion request and returns a CompletionStream once headers arrive.
+        """
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.url, json=payload, stream=True, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, self.backoff)
+                logger.warning("Completion request failed (%s); retrying in %.1fs.", e, delay)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    ttfb = time.perf_counter() - started
+                    return CompletionStream(response, started, ttfb, attempt, self.timings)
+                delay = retry_delay(attempt, self.backoff, response.headers.get('Retry-After'))
+                logger.warning("Completion request returned %s; retrying in %.1fs.", response.status_code, delay)
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
+class AsyncCompletionStream(CompletionStream):
+    """
+    Async counterpart of CompletionStream for httpx streaming responses.
+    """
+
+    async def error_message(self):
+        return error_message_from_body(await self.response.aread())
+
+    async def iter_deltas(self):
+        try:
+            async for line in self.response.aiter_lines():
+                if not line:
+                    continue
+                event = parse_stream_event(line)
+                if event is None:
+                    break
+                if event.get('usage'):
+                    self.usage = event['usage']
+                delta = event_delta(event)
+                if delta and self.timing['ttft'] is None:
+                    self.timing['ttft'] = time.perf_counter() - self._started
+                yield delta
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._finish():
+            await self.response.aclose()
+
+
+class AsyncCompletionClient:
+    """
+    Async completion client backed by a pooled httpx.AsyncClient, with the same retry policy.
+    """
+
+    def __init__(self, api_key, base_url='https://api.openai.com/v1', pool_size=100,
+                 connect_timeout=5.0, read_timeout=300.0, max_retries=3, backoff=0.5):
+        import httpx
+        self._httpx = httpx
+        self.url = base_url.rstrip('/') + '/chat/completions'
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timings = CompletionTimings()
+        self.client = httpx.AsyncClient(
+            headers={'Authorization': f'Bearer {api_key}'},
+            timeout=httpx.Timeout(connect_timeout, read=read_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    async def stream_chat(self, payload):
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            request = self.client.build_request('POST', self.url, json=payload)
+            try:
+                response = await self.client.send(request, stream=True)
+            except (self._httpx.ConnectError, self._httpx.TimeoutException) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_delay(attempt, self.backoff)
+                logger.warning("Completion request failed (%s); retrying in %.1fs.", e, delay)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    ttfb = time.perf_counter() - started
+                    return AsyncCompletionStream(response, started, ttfb, attempt, self.timings)
+                delay = retry_delay(attempt, self.backoff, response.headers.get('Retry-After'))
+                logger.warning("Completion request returned %s; retrying in %.1fs.", response.status_code, delay)
+                await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.client.aclose()
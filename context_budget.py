@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from codebase_index import SELECTION_HEADER
+from token_ledger import REPLY_PRIMING_TOKENS, get_encoding
+
+logger = logging.getLogger('PrompterApp')
+
+# Context windows of known models; the longest matching prefix wins.
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo-instruct': 4096,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+SUMMARY_PREFIX = "Summary of earlier conversation (older turns omitted):\n"
+TRUNCATION_NOTE = "\n\n[Codebase truncated to fit the context window.]"
+
+
+def context_window_for_model(model):
+    """
+    Returns the context window size of the model, falling back to DEFAULT_CONTEXT_WINDOW.
+    """
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+class ContextBudgeter:
+    """
+    Decides what part of a chat fits into the model's context window.
+
+    The draft always goes in. The codebase prompt may use up to 'codebase_share'
+    of the input budget. Depending on 'codebase_mode' it is sent whole ('full',
+    trimmed when larger), replaced by the chunks most relevant to the query from a
+    CodebaseIndex ('index'), or sent whole when it fits and retrieved otherwise
+    ('auto'). Retrieval uses at most 'retrieval_tokens'. Prior messages fill the rest
+    newest-first using their cached token counts; when older turns have to be
+    dropped, 'summary_tokens' are reserved for an extractive summary of them.
+
+    'prompt_layout' controls message order. 'default' sends codebase, summary,
+    history, draft. 'prefix_cache' keeps the start of every request byte-identical
+    across turns for provider prompt caching: the codebase message comes first and
+    is reused as-is, followed by the append-only history, with the volatile summary
+    and the draft last. Older turns are then dropped in blocks of 'history_drop_block'
+    messages, so the first history message only moves every few turns.
+    """
+
+    def __init__(self, ledger, context_window, reserved_output=4096, codebase_share=0.75,
+                 summary_tokens=256, codebase_mode='auto', retrieval_tokens=8000, top_k=20,
+                 max_cached_prompts=8, prompt_layout='default', history_drop_block=8):
+        self.ledger = ledger
+        self.prompt_layout = prompt_layout
+        self.history_drop_block = history_drop_block
+        self.codebase_mode = codebase_mode
+        self.retrieval_tokens = retrieval_tokens
+        self.top_k = top_k
+        self.context_window = context_window
+        self.reserved_output = reserved_output
+        self.codebase_share = codebase_share
+        self.summary_tokens = summary_tokens
+        self.max_cached_prompts = max_cached_prompts
+        self._trimmed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def available_tokens(self):
+        return max(0, self.context_window - self.reserved_output - REPLY_PRIMING_TOKENS)
+
+    def uses_index(self, index):
+        return index is not None and self.codebase_mode in ('auto', 'index')
+
+    def plan(self, codebase_prompt, history, draft, index=None, query='', draft_tokens=None):
+        """
+        Selects the context for sending 'draft' after 'history' (ledger history entries, oldest first).
+        'index' is the CodebaseIndex of the codebase prompt and 'query' the text to rank its chunks by.
+        'draft_tokens' is the token count of the draft's content, if already known.
+
+        Returns a plan dict with the codebase prompt to send, the ids of the included and
+        dropped messages and a token breakdown. When messages were dropped, call
+        add_summary() with their text before using the plan.
+        """
+        ledger = self.ledger
+        available = self.available_tokens()
+        if draft:
+            draft_tokens = ledger.message_tokens('user', ledger.count_text(draft) if draft_tokens is None else draft_tokens)
+        else:
+            draft_tokens = 0
+
+        codebase_tokens = 0
+        codebase_source = 'none'
+        codebase_chunks = 0
+        if codebase_prompt:
+            codebase_cap = int(available * self.codebase_share)
+            if self.uses_index(index) and self.codebase_mode == 'index':
+                full_tokens = None
+            else:
+                full_tokens = ledger.message_tokens('assistant', ledger.prompt_tokens(codebase_prompt))
+            if full_tokens is not None and full_tokens <= codebase_cap:
+                codebase_tokens = full_tokens
+                codebase_source = 'full'
+            elif self.uses_index(index):
+                codebase_prompt, codebase_tokens, codebase_chunks = self.select_codebase(
+                    index, query or draft, min(codebase_cap, self.retrieval_tokens)
+                )
+                codebase_source = 'retrieved'
+            else:
+                codebase_prompt, codebase_tokens = self.trim_prompt(codebase_prompt, codebase_cap)
+                codebase_source = 'trimmed'
+
+        remaining = available - draft_tokens - codebase_tokens
+        costs = [ledger.message_tokens(item['role'], item['content_tokens']) for item in history]
+        history_budget = remaining
+        if sum(costs) > remaining and self.summary_tokens:
+            history_budget = remaining - self.summary_tokens
+
+        included = []
+        history_tokens = 0
+        for item, cost in zip(reversed(history), reversed(costs)):
+            if history_tokens + cost > history_budget:
+                break
+            included.append(item)
+            history_tokens += cost
+        included.reverse()
+        if self.prompt_layout == 'prefix_cache' and self.history_drop_block > 1 and len(included) < len(history):
+            # Round the cut up to a whole block so the start of the history stays put for several turns
+            first = len(history) - len(included)
+            cut = min(len(history), -(-first // self.history_drop_block) * self.history_drop_block)
+            history_tokens -= sum(costs[first:cut])
+            included = history[cut:]
+        included_ids = {item['id'] for item in included}
+        dropped = history[:len(history) - len(included)]
+
+        breakdown = {
+            'context_window': self.context_window,
+            'reserved_output': self.reserved_output,
+            'available': available,
+            'codebase': codebase_tokens,
+            'codebase_source': codebase_source,
+            'codebase_chunks': codebase_chunks,
+            'history': [
+                {'id': item['id'], 'role': item['role'], 'tokens': cost, 'included': item['id'] in included_ids}
+                for item, cost in zip(history, costs)
+            ],
+            'history_included': len(included),
+            'history_dropped': len(dropped),
+            'history_tokens': history_tokens,
+            'summary': 0,
+            'draft': draft_tokens,
+            'reply_priming': REPLY_PRIMING_TOKENS,
+        }
+        breakdown['total'] = codebase_tokens + history_tokens + draft_tokens + REPLY_PRIMING_TOKENS
+        breakdown['overflow'] = breakdown['total'] > available + REPLY_PRIMING_TOKENS
+        return {
+            'codebase_prompt': codebase_prompt,
+            'included_ids': [item['id'] for item in included],
+            'dropped_ids': [item['id'] for item in dropped],
+            'summary': '',
+            'breakdown': breakdown,
+        }
+
+    def add_summary(self, plan, dropped_snippets):
+        """
+        Adds an extractive summary of the dropped turns to the plan, within the summary budget.
+        'dropped_snippets' are short excerpts of the dropped user messages, oldest first.
+        """
+        if not dropped_snippets or not self.summary_tokens:
+            return plan
+        ledger = self.ledger
+        budget = self.summary_tokens - ledger.message_tokens('system', 0)
+        lines = []
+        for snippet in reversed(dropped_snippets):
+            line = f"- The user asked: {' '.join(snippet.split())}"
+            candidate = SUMMARY_PREFIX + '\n'.join([line] + lines)
+            if ledger.count_text(candidate) > budget:
+                break
+            lines.insert(0, line)
+        if not lines:
+            return plan
+        plan['summary'] = SUMMARY_PREFIX + '\n'.join(lines)
+        summary_tokens = ledger.message_tokens('system', ledger.count_text(plan['summary']))
+        plan['breakdown']['summary'] = summary_tokens
+        plan['breakdown']['total'] += summary_tokens
+        return plan
+
+    def build_messages(self, plan, history_messages, draft, prefix_message=None):
+        """
+        Assembles the API message list from a plan and the content of its included messages.
+        'prefix_message' is the prebuilt codebase message of the snapshot; it is reused when the
+        plan sends that exact prompt, so the request prefix is the same object every turn.
+        """
+        messages = []
+        if plan['codebase_prompt']:
+            if prefix_message is not None and prefix_message['content'] is plan['codebase_prompt']:
+                messages.append(prefix_message)
+            else:
+                messages.append({"role": "assistant", "content": plan['codebase_prompt']})
+        summary = [{"role": "system", "content": plan['summary']}] if plan['summary'] else []
+        if self.prompt_layout == 'prefix_cache':
+            messages.extend(history_messages)
+            messages.extend(summary)
+        else:
+            messages.extend(summary)
+            messages.extend(history_messages)
+        messages.append({"role": "user", "content": draft})
+        return messages
+
+    def select_codebase(self, index, query, max_tokens):
+        """
+        Builds a codebase prompt from the index chunks most relevant to the query.
+        Returns (prompt, tokens, chunk_count).
+        """
+        ledger = self.ledger
+        overhead = ledger.message_tokens('assistant', ledger.count_text(SELECTION_HEADER))
+        chunks = index.select(query, max(0, max_tokens - overhead), self.top_k)
+        while True:
+            prompt = index.render(chunks)
+            tokens = ledger.message_tokens('assistant', ledger.count_text(prompt))
+            if tokens <= max_tokens or not chunks:
+                return prompt, tokens, len(chunks)
+            chunks = chunks[:-1]
+
+    def trim_prompt(self, prompt, max_tokens):
+        """
+        Trims a prompt to fit in max_tokens (including message overhead). Results are cached
+        per prompt and budget, so repeated counts of the same snapshot stay cheap.
+        """
+        key = (hashlib.sha256(prompt.encode('utf-8')).hexdigest(), max_tokens)
+        with self._lock:
+            if key in self._trimmed:
+                self._trimmed.move_to_end(key)
+                return self._trimmed[key]
+        encoding = get_encoding(self.ledger.model)
+        overhead = self.ledger.message_tokens('assistant', self.ledger.count_text(TRUNCATION_NOTE))
+        keep = max(0, max_tokens - overhead)
+        tokens = encoding.encode_ordinary(prompt)
+        while True:
+            trimmed = encoding.decode(tokens[:keep]) + TRUNCATION_NOTE
+            cost = self.ledger.message_tokens('assistant', self.ledger.count_text(trimmed))
+            # Re-encoding at the cut can merge differently, so shave off any excess.
+            if cost <= max_tokens or keep == 0:
+                break
+            keep = max(0, keep - (cost - max_tokens))
+        result = (trimmed, cost)
+        logger.info("Trimmed codebase prompt to %s tokens to fit the context window.", result[1])
+        with self._lock:
+            self._trimmed[key] = result
+            while len(self._trimmed) > self.max_cached_prompts:
+                self._trimmed.popitem(last=False)
+        return result
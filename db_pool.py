@@ -0,0 +1,180 @@
+import logging
+import threading
+import time
+
+from mariadb import Error
+
+logger = logging.getLogger('PrompterApp')
+
+
+class PoolTimeoutError(Error):
+    """
+    Raised when no pooled connection becomes available within the checkout timeout.
+    """
+
+
+class TracedCursor:
+    """
+    Proxy around a cursor that times every query as a 'db.<verb>' span.
+    """
+
+    def __init__(self, cursor, span):
+        self._cursor = cursor
+        self._span = span
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, statement, *args, **kwargs):
+        with self._span(f"db.{statement.split(None, 1)[0].lower()}"):
+            return self._cursor.execute(statement, *args, **kwargs)
+
+    def executemany(self, statement, *args, **kwargs):
+        with self._span(f"db.{statement.split(None, 1)[0].lower()}"):
+            return self._cursor.executemany(statement, *args, **kwargs)
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled connection. close() returns it to the pool instead of disconnecting.
+    """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise Error("Connection has already been returned to the pool.")
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self.__getattr__('cursor')(*args, **kwargs)
+        return TracedCursor(cursor, self._pool.span) if self._pool.span else cursor
+
+    def close(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of database connections.
+
+    Checkouts block for at most 'timeout' seconds when all connections are in use.
+    Connections idle for longer than 'ping_interval' seconds are health checked
+    before being handed out and replaced if the server dropped them.
+
+    span, if given, is a context manager factory (such as Tracer.span) used to time
+    every query run on a checked-out connection.
+    """
+
+    def __init__(self, connect, size=10, timeout=5.0, ping_interval=30.0, span=None):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.span = span
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'created': 0,
+            'in_use': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'replaced': 0,
+        }
+
+    def get_connection(self):
+        """
+        Checks out a connection, waiting up to the pool timeout for one to be released.
+        """
+        start = time.monotonic()
+        waited = False
+        if not self._slots.acquire(blocking=False):
+            waited = True
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats['waits'] += 1
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time_total'] += time.monotonic() - start
+                logger.error("Timed out after %ss waiting for a database connection.", self.timeout)
+                raise PoolTimeoutError(f"No database connection available within {self.timeout} seconds.")
+        try:
+            connection = self._take_idle() or self._create()
+        except Exception:
+            self._slots.release()
+            raise
+        wait_time = time.monotonic() - start
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        """
+        Returns a connection to the pool, discarding it if it cannot be reset.
+        """
+        try:
+            connection.rollback()
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+        except Error:
+            logger.warning("Discarding database connection that failed to reset.")
+            self._discard(connection)
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool metrics.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['size'] = self.size
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+
+    def _take_idle(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, idle_since = self._idle.pop()
+            if time.monotonic() - idle_since < self.ping_interval:
+                return connection
+            try:
+                connection.ping()
+                return connection
+            except Error:
+                logger.warning("Pooled database connection failed health check; replacing it.")
+                with self._lock:
+                    self._stats['replaced'] += 1
+                self._discard(connection)
+
+    def _create(self):
+        connection = self._connect()
+        with self._lock:
+            self._stats['created'] += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Error:
+            pass
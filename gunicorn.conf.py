@@ -0,0 +1,19 @@
+"""
+gunicorn settings for wsgi.py. Every setting can be overridden on the command line
+or through the PROMPTER_* environment variables below.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('PROMPTER_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('PROMPTER_WORKERS', multiprocessing.cpu_count()))
+# Streams spend most of their time waiting on the model, so each worker serves several at once
+worker_class = 'gthread'
+threads = int(os.environ.get('PROMPTER_THREADS', 8))
+# Heartbeats come from the worker's main loop, so long streams do not trip the timeout
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+# Each worker must open its own database connections and start its own background
+# threads, which do not survive a fork; importing the app in the master would share them.
+preload_app = False
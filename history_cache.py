@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class HistoryCache:
+    """
+    In-process cache of chat history list pages, keyed by (before, limit).
+
+    invalidate() drops every page and bumps a generation counter; a page read from
+    the database before an invalidation is not stored afterwards, so a slow reader
+    cannot reinstate a list that no longer includes a newly created chat.
+
+    With version_path set, invalidate() also touches that file and every process
+    sharing it drops its pages once it sees the file's mtime change, so caches of
+    separate worker processes stay consistent.
+    """
+
+    def __init__(self, max_pages=64, version_path=None):
+        self.max_pages = max_pages
+        self.version_path = version_path
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._version = self._read_version()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            self._sync()
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page, generation):
+        with self._lock:
+            self._sync()
+            if generation != self.generation:
+                return
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            if self.version_path:
+                with open(self.version_path, 'a'):
+                    os.utime(self.version_path)
+                self._version = self._read_version()
+            self._drop()
+
+    def stats(self):
+        with self._lock:
+            return {'pages': len(self._pages), 'hits': self.hits, 'misses': self.misses, 'generation': self.generation}
+
+    def _drop(self):
+        self.generation += 1
+        self._pages.clear()
+
+    def _sync(self):
+        version = self._read_version()
+        if version != self._version:
+            self._version = version
+            self._drop()
+
+    def _read_version(self):
+        if not self.version_path:
+            return None
+        try:
+            return os.stat(self.version_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
@@ -0,0 +1,394 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger('PrompterApp')
+
+MESSAGE_COLUMNS = ('write_id', 'chat_id', 'sender', 'content', 'timestamp', 'token_count')
+MAX_CONTENT_BYTES = 65535  # messages.content is a TEXT column
+
+
+class MessageWriter:
+    """
+    Write-behind persistence of chat messages.
+
+    enqueue() only appends to an in-memory queue bounded by message count and by the
+    bytes of content it holds; a background worker writes everything queued so far as
+    one multi-row INSERT, retrying with exponential backoff. Messages that cannot be
+    written (the database stays unavailable, or the queue is full) are appended to a
+    local journal instead, which is replayed on startup, whenever a later batch
+    succeeds and every 'replay_interval' seconds while spilled messages are waiting.
+    Each message carries a write_id with a unique index, so replaying a message that
+    did reach the database is a no-op.
+
+    Errors of 'rejected_types' (such as integrity or data errors) are not retried: the
+    batch is written row by row instead, and the rows the database rejects on their own
+    are appended to the 'dead_letter_path' file, so one bad row can neither hold back
+    the rest of its batch nor keep the journal from draining. Content longer than
+    max_content_bytes goes to the dead-letter file without being tried; callers can
+    check fits() first to reject it up front.
+
+    A message counts as pending for its chat until it is in the database, whether it
+    is queued or spilled, so wait_for_chat() only returns once history reads see it.
+
+    Several worker processes may share one journal path. Appends hold an flock on the
+    journal; a replay first renames the journal to a name of its own, then locks and
+    reads it, so every spilled message is replayed by exactly one process at a time.
+    """
+
+    def __init__(self, connect, journal_path, batch_size=100, max_pending=10000,
+                 max_pending_bytes=64 * 1024 * 1024, max_retries=5, backoff=0.2,
+                 replay_interval=5.0, error_types=(Exception,), rejected_types=(),
+                 dead_letter_path=None, max_content_bytes=MAX_CONTENT_BYTES):
+        self.connect = connect
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path or f"{journal_path}.rejected"
+        self.max_content_bytes = max_content_bytes
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self.replay_interval = replay_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.error_types = error_types
+        self.rejected_types = rejected_types
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._pending_chats = {}
+        self._spilled_chats = {}  # chat_id -> write_ids of spilled messages not yet replayed
+        self._cond = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self._stats = {
+            'enqueued': 0, 'written': 0, 'batches': 0, 'retries': 0,
+            'spilled': 0, 'replayed': 0, 'rejected': 0, 'max_batch': 0, 'last_error': None,
+        }
+
+    def start(self, replay=True):
+        """
+        Starts the background worker, replaying the journal first unless replay is False
+        (for callers that replay once the database is known to be reachable).
+        """
+        if replay:
+            self.replay_journal()
+        self._thread.start()
+        return self
+
+    def fits(self, content):
+        """
+        Returns True if content is short enough to be stored as a message.
+        """
+        return len(content.encode('utf-8')) <= self.max_content_bytes
+
+    def enqueue(self, chat_id, sender, content, timestamp, token_count):
+        """
+        Queues a message for insertion and returns its write_id.
+        A message is spilled to the journal when the queue is full. An empty queue always
+        takes a message, so the queue holds at most max_pending_bytes plus one message.
+        Content longer than max_content_bytes is moved to the dead-letter file instead.
+        """
+        record = {
+            'write_id': uuid.uuid4().hex,
+            'chat_id': chat_id,
+            'sender': sender,
+            'content': content,
+            'timestamp': timestamp,
+            'token_count': token_count,
+        }
+        size = len(content.encode('utf-8'))
+        with self._cond:
+            self._stats['enqueued'] += 1
+        if size > self.max_content_bytes:
+            logger.error("Message of %s bytes for chat_id %s exceeds %s bytes; not writing it.",
+                         size, chat_id, self.max_content_bytes)
+            self._quarantine([record], f"content of {size} bytes exceeds {self.max_content_bytes}")
+            return record['write_id']
+        with self._cond:
+            if not self._queue or (len(self._queue) < self.max_pending
+                                   and self._queued_bytes + size <= self.max_pending_bytes):
+                self._queue.append((record, size))
+                self._queued_bytes += size
+                self._pending_chats[chat_id] = self._pending_chats.get(chat_id, 0) + 1
+                self._cond.notify_all()
+                return record['write_id']
+        logger.warning("Message write queue is full; spilling message to the journal.")
+        self._spill([record])
+        return record['write_id']
+
+    def pending(self, chat_id):
+        """
+        Returns the number of messages of a chat not yet in the database, queued or spilled.
+        """
+        with self._cond:
+            return self._pending_chats.get(chat_id, 0) + len(self._spilled_chats.get(chat_id, ()))
+
+    def wait_for_chat(self, chat_id, timeout=2.0):
+        """
+        Blocks until the queued and spilled messages of chat_id are in the database, so its history
+        can be read back. Returns False if they are still pending after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending_chats.get(chat_id) or self._spilled_chats.get(chat_id):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Timed out waiting for queued messages of chat_id %s.", chat_id)
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=5.0):
+        """
+        Stops the worker after it has written what is queued; anything left is spilled to the journal.
+        """
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        with self._cond:
+            leftover = [record for record, _ in self._queue]
+            self._queue.clear()
+            self._queued_bytes = 0
+            self._pending_chats.clear()
+        if leftover:
+            self._spill(leftover)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._stats, queued=len(self._queue), queued_bytes=self._queued_bytes,
+                spilled_pending=sum(len(ids) for ids in self._spilled_chats.values()), journal=self._has_journal()
+            )
+
+    def replay_journal(self):
+        """
+        Writes journaled messages to the database. The journal is moved aside first, so
+        messages spilled meanwhile start a new journal; on failure it is kept for the next attempt.
+        Journals moved aside by other processes that did not finish replaying them are picked up too.
+        """
+        with self._journal_lock:
+            if os.path.exists(self.journal_path):
+                try:
+                    os.replace(self.journal_path, f"{self.journal_path}.replay.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+                except FileNotFoundError:
+                    pass  # Another process moved it aside first
+        replayed = 0
+        for path in sorted(glob.glob(f"{glob.escape(self.journal_path)}.replay*")):
+            replayed += self._replay_file(path)
+        with self._cond:
+            # Spills are counted only after they reach the journal, so with no journal left
+            # anywhere every message spilled so far is in the database, whoever replayed it
+            if self._spilled_chats and not self._has_journal():
+                self._spilled_chats.clear()
+                self._cond.notify_all()
+        return replayed
+
+    def _replay_file(self, path):
+        try:
+            f = open(path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return 0
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0  # Being appended to, or replayed by another process; left for the next attempt
+            if not self._is_current(f, path):
+                return 0
+            records = []
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping unreadable message journal entry.")
+                    continue
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                records.append(record)
+            rejected = []
+            try:
+                for start in range(0, len(records), self.batch_size):
+                    batch = records[start:start + self.batch_size]
+                    try:
+                        self._insert(batch)
+                    except self.rejected_types:
+                        rejected.extend(self._insert_rows(batch))
+            except self.error_types as e:
+                logger.warning("Message journal replay failed (%s); will retry later.", e)
+                return 0
+            # Quarantined only once the whole journal is through, so a retried replay adds no duplicates
+            if rejected:
+                self._quarantine(*zip(*rejected))
+            os.remove(path)
+        with self._cond:
+            self._stats['replayed'] += len(records)
+            self._settle_spilled(records)
+            self._cond.notify_all()
+        logger.info("Replayed %s journaled messages.", len(records))
+        return len(records)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop.is_set():
+                    # Spilled messages keep their chats waiting, so retry the journal while idle
+                    if not self._cond.wait(self.replay_interval if self._spilled_chats else None):
+                        break
+                if not self._queue and self._stop.is_set():
+                    return
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    record, size = self._queue.popleft()
+                    self._queued_bytes -= size
+                    batch.append(record)
+            if not batch:
+                self.replay_journal()
+                continue
+            written = self._write_batch(batch)
+            with self._cond:
+                for record in batch:
+                    remaining = self._pending_chats.get(record['chat_id'], 0) - 1
+                    if remaining > 0:
+                        self._pending_chats[record['chat_id']] = remaining
+                    else:
+                        self._pending_chats.pop(record['chat_id'], None)
+                self._cond.notify_all()
+            if written and self._has_journal():
+                self.replay_journal()
+
+    def _write_batch(self, batch):
+        """
+        Inserts a batch, retrying with backoff; spills it to the journal if every attempt fails.
+        A rejected batch is written row by row, quarantining the rows rejected on their own.
+        Returns True if the batch reached the database, apart from any quarantined rows.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                try:
+                    self._insert(batch)
+                    rejected = []
+                except self.rejected_types:
+                    rejected = self._insert_rows(batch)
+                if rejected:
+                    self._quarantine(*zip(*rejected))
+                with self._cond:
+                    self._stats['written'] += len(batch) - len(rejected)
+                    self._stats['batches'] += 1
+                    self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+                return True
+            except self.error_types as e:
+                with self._cond:
+                    self._stats['last_error'] = str(e)
+                if attempt == self.max_retries or self._stop.is_set():
+                    break
+                with self._cond:
+                    self._stats['retries'] += 1
+                delay = self.backoff * (2 ** attempt)
+                logger.warning("Writing %s messages failed (%s); retrying in %.1fs.", len(batch), e, delay)
+                self._stop.wait(delay)
+        logger.error("Giving up on writing %s messages; spilling them to the journal.", len(batch))
+        self._spill(batch)
+        return False
+
+    def _insert_rows(self, records):
+        """
+        Inserts records one at a time and returns (record, error) pairs for those the database
+        rejects. Other errors propagate, so the caller retries or keeps the records as a whole.
+        """
+        rejected = []
+        for record in records:
+            try:
+                self._insert([record])
+            except self.rejected_types as e:
+                logger.error("Database rejected message %s of chat_id %s (%s); moving it to %s.",
+                             record['write_id'], record['chat_id'], e, self.dead_letter_path)
+                rejected.append((record, str(e)))
+        return rejected
+
+    def _insert(self, records):
+        row = f"({', '.join('?' for _ in MESSAGE_COLUMNS)})"
+        params = [record[column] for record in records for column in MESSAGE_COLUMNS]
+        connection = self.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                f"INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}) VALUES {', '.join(row for _ in records)} "
+                f"ON DUPLICATE KEY UPDATE id = id",
+                params
+            )
+            connection.commit()
+        finally:
+            cursor.close()
+            connection.close()
+
+    def _spill(self, records):
+        lines = ''.join(
+            json.dumps(dict(record, timestamp=record['timestamp'].isoformat())) + '\n' for record in records
+        )
+        with self._journal_lock:
+            while True:
+                with open(self.journal_path, 'a', encoding='utf-8') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    # A replay may have moved the journal aside while we waited for the lock
+                    if not self._is_current(f, self.journal_path):
+                        continue
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    break
+        with self._cond:
+            self._stats['spilled'] += len(records)
+            for record in records:
+                self._spilled_chats.setdefault(record['chat_id'], set()).add(record['write_id'])
+
+    def _quarantine(self, records, errors):
+        """
+        Appends records the database will never accept to the dead-letter file, with the error of each.
+        errors is one error per record, or a single error for all of them.
+        """
+        if isinstance(errors, str):
+            errors = [errors] * len(records)
+        lines = ''.join(
+            json.dumps(dict(record, timestamp=record['timestamp'].isoformat(), error=error)) + '\n'
+            for record, error in zip(records, errors)
+        )
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._cond:
+            self._stats['rejected'] += len(records)
+
+    def _settle_spilled(self, records):
+        """
+        Stops counting replayed records as pending for their chats. Records spilled by other
+        processes are not tracked here and are ignored. Called with _cond held.
+        """
+        for record in records:
+            write_ids = self._spilled_chats.get(record['chat_id'])
+            if write_ids is not None:
+                write_ids.discard(record['write_id'])
+                if not write_ids:
+                    del self._spilled_chats[record['chat_id']]
+
+    def _has_journal(self):
+        return os.path.exists(self.journal_path) or bool(glob.glob(f"{glob.escape(self.journal_path)}.replay*"))
+
+    @staticmethod
+    def _is_current(f, path):
+        """
+        Returns True if the open file f is still the file at path.
+        """
+        try:
+            return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,324 @@
+import bisect
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('PrompterApp')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [(name, value) for name, value in zip(labelnames, key)] + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def export(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def export(self):
+        with self._lock:
+            return [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+
+
+class Gauge:
+    """
+    A value read from 'read' (a callable returning a number) when metrics are collected.
+    """
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.labelnames = ()
+        self.read = read
+
+    def export(self):
+        try:
+            return [[[], float(self.read())]]
+        except Exception:
+            return []
+
+
+class MetricsRegistry:
+    """
+    Process metrics rendered in the Prometheus text format.
+
+    With 'directory' set, each process periodically exports its metrics to a file
+    named after its pid there, and render() merges every file in the directory, so
+    whichever worker process is scraped reports the totals of all of them.
+    Gauges of processes that stopped exporting are left out.
+    """
+
+    def __init__(self, directory=None, export_interval=5.0):
+        self.directory = directory
+        self.export_interval = export_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, read):
+        return self._register(Gauge(name, help, read))
+
+    def start(self):
+        """
+        Starts exporting to 'directory' in the background, if one is set.
+        """
+        if self.directory and self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._export_loop, name='metrics-export', daemon=True)
+            self._thread.start()
+        return self
+
+    def export(self):
+        """
+        Returns this process's metric values as a JSON-serializable dict.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.export() for metric in metrics}
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        exports = [self.export()]
+        if self.directory:
+            self._write_export(exports[0])
+            exports = self._read_exports()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            kind = {Counter: 'counter', Histogram: 'histogram', Gauge: 'gauge'}[type(metric)]
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            merged = {}
+            for export in exports:
+                for entry in export.get(metric.name, []):
+                    key = tuple(entry[0])
+                    if kind == 'histogram':
+                        counts, total = merged.get(key, ([0] * (len(metric.buckets) + 1), 0.0))
+                        merged[key] = ([a + b for a, b in zip(counts, entry[1])], total + entry[2])
+                    else:
+                        merged[key] = merged.get(key, 0) + entry[1]
+            for key, value in sorted(merged.items()):
+                if kind != 'histogram':
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+                    continue
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    lines.append(
+                        f"{metric.name}_bucket{_format_labels(metric.labelnames, key, [('le', le)])} {cumulative}"
+                    )
+                lines.append(f"{metric.name}_sum{_format_labels(metric.labelnames, key)} {_format_value(total)}")
+                lines.append(f"{metric.name}_count{_format_labels(metric.labelnames, key)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def _export_loop(self):
+        while True:
+            time.sleep(self.export_interval)
+            try:
+                self._write_export(self.export())
+            except Exception:
+                logger.warning("Could not export metrics.", exc_info=True)
+
+    def _write_export(self, export):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(export, f)
+        os.replace(temp_path, path)
+
+    def _read_exports(self):
+        exports = []
+        stale_before = time.time() - 3 * self.export_interval
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    export = json.load(f)
+                if os.path.getmtime(path) < stale_before:
+                    for name in [name for name, metric in self._metrics.items() if isinstance(metric, Gauge)]:
+                        export.pop(name, None)
+            except (OSError, ValueError):
+                continue
+            exports.append(export)
+        return exports
+
+
+class Trace:
+    """
+    The spans of one request: (name, start offset, duration) in seconds.
+    """
+
+    def __init__(self, tracer, route, method):
+        self.tracer = tracer
+        self.id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.spans = []
+        self.deferred = False
+        self.finished = False
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, started)
+
+    def record(self, name, seconds, started=None):
+        """
+        Adds a span measured elsewhere, e.g. the time to first token reported by the completion client.
+        """
+        offset = (started if started is not None else time.perf_counter() - seconds) - self.started
+        self.spans.append((name, offset, seconds))
+        self.tracer.span_seconds.observe(seconds, span=name)
+
+    def defer(self):
+        """
+        Marks the trace to be finished by the route itself, once its streamed body is done.
+        """
+        self.deferred = True
+
+    def finish(self, status=200, error=False):
+        if self.finished:
+            return
+        self.finished = True
+        self.tracer.finish(self, status, error)
+
+    def to_dict(self, duration):
+        return {
+            'trace_id': self.id,
+            'route': self.route,
+            'method': self.method,
+            'duration': duration,
+            'spans': [{'name': name, 'start': offset, 'duration': seconds} for name, offset, seconds in self.spans],
+        }
+
+
+class Tracer:
+    """
+    Per-request tracing. start() opens a trace for the current request (a context
+    variable, so it follows the request across threads and tasks that copy the
+    context); span() times a block into the 'span' histogram and the current trace,
+    if any. Requests slower than 'slow_threshold' seconds are logged with their spans
+    and kept, most recent first, for the /traces endpoint.
+    """
+
+    def __init__(self, registry, slow_threshold=1.0, max_traces=50):
+        self.slow_threshold = slow_threshold
+        self._current = contextvars.ContextVar('prompter_trace', default=None)
+        self._slow = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        self.requests = registry.counter(
+            'prompter_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status')
+        )
+        self.errors = registry.counter('prompter_errors_total', 'Failed HTTP requests by route.', ('route',))
+        self.request_seconds = registry.histogram(
+            'prompter_request_seconds', 'HTTP request duration, including streamed bodies.', ('route',)
+        )
+        self.span_seconds = registry.histogram('prompter_span_seconds', 'Duration of traced operations.', ('span',))
+
+    def start(self, route, method):
+        trace = Trace(self, route, method)
+        self._current.set(trace)
+        return trace
+
+    def current(self):
+        return self._current.get()
+
+    @contextmanager
+    def span(self, name):
+        trace = self._current.get()
+        if trace is not None:
+            with trace.span(name):
+                yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span_seconds.observe(time.perf_counter() - started, span=name)
+
+    def finish(self, trace, status, error):
+        duration = time.perf_counter() - trace.started
+        self.requests.inc(route=trace.route, method=trace.method, status=status)
+        self.request_seconds.observe(duration, route=trace.route)
+        if error or status >= 500:
+            self.errors.inc(route=trace.route)
+        if duration >= self.slow_threshold:
+            spans = ', '.join(f"{name}={seconds * 1000:.1f}ms" for name, _, seconds in trace.spans)
+            logger.info("Slow request %s %s (%.3fs) trace %s: %s", trace.method, trace.route, duration, trace.id, spans)
+            with self._lock:
+                self._slow.appendleft(trace.to_dict(duration))
+
+    def slow_traces(self):
+        with self._lock:
+            return list(self._slow)
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('PrompterApp')
+
+_TRAILING_SPACE = re.compile(r'[ \t]+$', re.MULTILINE)
+
+
+def normalize_content(content):
+    """
+    Normalizes message text for cache keys: line endings, trailing spaces and surrounding whitespace.
+    """
+    return _TRAILING_SPACE.sub('', content.replace('\r\n', '\n')).strip()
+
+
+def cache_key(model, messages, prefix_id=None, **params):
+    """
+    Returns the cache key of a completion request.
+
+    When prefix_id is given it stands in for the first message (the full codebase
+    prompt of a snapshot), so the multi-megabyte prompt is not rehashed per request.
+    """
+    if prefix_id is not None:
+        messages = messages[1:]
+    payload = {
+        'model': model,
+        'prefix': prefix_id,
+        'params': params,
+        'messages': [[message['role'], normalize_content(message['content'])] for message in messages],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class MemoryResponseCache:
+    """
+    In-process LRU cache of completed responses with a time-to-live.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns (text, token_count) for a live entry, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[2] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, text, token_count):
+        with self._lock:
+            self._entries[key] = (text, token_count, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class SQLiteResponseCache:
+    """
+    Response cache in a local SQLite file, so cached answers survive restarts and are shared between processes.
+    Entries expire after ttl seconds; beyond max_entries the least recently used are evicted.
+    """
+
+    def __init__(self, path, max_entries=256, ttl=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, text TEXT, token_count INTEGER, created_at REAL, accessed_at REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)")
+        self._connection.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT text, token_count FROM responses WHERE key = ? AND created_at > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0], row[1]
+
+    def put(self, key, text, token_count):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, text, token_count, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, text, token_count, now, now)
+            )
+            self._connection.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._connection.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {'backend': 'sqlite', 'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+
+def create_response_cache(mode, path=None, max_entries=256, ttl=3600):
+    """
+    Returns the response cache for a response_cache config value ('off', 'memory' or 'sqlite'), or None when off.
+    """
+    if mode == 'memory':
+        return MemoryResponseCache(max_entries, ttl)
+    if mode == 'sqlite':
+        return SQLiteResponseCache(path, max_entries, ttl)
+    if mode != 'off':
+        logger.warning("Unknown response_cache mode '%s'; response caching is off.", mode)
+    return None
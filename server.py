@@ -2,82 +2,234 @@ import subprocess
 import os
 import json
 import logging
+import hashlib
+import atexit
+import fcntl
+import threading
+import time
+STARTUP_STARTED = time.perf_counter()
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import requests
 import mariadb
 from mariadb import Error
 from datetime import datetime
 import re
-import tiktoken
+from app_logging import TEXT_FORMAT, configure_logging
+from codebase_index import CodebaseIndex
+from codebase_jobs import CodebaseJobManager, DatabaseJobStore
+from collector import IncrementalCollector, CollectorWatcher
+from completion_client import CompletionClient, coalesce_deltas, parse_stream_chunk
+from context_budget import ContextBudgeter, context_window_for_model
+from db_pool import ConnectionPool
+from history_cache import HistoryCache
+from message_writer import MessageWriter
+from metrics import MetricsRegistry, Tracer
+from response_cache import cache_key, create_response_cache
+from snapshots import SnapshotStore, SnapshotCache
+from startup import StartupTracker
+from token_ledger import TokenLedger, get_encoding, set_encoding_cache_dir
+
+startup = StartupTracker(started=STARTUP_STARTED)
+startup.mark('imports')
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Context-Budget', 'X-Response-Cache'])
 
 logger = logging.getLogger('PrompterApp')
-logger.setLevel(logging.DEBUG)
-
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-
-file_handler = logging.FileHandler('app.log')
-file_handler.setLevel(logging.DEBUG)
-
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
-
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
-
-logger.info("Starting PrompterApp...")
 
 config = {}
-config_path = '/home/brandon/Projects/prompter/config.conf'
+# PROMPTER_CONFIG points benchmarks and deployments at another config file
+config_path = os.environ.get('PROMPTER_CONFIG', '/home/brandon/Projects/prompter/config.conf')
 if os.path.exists(config_path):
-    logger.debug(f"Loading configuration from {config_path}")
     with open(config_path, 'r') as f:
         for line in f:
             if '=' in line:
                 key, value = line.strip().split('=', 1)
                 config[key.strip()] = value.strip()
-    logger.info("Configuration loaded successfully.")
 else:
+    logging.basicConfig(format=TEXT_FORMAT)
     logger.critical("config.conf not found. Please create one with the required configurations.")
     raise FileNotFoundError("config.conf not found. Please create one with the required configurations.")
 
+# Logging is configured from config.conf, so it is set up once the file has been read
+log_listener = configure_logging(logger, config)
+logger.info("Starting PrompterApp...")
+logger.info("Configuration loaded successfully from %s.", config_path)
+startup.mark('config')
+
+# Files the app writes default to the directory holding config.conf
+DATA_DIR = config.get('data_dir', os.path.dirname(os.path.abspath(config_path)))
 API_KEY = config.get('api_key')
 MODEL = config.get('model', 'gpt-3.5-turbo')
+CONTEXT_WINDOW = int(config.get('context_window', 0)) or context_window_for_model(MODEL)
+MAX_OUTPUT_TOKENS = int(config.get('max_output_tokens', 4096))
+CONTEXT_CODEBASE_SHARE = float(config.get('context_codebase_share', 0.75))
+CONTEXT_SUMMARY_TOKENS = int(config.get('context_summary_tokens', 256))
+CODEBASE_MODE = config.get('codebase_mode', 'auto')
+CODEBASE_RETRIEVAL_TOKENS = int(config.get('codebase_retrieval_tokens', 8000))
+CODEBASE_TOP_K = int(config.get('codebase_top_k', 20))
+PROMPT_LAYOUT = config.get('prompt_layout', 'default')
+HISTORY_DROP_BLOCK = int(config.get('history_drop_block', 8))
+CODEBASE_FILE_HEADER = config.get('codebase_file_header')
+COLLECTOR_MODE = config.get('collector_mode', 'script')
+COLLECTOR_MANIFEST = config.get('collector_manifest', os.path.join(DATA_DIR, 'codebase.manifest.json'))
+COLLECTOR_EXTENSIONS = config.get('collector_extensions')
+COLLECTOR_EXCLUDE = config.get('collector_exclude')
+COLLECTOR_WATCH = config.get('collector_watch', 'false').lower() == 'true'
+COLLECTOR_WATCH_INTERVAL = float(config.get('collector_watch_interval', 2))
+API_BASE_URL = config.get('api_base_url', 'https://api.openai.com/v1')
+API_POOL_SIZE = int(config.get('api_pool_size', 20))
+API_CONNECT_TIMEOUT = float(config.get('api_connect_timeout', 5))
+API_READ_TIMEOUT = float(config.get('api_read_timeout', 300))
+API_MAX_RETRIES = int(config.get('api_max_retries', 3))
+API_RETRY_BACKOFF = float(config.get('api_retry_backoff', 0.5))
+API_STREAM_USAGE = config.get('api_stream_usage', 'true').lower() == 'true'
+STREAM_FLUSH_INTERVAL = float(config.get('stream_flush_interval', 0.05))
+STREAM_FLUSH_CHARS = int(config.get('stream_flush_chars', 512))
 SCRIPT_NAME = config.get('script_name', 'codecollector')
 CODEBASE_DIR = config.get('codecollector_directory')
+CODEBASE_OUTPUT_FILE = config.get('codecollector_output', os.path.join(DATA_DIR, 'codebase.prompt'))
 DB_HOST = config.get('db_host')
+DB_PORT = int(config.get('db_port', 3306))
 DB_USER = config.get('db_user')
 DB_PASSWORD = config.get('db_password')
 DB_NAME = config.get('db_name')
+DB_POOL_SIZE = int(config.get('db_pool_size', 10))
+DB_POOL_TIMEOUT = float(config.get('db_pool_timeout', 5))
+DB_POOL_PING_INTERVAL = float(config.get('db_pool_ping_interval', 30))
+HISTORY_PAGE_SIZE = int(config.get('history_page_size', 50))
+HISTORY_MESSAGE_PAGE_SIZE = int(config.get('history_message_page_size', 200))
+HISTORY_MAX_PAGE_SIZE = int(config.get('history_max_page_size', 500))
+MESSAGE_JOURNAL = config.get('message_journal', os.path.join(DATA_DIR, 'messages.journal'))
+MESSAGE_DEAD_LETTER = config.get('message_dead_letter', os.path.join(DATA_DIR, 'messages.rejected'))
+MESSAGE_BATCH_SIZE = int(config.get('message_batch_size', 100))
+MESSAGE_QUEUE_SIZE = int(config.get('message_queue_size', 10000))
+MESSAGE_QUEUE_BYTES = int(config.get('message_queue_bytes', 64 * 1024 * 1024))
+MESSAGE_REPLAY_INTERVAL = float(config.get('message_replay_interval', 5))
+MESSAGE_WRITE_RETRIES = int(config.get('message_write_retries', 5))
+MESSAGE_WRITE_BACKOFF = float(config.get('message_write_backoff', 0.2))
+MESSAGE_WRITE_WAIT = float(config.get('message_write_wait', 2))
+RESPONSE_CACHE = config.get('response_cache', 'off')
+RESPONSE_CACHE_PATH = config.get('response_cache_path', os.path.join(DATA_DIR, 'responses.sqlite'))
+RESPONSE_CACHE_SIZE = int(config.get('response_cache_size', 256))
+RESPONSE_CACHE_TTL = float(config.get('response_cache_ttl', 3600))
+SNAPSHOT_DIR = config.get('snapshot_dir', os.path.join(DATA_DIR, 'snapshots'))
+SNAPSHOT_CACHE_SIZE = int(config.get('snapshot_cache_size', 4))
+SNAPSHOT_KEEP = int(config.get('snapshot_keep', 10))
+CODEBASE_JOB_RETENTION = float(config.get('codebase_job_retention', 3600))
+CODEBASE_JOB_STALE_AFTER = float(config.get('codebase_job_stale_after', 300))
+METRICS_DIR = config.get('metrics_dir')
+TOKENIZER_CACHE_DIR = config.get('tokenizer_cache_dir', os.path.join(DATA_DIR, 'tiktoken_cache'))
+DB_INIT_BACKOFF = float(config.get('db_init_backoff', 0.5))
+DB_INIT_MAX_BACKOFF = float(config.get('db_init_max_backoff', 30))
+COUNT_TOKENS_BATCH_MAX = int(config.get('count_tokens_batch_max', 256))
+COUNT_TOKENS_THREADS = int(config.get('count_tokens_threads', os.cpu_count() or 4))
+TRACE_SLOW_THRESHOLD = float(config.get('trace_slow_threshold', 1.0))
+DEFAULT_WORKSPACE = 'default'
+WORKSPACES = {DEFAULT_WORKSPACE: CODEBASE_DIR}
+WORKSPACES.update({key[len('workspace.'):]: value for key, value in config.items() if key.startswith('workspace.')})
 
 if not all([API_KEY, SCRIPT_NAME, CODEBASE_DIR, DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
     logger.critical("Missing required configurations: 'api_key', 'script_name', 'codecollector_directory', 'db_host', 'db_user', 'db_password', or 'db_name'.")
     raise ValueError("Please ensure 'api_key', 'script_name', 'codecollector_directory', 'db_host', 'db_user', 'db_password', and 'db_name' are set in config.conf.")
 
-codebase_content = ""
+CODEBASE_PROMPT_PREFIX = "You have access to the following codebase:\n\n"
+
+class LoadedCodebase:
+    """
+    A loaded codebase snapshot: the assistant prompt carrying its content, its relevance
+    index and prompt token count. Never modified once built, so requests holding one always
+    see a complete codebase. The content itself is not kept; the prompt already holds it.
+    """
+
+    __slots__ = ('snapshot_id', 'prompt', 'prefix_message', 'index', 'prompt_tokens')
+
+    def __init__(self, content='', index=None, snapshot_id=None, prompt_tokens=0):
+        self.snapshot_id = snapshot_id
+        self.prompt = f"{CODEBASE_PROMPT_PREFIX}{content}" if content else ""
+        # Built once per snapshot so every request starts with the same message object and bytes
+        self.prefix_message = {"role": "assistant", "content": self.prompt}
+        self.index = index
+        self.prompt_tokens = prompt_tokens
+
+EMPTY_CODEBASE = LoadedCodebase()
+metrics_registry = MetricsRegistry(METRICS_DIR).start()
+tracer = Tracer(metrics_registry, slow_threshold=TRACE_SLOW_THRESHOLD)
+tokens_total = metrics_registry.counter('prompter_tokens_total', 'Tokens sent to and received from the model.', ('direction',))
+stream_bytes_total = metrics_registry.counter('prompter_stream_bytes_total', 'Bytes of completion text streamed to clients.')
+upstream_seconds = metrics_registry.histogram(
+    'prompter_upstream_seconds', 'Completion API latency by phase (ttfb, ttft, duration).', ('phase',)
+)
+chunk_token_cache = {}
+history_cache = HistoryCache(version_path=os.path.join(SNAPSHOT_DIR, 'history.version'))
+response_cache = create_response_cache(RESPONSE_CACHE, RESPONSE_CACHE_PATH, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+native_collectors = {}
+native_collectors_lock = threading.Lock()
+script_lock = threading.Lock()
+token_ledger = TokenLedger(MODEL)
+set_encoding_cache_dir(TOKENIZER_CACHE_DIR)
+context_budgeter = ContextBudgeter(
+    token_ledger,
+    CONTEXT_WINDOW,
+    reserved_output=MAX_OUTPUT_TOKENS,
+    codebase_share=CONTEXT_CODEBASE_SHARE,
+    summary_tokens=CONTEXT_SUMMARY_TOKENS,
+    codebase_mode=CODEBASE_MODE,
+    retrieval_tokens=CODEBASE_RETRIEVAL_TOKENS,
+    top_k=CODEBASE_TOP_K,
+    prompt_layout=PROMPT_LAYOUT,
+    history_drop_block=HISTORY_DROP_BLOCK
+)
+completion_client = CompletionClient(
+    API_KEY,
+    base_url=API_BASE_URL,
+    pool_size=API_POOL_SIZE,
+    connect_timeout=API_CONNECT_TIMEOUT,
+    read_timeout=API_READ_TIMEOUT,
+    max_retries=API_MAX_RETRIES,
+    backoff=API_RETRY_BACKOFF
+)
+
+def connect_to_db():
+    connection = mariadb.connect(
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME
+    )
+    logger.debug("Connected to MariaDB database")
+    return connection
+
+db_pool = ConnectionPool(
+    connect_to_db,
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    ping_interval=DB_POOL_PING_INTERVAL,
+    span=tracer.span
+)
+metrics_registry.gauge('prompter_db_pool_in_use', 'Database connections checked out.', lambda: db_pool.stats()['in_use'])
 
 def create_db_connection():
+    """
+    Checks out a connection from the pool. Closing it returns it to the pool.
+    """
     try:
-        connection = mariadb.connect(
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            database=DB_NAME
-        )
-        logger.info("Connected to MariaDB database")
-        return connection
+        with tracer.span('db.connect'):
+            return db_pool.get_connection()
     except Error as e:
         logger.exception("Error while connecting to MariaDB")
         raise e
 
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS snapshot_id CHAR(64)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS token_count INT",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS write_id CHAR(32)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_write_id ON messages (write_id)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_history_created_at ON chat_history (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp ON messages (chat_id, timestamp)",
+]
+
 def init_db():
     connection = create_db_connection()
     cursor = connection.cursor()
@@ -86,7 +238,9 @@ def init_db():
         CREATE TABLE IF NOT EXISTS chat_history (
             id INT AUTO_INCREMENT PRIMARY KEY,
             title VARCHAR(255),
-            created_at DATETIME
+            created_at DATETIME,
+            snapshot_id CHAR(64),
+            INDEX idx_chat_history_created_at (created_at)
         )
         """
         cursor.execute(create_chat_history_table)
@@ -97,76 +251,688 @@ def init_db():
             sender ENUM('user', 'bot'),
             content TEXT,
             timestamp DATETIME,
+            token_count INT,
+            write_id CHAR(32),
+            INDEX idx_messages_chat_timestamp (chat_id, timestamp),
+            UNIQUE INDEX idx_messages_write_id (write_id),
             FOREIGN KEY (chat_id) REFERENCES chat_history(id) ON DELETE CASCADE
         )
         """
         cursor.execute(create_messages_table)
+        create_codebase_jobs_table = """
+        CREATE TABLE IF NOT EXISTS codebase_jobs (
+            id CHAR(32) PRIMARY KEY,
+            workspace VARCHAR(255),
+            directory VARCHAR(1024),
+            active_key CHAR(64),
+            status VARCHAR(16),
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            chat_ids TEXT,
+            created_at DOUBLE,
+            started_at DOUBLE,
+            finished_at DOUBLE,
+            updated_at DOUBLE,
+            UNIQUE INDEX idx_codebase_jobs_active_key (active_key)
+        )
+        """
+        cursor.execute(create_codebase_jobs_table)
+        # Bring tables created by earlier versions up to date; every statement is idempotent
+        for migration in SCHEMA_MIGRATIONS:
+            cursor.execute(migration)
         connection.commit()
         logger.info("Database initialized and tables ensured.")
+    finally:
+        cursor.close()
+        connection.close()
+
+message_writer = MessageWriter(
+    create_db_connection,
+    MESSAGE_JOURNAL,
+    batch_size=MESSAGE_BATCH_SIZE,
+    max_pending=MESSAGE_QUEUE_SIZE,
+    max_pending_bytes=MESSAGE_QUEUE_BYTES,
+    max_retries=MESSAGE_WRITE_RETRIES,
+    backoff=MESSAGE_WRITE_BACKOFF,
+    replay_interval=MESSAGE_REPLAY_INTERVAL,
+    error_types=(Error,),
+    rejected_types=(mariadb.IntegrityError, mariadb.DataError),
+    dead_letter_path=MESSAGE_DEAD_LETTER
+).start(replay=False)
+atexit.register(message_writer.close)
+metrics_registry.gauge('prompter_message_queue', 'Chat messages queued for writing.', lambda: message_writer.stats()['queued'])
+
+def prepare_database():
+    """
+    Startup task: ensures the schema, then writes messages journaled while the database was unavailable.
+    """
+    init_db()
+    message_writer.replay_journal()
+
+# Schema checks and tokenizer loading run in the background, retried until they succeed, so the
+# process starts serving immediately and /readyz reports when it can handle chats.
+startup.background('database', prepare_database, backoff=DB_INIT_BACKOFF, max_backoff=DB_INIT_MAX_BACKOFF, error_types=(Error,))
+startup.background('tokenizer', lambda: get_encoding(MODEL), backoff=DB_INIT_BACKOFF, max_backoff=DB_INIT_MAX_BACKOFF)
+
+def history_from_token_rows(rows):
+    """
+    Converts (id, sender, token_count, content) rows into ledger history entries.
+    Returns (history, backfill) where backfill holds (token_count, id) pairs for rows
+    that had no stored count yet.
+    """
+    history = []
+    backfill = []
+    for message_id, sender, token_count, content in rows:
+        if token_count is None:
+            token_count = token_ledger.count_text(content or '')
+            backfill.append((token_count, message_id))
+        role = 'user' if sender == 'user' else 'assistant'
+        history.append({'id': message_id, 'role': role, 'content_tokens': token_count})
+    return history, backfill
+
+def fetch_history_token_counts(cursor, chat_id):
+    """
+    Returns the cached token counts of a chat's messages, oldest first.
+    Messages stored before token counts were recorded are counted once and backfilled.
+    """
+    cursor.execute(
+        "SELECT id, sender, token_count, IF(token_count IS NULL, content, NULL) "
+        "FROM messages WHERE chat_id = ? ORDER BY timestamp ASC, id ASC",
+        (chat_id,)
+    )
+    history, backfill = history_from_token_rows(cursor.fetchall())
+    if backfill:
+        cursor.executemany(BACKFILL_TOKEN_COUNTS, backfill)
+        cursor.connection.commit()
+        logger.debug("Backfilled token counts for %d messages in chat_id %s.", len(backfill), chat_id)
+    return history
+
+BACKFILL_TOKEN_COUNTS = "UPDATE messages SET token_count = ? WHERE id = ?"
+
+def id_placeholders(ids):
+    return ', '.join('?' for _ in ids)
+
+def fetch_summary_snippets(cursor, message_ids):
+    """
+    Returns the opening text of the user messages among message_ids, oldest first.
+    """
+    cursor.execute(
+        f"SELECT LEFT(content, 200) FROM messages WHERE sender = 'user' AND id IN ({id_placeholders(message_ids)}) "
+        "ORDER BY timestamp ASC, id ASC",
+        tuple(message_ids)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def fetch_recent_snippets(cursor, chat_id, limit=2):
+    """
+    Returns the opening text of the most recent messages in chat_id, used to rank codebase chunks.
+    """
+    cursor.execute(
+        "SELECT LEFT(content, 2000) FROM messages WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+        (chat_id, limit)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def count_chunk_tokens(text):
+    """
+    Token counter for index chunks, memoized by content hash so re-indexing after a small change is cheap.
+    """
+    key = hashlib.sha256(text.encode('utf-8')).digest()
+    tokens = chunk_token_cache.get(key)
+    if tokens is None:
+        tokens = token_ledger.count_text(text)
+        if len(chunk_token_cache) >= 100000:
+            chunk_token_cache.clear()
+        chunk_token_cache[key] = tokens
+    return tokens
+
+def build_codebase_index(content):
+    """
+    Builds the relevance index for a freshly loaded codebase, unless the full codebase is always sent.
+    """
+    if CODEBASE_MODE == 'full' or not content:
+        return None
+    header_patterns = [CODEBASE_FILE_HEADER] if CODEBASE_FILE_HEADER else None
+    return CodebaseIndex.build(content, count_chunk_tokens, header_patterns=header_patterns)
+
+def native_collector(workspace):
+    """
+    Returns the incremental collector of a workspace, creating it on first use.
+    """
+    with native_collectors_lock:
+        collector = native_collectors.get(workspace)
+        if collector is None:
+            if workspace == DEFAULT_WORKSPACE:
+                manifest_path = COLLECTOR_MANIFEST
+            else:
+                manifest_path = os.path.join(SNAPSHOT_DIR, f'{workspace}.manifest.json')
+            collector = IncrementalCollector(
+                WORKSPACES[workspace],
+                manifest_path=manifest_path,
+                extensions={ext.strip() for ext in COLLECTOR_EXTENSIONS.split(',')} if COLLECTOR_EXTENSIONS else None,
+                exclude_dirs={name.strip() for name in COLLECTOR_EXCLUDE.split(',')} if COLLECTOR_EXCLUDE else None,
+                count_text=token_ledger.count_text
+            )
+            native_collectors[workspace] = collector
+        return collector
+
+def collect_codebase(workspace=DEFAULT_WORKSPACE, progress=None):
+    """
+    Collects a workspace with the configured collector and returns (content, stats, content_tokens).
+    content_tokens is None when the token count is not already known.
+    """
+    directory = WORKSPACES[workspace]
+    if COLLECTOR_MODE == 'native':
+        collector = native_collector(workspace)
+        stats = collector.refresh(progress=progress)
+        return collector.content(), stats, stats['tokens']
+    started = time.perf_counter()
+    # The script always writes the same output file, so runs for different workspaces must not overlap,
+    # in this process or any other worker.
+    with script_lock, open(f"{CODEBASE_OUTPUT_FILE}.lock", 'a') as output_lock:
+        fcntl.flock(output_lock, fcntl.LOCK_EX)
+        logger.debug("Executing subprocess: %s %s", SCRIPT_NAME, directory)
+        subprocess.run([SCRIPT_NAME, directory], check=True)
+        logger.info("'codecollector' command executed successfully.")
+        if not os.path.exists(CODEBASE_OUTPUT_FILE):
+            raise FileNotFoundError(f"Output file '{CODEBASE_OUTPUT_FILE}' not found.")
+        with open(CODEBASE_OUTPUT_FILE, 'r', encoding='utf-8') as f:
+            content = f.read()
+    logger.info("Codebase content loaded from '%s'.", CODEBASE_OUTPUT_FILE)
+    if progress:
+        progress(bytes=len(content))
+    return content, {'bytes': len(content), 'elapsed': time.perf_counter() - started}, None
+
+def load_snapshot(snapshot_id):
+    """
+    Loads a stored snapshot into memory, reusing its stored index and token count when present.
+    """
+    content = snapshot_store.get_content(snapshot_id)
+    meta = snapshot_store.get_meta(snapshot_id)
+    index = snapshot_store.get_index(snapshot_id) if CODEBASE_MODE != 'full' else None
+    if index is None and CODEBASE_MODE != 'full':
+        index = build_codebase_index(content)
+        if index is not None:
+            snapshot_store.put_index(snapshot_id, index)
+    codebase = LoadedCodebase(content, index, snapshot_id)
+    if meta.get('prompt_tokens') is not None:
+        token_ledger.remember_prompt_tokens(codebase.prompt, meta['prompt_tokens'])
+    codebase.prompt_tokens = token_ledger.prompt_tokens(codebase.prompt) if codebase.prompt else 0
+    if meta.get('prompt_tokens') is None:
+        snapshot_store.update_meta(snapshot_id, prompt_tokens=codebase.prompt_tokens)
+    logger.info("Loaded codebase snapshot %.12s into memory.", snapshot_id)
+    return codebase
+
+def install_codebase(content, content_tokens=None, workspace=DEFAULT_WORKSPACE):
+    """
+    Stores content as a snapshot and makes it the workspace's current codebase.
+    Returns (snapshot_id, prompt_tokens).
+    """
+    snapshot_id = snapshot_store.put(content, name=workspace)
+    codebase = LoadedCodebase(content, build_codebase_index(content), snapshot_id)
+    if content_tokens is not None and codebase.prompt:
+        token_ledger.remember_prompt_tokens(
+            codebase.prompt, token_ledger.count_text(CODEBASE_PROMPT_PREFIX) + content_tokens
+        )
+    codebase.prompt_tokens = token_ledger.prompt_tokens(codebase.prompt) if codebase.prompt else 0
+    snapshot_store.update_meta(snapshot_id, prompt_tokens=codebase.prompt_tokens)
+    if codebase.index is not None:
+        snapshot_store.put_index(snapshot_id, codebase.index)
+    snapshot_cache.put(snapshot_id, codebase)
+    snapshot_store.set_workspace_snapshot(workspace, snapshot_id)
+    logger.debug("Codebase snapshot %.12s for workspace '%s' is %d tokens.", snapshot_id, workspace, codebase.prompt_tokens)
+    prune_snapshots()
+    return snapshot_id, codebase.prompt_tokens
+
+def prune_snapshots():
+    """
+    Deletes stored snapshots that no workspace or chat is pinned to, beyond the snapshot_keep most recent.
+    Skipped while the database is unreachable, since the chats' snapshots are unknown then.
+    """
+    try:
+        connection = create_db_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT DISTINCT snapshot_id FROM chat_history WHERE snapshot_id IS NOT NULL")
+            chat_snapshots = {row[0] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+            connection.close()
     except Error as e:
-        logger.exception("Error initializing the database.")
-        raise e
+        logger.warning("Not pruning codebase snapshots; chat snapshots could not be read (%s).", e)
+        return 0
+    return snapshot_store.prune(chat_snapshots, SNAPSHOT_KEEP)
+
+def workspace_codebase(workspace=DEFAULT_WORKSPACE):
+    """
+    Returns the current codebase of a workspace, or an empty codebase if none was loaded.
+    """
+    snapshot_id = snapshot_store.workspace_snapshot(workspace)
+    if not snapshot_id:
+        return EMPTY_CODEBASE
+    return snapshot_cache.get(snapshot_id)
+
+def chat_codebase(snapshot_id, workspace=DEFAULT_WORKSPACE):
+    """
+    Returns the codebase a chat is pinned to. Chats without a (stored) snapshot use the workspace's current one.
+    """
+    if snapshot_id and snapshot_store.exists(snapshot_id):
+        return snapshot_cache.get(snapshot_id)
+    return workspace_codebase(workspace)
+
+def workspace_summaries():
+    """
+    Returns the configured workspaces with the metadata of their current snapshots.
+    """
+    summaries = []
+    for name, directory in WORKSPACES.items():
+        snapshot_id = snapshot_store.workspace_snapshot(name)
+        summaries.append({
+            'name': name,
+            'directory': directory,
+            'snapshot': snapshot_store.get_meta(snapshot_id) if snapshot_id else None
+        })
+    return summaries
+
+def rebind_chats(chat_ids, snapshot_id):
+    """
+    Pins chats to a newly loaded snapshot.
+    """
+    connection = create_db_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f"UPDATE chat_history SET snapshot_id = ? WHERE id IN ({id_placeholders(chat_ids)})",
+            (snapshot_id, *chat_ids)
+        )
+        connection.commit()
     finally:
         cursor.close()
         connection.close()
 
-init_db()
+def run_codebase_job(job):
+    """
+    Background job body: collects the workspace, reporting progress on the job, then swaps it in.
+    Chats that asked for the load are pinned to the new snapshot.
+    """
+    content, stats, content_tokens = collect_codebase(job.workspace, progress=job.update)
+    stats['snapshot_id'], stats['prompt_tokens'] = install_codebase(content, content_tokens, job.workspace)
+    job.update(bytes=len(content), tokens=stats['prompt_tokens'])
+    if job.chat_ids:
+        rebind_chats(sorted(job.chat_ids), stats['snapshot_id'])
+    return stats
+
+snapshot_store = SnapshotStore(SNAPSHOT_DIR)
+snapshot_cache = SnapshotCache(load_snapshot, capacity=SNAPSHOT_CACHE_SIZE)
+codebase_jobs = CodebaseJobManager(
+    run_codebase_job,
+    store=DatabaseJobStore(
+        create_db_connection,
+        mariadb.IntegrityError,
+        retention=CODEBASE_JOB_RETENTION,
+        stale_after=CODEBASE_JOB_STALE_AFTER
+    )
+)
+
+def fetch_messages_by_id(cursor, message_ids):
+    """
+    Returns the API messages for message_ids, oldest first.
+    """
+    if not message_ids:
+        return []
+    cursor.execute(
+        f"SELECT sender, content FROM messages WHERE id IN ({id_placeholders(message_ids)}) ORDER BY timestamp ASC, id ASC",
+        tuple(message_ids)
+    )
+    return [
+        {"role": 'user' if sender == 'user' else 'assistant', "content": content}
+        for sender, content in cursor.fetchall()
+    ]
+
+def plan_chat_context(cursor, chat_id, draft, codebase):
+    """
+    Plans the context for sending draft in chat_id with the given codebase within the model's context window.
+    Used by both /chat and the token counting endpoints so the counts match what is sent.
+    Callers wait for the chat's queued messages before checking out the connection behind cursor,
+    so a slow write-behind flush cannot hold pool slots the writer needs.
+    """
+    history = fetch_history_token_counts(cursor, chat_id) if chat_id else []
+    query = draft
+    if chat_id and context_budgeter.uses_index(codebase.index):
+        query = '\n'.join([draft] + fetch_recent_snippets(cursor, chat_id))
+    with tracer.span('context.plan'):
+        plan = context_budgeter.plan(codebase.prompt, history, draft, index=codebase.index, query=query)
+    if plan['dropped_ids'] and context_budgeter.summary_tokens:
+        context_budgeter.add_summary(plan, fetch_summary_snippets(cursor, plan['dropped_ids']))
+    return plan
+
+def observe_completion(completion):
+    """
+    Records the latency phases and token usage of a finished completion stream in the metrics.
+    """
+    for phase in ('ttfb', 'ttft', 'duration'):
+        if completion.timing.get(phase) is not None:
+            upstream_seconds.observe(completion.timing[phase], phase=phase)
+
+def response_cache_key(plan, codebase, messages):
+    """
+    Returns the response cache key of a planned request. A full codebase prompt is keyed by its snapshot id.
+    """
+    full_codebase = plan['breakdown']['codebase_source'] == 'full' and codebase.snapshot_id
+    return cache_key(
+        MODEL, messages, prefix_id=codebase.snapshot_id if full_codebase else None, max_tokens=MAX_OUTPUT_TOKENS
+    )
 
-def count_tokens(messages, model=MODEL):
+def budget_header(breakdown):
     """
-    Counts the number of tokens in the messages list based on the model's tokenization.
+    Returns the context budget breakdown without the per-message list, for response metadata.
     """
+    return json.dumps({key: value for key, value in breakdown.items() if key != 'history'})
+
+def count_input_tokens(chat_id, new_message, workspace=DEFAULT_WORKSPACE):
+    """
+    Counts the input tokens for sending new_message in chat_id, as planned by the context budgeter.
+    Returns (total, breakdown).
+    """
+    if not chat_id:
+        plan = plan_chat_context(None, None, new_message, workspace_codebase(workspace))
+        return plan['breakdown']['total'], plan['breakdown']
+    message_writer.wait_for_chat(chat_id, MESSAGE_WRITE_WAIT)
+    connection = create_db_connection()
+    cursor = connection.cursor()
     try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        logger.warning(f"Model {model} not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding('cl100k_base')
-
-    if model.startswith("gpt-4"):
-        tokens_per_message = 3
-        tokens_per_name = 1
-    elif model.startswith("gpt-3.5-turbo"):
-        tokens_per_message = 4
-        tokens_per_name = -1
-    else:
-        tokens_per_message = 3
-        tokens_per_name = 1
-
-    token_count = 0
-    for message in messages:
-        token_count += tokens_per_message
-        for key, value in message.items():
-            token_count += len(encoding.encode(value))
-            if key == "name":
-                token_count += tokens_per_name
-    token_count += 3  # Every reply is primed with <|start|>assistant<|message|>
-    return token_count
+        cursor.execute("SELECT snapshot_id FROM chat_history WHERE id = ?", (chat_id,))
+        row = cursor.fetchone()
+        codebase = chat_codebase(row[0] if row else None, workspace)
+        plan = plan_chat_context(cursor, chat_id, new_message, codebase)
+        logger.debug("Planned %d prior messages from chat_id %s into token count.", plan['breakdown']['history_included'], chat_id)
+    finally:
+        cursor.close()
+        connection.close()
+    return plan['breakdown']['total'], plan['breakdown']
+
+def batch_history_query(chat_ids):
+    """
+    Returns (query, params) reading the snapshot and messages of every chat in chat_ids, for batch_histories.
+    Queries built for the batch endpoint use '?' placeholders; asgi_server converts them for aiomysql.
+    """
+    return (
+        "SELECT h.id, h.snapshot_id, m.id, m.sender, m.token_count, IF(m.token_count IS NULL, m.content, NULL) "
+        "FROM chat_history h LEFT JOIN messages m ON m.chat_id = h.id "
+        f"WHERE h.id IN ({id_placeholders(chat_ids)}) ORDER BY h.id, m.timestamp ASC, m.id ASC",
+        tuple(chat_ids)
+    )
+
+def batch_histories(rows):
+    """
+    Returns ({chat_id: history}, {chat_id: snapshot_id}, backfill) from the rows of batch_history_query.
+    Unknown chats are missing from both dicts; backfill holds the (token_count, id) pairs of messages
+    counted now, to be stored with BACKFILL_TOKEN_COUNTS.
+    """
+    grouped = {}
+    snapshots = {}
+    for chat_id, snapshot_id, *message in rows:
+        snapshots[chat_id] = snapshot_id
+        grouped.setdefault(chat_id, [])
+        if message[0] is not None:
+            grouped[chat_id].append(message)
+    histories = {}
+    backfill = []
+    for chat_id, chat_rows in grouped.items():
+        histories[chat_id], chat_backfill = history_from_token_rows(chat_rows)
+        backfill.extend(chat_backfill)
+    return histories, snapshots, backfill
+
+def batch_recent_query(chat_ids, limit=2):
+    """
+    Returns (query, params) reading the opening text of the last 'limit' messages of every chat in chat_ids.
+    """
+    return (
+        "SELECT chat_id, snippet FROM ("
+        "SELECT chat_id, LEFT(content, 2000) AS snippet, "
+        "ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp DESC, id DESC) AS position "
+        f"FROM messages WHERE chat_id IN ({id_placeholders(chat_ids)})"
+        ") recent WHERE position <= ? ORDER BY chat_id, position",
+        (*chat_ids, limit)
+    )
+
+def batch_summary_query(message_ids):
+    """
+    Returns (query, params) reading the opening text of the user messages among message_ids, oldest first.
+    """
+    return (
+        f"SELECT chat_id, LEFT(content, 200) FROM messages WHERE sender = 'user' AND id IN ({id_placeholders(message_ids)}) "
+        "ORDER BY timestamp ASC, id ASC",
+        tuple(message_ids)
+    )
+
+def group_snippets(rows):
+    """
+    Groups (chat_id, snippet) rows into {chat_id: snippets}.
+    """
+    snippets = {}
+    for chat_id, snippet in rows:
+        snippets.setdefault(chat_id, []).append(snippet)
+    return snippets
+
+def batch_codebases(items, snapshots, workspace):
+    """
+    Returns ({chat_id: codebase}, indexed) for the items of a token count batch: drafts without a
+    chat (chat_id None) get the workspace's current codebase and chats their pinned snapshot.
+    Items whose chat is missing from snapshots are left out. indexed lists the chats whose
+    codebase uses the relevance index, so their recent messages are needed.
+    """
+    codebases = {
+        chat_id: chat_codebase(snapshots[chat_id], workspace) if chat_id is not None else workspace_codebase(workspace)
+        for chat_id, _ in items if chat_id is None or chat_id in snapshots
+    }
+    indexed = sorted(
+        chat_id for chat_id, codebase in codebases.items()
+        if chat_id is not None and context_budgeter.uses_index(codebase.index)
+    )
+    return codebases, indexed
+
+def plan_token_batch(items, draft_counts, histories, codebases, recent):
+    """
+    Plans every (chat_id, draft) item of a token count batch from prefetched data: draft
+    token counts, {chat_id: history}, {chat_id: codebase} (None for chats without a
+    chat_id) and {chat_id: recent snippets} for chats using the codebase index.
+    Returns one plan per item, or None for items whose chat does not exist.
+    """
+    plans = []
+    with tracer.span('context.plan'):
+        for (chat_id, draft), draft_tokens in zip(items, draft_counts):
+            if chat_id not in codebases:
+                plans.append(None)
+                continue
+            codebase = codebases[chat_id]
+            query = '\n'.join([draft] + recent[chat_id]) if chat_id in recent else draft
+            plans.append(context_budgeter.plan(
+                codebase.prompt, histories.get(chat_id, []), draft,
+                index=codebase.index, query=query, draft_tokens=draft_tokens
+            ))
+    return plans
+
+def summarize_token_batch(items, plans, summaries):
+    """
+    Adds the summaries of dropped history to the plans of a token count batch.
+    summaries holds {chat_id: snippets} of the dropped user messages.
+    """
+    for (chat_id, _), plan in zip(items, plans):
+        if plan and plan['dropped_ids']:
+            context_budgeter.add_summary(plan, summaries.get(chat_id, []))
+
+def count_input_tokens_batch(items, workspace=DEFAULT_WORKSPACE):
+    """
+    Counts the input tokens of several (chat_id, draft) pairs, planned as count_input_tokens does.
+    Drafts are encoded in parallel and every chat's history is read in one query.
+    Returns one plan per item, or None for items whose chat does not exist.
+    """
+    with tracer.span('tokenize'):
+        draft_counts = token_ledger.count_texts([draft for _, draft in items], COUNT_TOKENS_THREADS)
+    chat_ids = sorted({chat_id for chat_id, _ in items if chat_id is not None})
+    histories, snapshots, recent = {}, {}, {}
+    connection = cursor = None
+    try:
+        if chat_ids:
+            for chat_id in chat_ids:
+                message_writer.wait_for_chat(chat_id, MESSAGE_WRITE_WAIT)
+            connection = create_db_connection()
+            cursor = connection.cursor()
+            cursor.execute(*batch_history_query(chat_ids))
+            histories, snapshots, backfill = batch_histories(cursor.fetchall())
+            if backfill:
+                cursor.executemany(BACKFILL_TOKEN_COUNTS, backfill)
+                connection.commit()
+                logger.debug("Backfilled token counts for %d messages in %d chats.", len(backfill), len(histories))
+        codebases, indexed = batch_codebases(items, snapshots, workspace)
+        if indexed:
+            cursor.execute(*batch_recent_query(indexed))
+            recent = group_snippets(cursor.fetchall())
+        plans = plan_token_batch(items, draft_counts, histories, codebases, recent)
+        dropped = [message_id for plan in plans if plan for message_id in plan['dropped_ids']]
+        if dropped and context_budgeter.summary_tokens:
+            cursor.execute(*batch_summary_query(dropped))
+            summarize_token_batch(items, plans, group_snippets(cursor.fetchall()))
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+    return plans
+
+def parse_token_batch(data):
+    """
+    Validates a /count_tokens_batch payload. Returns (items, workspace, error) where items
+    holds (chat_id, draft) pairs and error, if not None, is the message for a 400 response.
+    A chat_id must be an integer or null; 0 means no chat, as in /count_tokens.
+    """
+    raw_items = data.get('items')
+    if not isinstance(raw_items, list) or not raw_items:
+        return None, None, 'No items provided.'
+    if len(raw_items) > COUNT_TOKENS_BATCH_MAX:
+        return None, None, f"At most {COUNT_TOKENS_BATCH_MAX} items per request."
+    items = []
+    for item in raw_items:
+        if not isinstance(item, dict) or not isinstance(item.get('draft'), str):
+            return None, None, "Every item needs a 'draft' string."
+        chat_id = item.get('chat_id')
+        if chat_id is not None and (not isinstance(chat_id, int) or isinstance(chat_id, bool)):
+            return None, None, "Every 'chat_id' must be an integer or null."
+        items.append((chat_id or None, item['draft'].strip()))
+    workspace = data.get('workspace') or DEFAULT_WORKSPACE
+    if workspace not in WORKSPACES:
+        return None, None, f"Unknown workspace '{workspace}'."
+    return items, workspace, None
+
+def token_batch_result(items, plans):
+    """
+    Returns the /count_tokens_batch response body for the plans of a batch.
+    """
+    results = []
+    for (chat_id, _), plan in zip(items, plans):
+        if plan is None:
+            results.append({'chat_id': chat_id, 'error': 'Chat history not found.'})
+        else:
+            results.append({
+                'chat_id': chat_id, 'input_token_count': plan['breakdown']['total'], 'breakdown': plan['breakdown']
+            })
+    total = sum(plan['breakdown']['total'] for plan in plans if plan)
+    return {'items': results, 'total_input_token_count': total}
+
+def count_tokens_response(endpoint):
+    """
+    Shared implementation of the token counting endpoints.
+    Expects a JSON payload with 'chat_id' (optional), 'workspace' (optional) and 'new_message'.
+    """
+    try:
+        data = request.get_json()
+        chat_id = data.get('chat_id')
+        new_message = data.get('new_message', '').strip()
+        if not new_message:
+            return jsonify({'error': 'No new_message provided.'}), 400
+        workspace = data.get('workspace') or DEFAULT_WORKSPACE
+        if workspace not in WORKSPACES:
+            return jsonify({'error': f"Unknown workspace '{workspace}'."}), 400
+        try:
+            token_count, breakdown = count_input_tokens(chat_id, new_message, workspace)
+        except Error:
+            logger.exception("Database error while fetching messages for token counting.")
+            return jsonify({'error': 'Database error while fetching messages.'}), 500
+        logger.debug("Total input tokens: %d", token_count)
+        return jsonify({'input_token_count': token_count, 'breakdown': breakdown}), 200
+    except Exception as e:
+        logger.exception("Error in %s endpoint.", endpoint)
+        return jsonify({'error': 'Failed to count tokens.'}), 500
+
+@app.before_request
+def start_trace():
+    """
+    Opens the trace of the request, named after its route pattern so ids do not split the metrics.
+    """
+    tracer.start(request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+
+@app.after_request
+def finish_trace(response):
+    """
+    Finishes the request's trace, unless the route streams its body and finishes it once the stream ends.
+    """
+    trace = tracer.current()
+    if trace is not None and not trace.deferred:
+        trace.finish(response.status_code)
+    return response
 
 @app.route('/run_codecollector', methods=['POST'])
 def run_codecollector():
     """
-    Endpoint to execute the 'codecollector' command and retrieve the consolidated codebase.
+    Endpoint to start loading a workspace's codebase in the background.
+    Accepts an optional JSON payload with 'workspace' and 'chat_id' (a chat to pin to the new snapshot).
+    Returns the job id immediately; concurrent requests share the job already running.
     """
-    global codebase_content
     logger.info("Received request to run codecollector.")
+    data = request.get_json(silent=True) or {}
+    workspace = data.get('workspace') or DEFAULT_WORKSPACE
+    if workspace not in WORKSPACES:
+        return jsonify({'error': f"Unknown workspace '{workspace}'."}), 400
     try:
-        output_file = '/home/brandon/Projects/prompter/codebase.prompt'
-        logger.debug(f"Executing subprocess: {SCRIPT_NAME} {CODEBASE_DIR}")
-        subprocess.run([SCRIPT_NAME, CODEBASE_DIR], check=True)
-        logger.info("'codecollector' command executed successfully.")
-        if not os.path.exists(output_file):
-            logger.error(f"Output file '{output_file}' not found.")
-            return jsonify({'error': f"Output file '{output_file}' not found."}), 500
-        with open(output_file, 'r', encoding='utf-8') as f:
-            codebase_content = f.read()
-        logger.info(f"Codebase content loaded from '{output_file}'.")
-        return jsonify({'message': 'Codebase loaded successfully.'}), 200
-    except subprocess.CalledProcessError as e:
-        logger.exception("Command execution failed.")
-        return jsonify({'error': f"Command execution failed: {str(e)}"}), 500
-    except Exception as ex:
-        logger.exception("An unexpected error occurred.")
-        return jsonify({'error': str(ex)}), 500
+        job, coalesced = codebase_jobs.submit(workspace, WORKSPACES[workspace], chat_id=data.get('chat_id'))
+    except Error as e:
+        logger.exception("Database error while starting a codebase load.")
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        logger.exception("An unexpected error occurred while starting a codebase load.")
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'coalesced': coalesced,
+        'status_url': f"/codebase_jobs/{job['job_id']}"
+    }), 202
+
+@app.route('/workspaces', methods=['GET'])
+def list_workspaces():
+    """
+    Endpoint to list the configured workspaces and the metadata of their current snapshots.
+    """
+    return jsonify({'workspaces': workspace_summaries()}), 200
+
+@app.route('/codebase_jobs/<job_id>', methods=['GET'])
+def codebase_job_status(job_id):
+    """
+    Endpoint to report the status and progress of a codebase load job.
+    """
+    try:
+        job = codebase_jobs.get(job_id)
+    except Error as e:
+        logger.exception("Database error while fetching codebase job %s.", job_id)
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        logger.exception("An unexpected error occurred while fetching codebase job %s.", job_id)
+        return jsonify({'error': str(e)}), 500
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job), 200
 
 def generate_stream(openai_response):
     """
@@ -175,13 +941,10 @@ def generate_stream(openai_response):
     try:
         for chunk in openai_response.iter_lines():
             if chunk:
-                if chunk.startswith(b'data: '):
-                    chunk = chunk[len(b'data: '):]
-                if chunk == b'[DONE]':
+                delta = parse_stream_chunk(chunk)
+                if delta is None:
                     logger.debug("Received [DONE] from OpenAI stream.")
                     break
-                data = json.loads(chunk.decode('utf-8'))
-                delta = data['choices'][0]['delta'].get('content', '')
                 yield delta
     except Exception as e:
         logger.exception("Error while generating stream.")
@@ -203,63 +966,39 @@ def count_tokens_route():
     Endpoint to count tokens based on the full input including assistant message, conversation history, and new message.
     Expects a JSON payload with 'chat_id' (optional) and 'new_message'.
     """
-    try:
-        data = request.get_json()
-        chat_id = data.get('chat_id')
-        new_message = data.get('new_message', '').strip()
-        if not new_message:
-            return jsonify({'error': 'No new_message provided.'}), 400
-
-        messages = []
-
-        # Add assistant message with codebase_content
-        if codebase_content:
-            assistant_message = f"You have access to the following codebase:\n\n{codebase_content}"
-            messages.append({"role": "assistant", "content": assistant_message})
-            logger.debug("Added assistant message with codebase content to messages for token counting.")
-
-        if chat_id:
-            connection = create_db_connection()
-            cursor = connection.cursor()
-            try:
-                cursor.execute(
-                    "SELECT sender, content FROM messages WHERE chat_id = ? ORDER BY timestamp ASC",
-                    (chat_id,)
-                )
-                prior_messages = cursor.fetchall()
-                for sender, content in prior_messages:
-                    role = 'user' if sender == 'user' else 'assistant'
-                    messages.append({"role": role, "content": content})
-                logger.debug(f"Added {len(prior_messages)} prior messages from chat_id {chat_id} to messages for token counting.")
-            except Error as e:
-                logger.exception("Database error while fetching messages for token counting.")
-                return jsonify({'error': 'Database error while fetching messages.'}), 500
-            finally:
-                cursor.close()
-                connection.close()
-
-        # Add the new user message
-        messages.append({"role": "user", "content": new_message})
-        logger.debug("Added new user message to messages for token counting.")
-
-        # Count tokens
-        token_count = count_tokens(messages, MODEL)
-        logger.debug(f"Total input tokens: {token_count}")
-        return jsonify({'input_token_count': token_count}), 200
+    return count_tokens_response('/count_tokens')
 
+@app.route('/count_tokens_batch', methods=['POST'])
+def count_tokens_batch_route():
+    """
+    Endpoint to count input tokens for many drafts at once.
+    Expects a JSON payload with 'items', a list of {'chat_id' (optional), 'draft'}, and an optional 'workspace'.
+    Returns the count and breakdown of every item, in order, and their total.
+    """
+    try:
+        items, workspace, error = parse_token_batch(request.get_json(silent=True) or {})
+        if error:
+            return jsonify({'error': error}), 400
+        try:
+            plans = count_input_tokens_batch(items, workspace)
+        except Error:
+            logger.exception("Database error while fetching messages for batch token counting.")
+            return jsonify({'error': 'Database error while fetching messages.'}), 500
+        return jsonify(token_batch_result(items, plans)), 200
     except Exception as e:
-        logger.exception("Error in /count_tokens endpoint.")
+        logger.exception("Error in /count_tokens_batch endpoint.")
         return jsonify({'error': 'Failed to count tokens.'}), 500
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """
     Endpoint to handle chat messages.
-    Expects a JSON payload with the user's message and optional chat_id.
+    Expects a JSON payload with the user's message and optional chat_id and workspace.
+    New chats are pinned to the workspace's current codebase snapshot.
     Streams the response from OpenAI to the client along with output token counts.
     """
-    global codebase_content
     logger.info("Received chat request.")
+    trace = tracer.current()
     connection = None
     cursor = None
     try:
@@ -269,118 +1008,145 @@ def chat():
         if not user_message:
             logger.warning("No message provided in the request.")
             return jsonify({'error': 'No message provided.'}), 400
-        logger.debug(f"User message: {user_message}")
+        if not message_writer.fits(user_message):
+            logger.warning("Message of %d characters is too long to store.", len(user_message))
+            return jsonify({'error': 'Message is too long.'}), 400
+        workspace = data.get('workspace') or DEFAULT_WORKSPACE
+        if workspace not in WORKSPACES:
+            return jsonify({'error': f"Unknown workspace '{workspace}'."}), 400
+        logger.debug("User message of %d characters.", len(user_message))
 
+        if chat_id:
+            message_writer.wait_for_chat(chat_id, MESSAGE_WRITE_WAIT)
         connection = create_db_connection()
         cursor = connection.cursor()
 
         if chat_id:
-            logger.debug(f"Continuing existing chat with ID: {chat_id}")
-            cursor.execute("SELECT id FROM chat_history WHERE id = ?", (chat_id,))
-            if cursor.fetchone() is None:
-                logger.warning(f"Chat ID {chat_id} not found.")
+            logger.debug("Continuing existing chat with ID: %s", chat_id)
+            cursor.execute("SELECT id, snapshot_id FROM chat_history WHERE id = ?", (chat_id,))
+            row = cursor.fetchone()
+            if row is None:
+                logger.warning("Chat ID %s not found.", chat_id)
                 return jsonify({'error': 'Chat history not found.'}), 404
+            codebase = chat_codebase(row[1], workspace)
         else:
+            codebase = workspace_codebase(workspace)
             title = extract_keywords(user_message) or "Untitled Chat"
             created_at = datetime.utcnow()
-            cursor.execute("INSERT INTO chat_history (title, created_at) VALUES (?, ?)", (title, created_at))
+            cursor.execute(
+                "INSERT INTO chat_history (title, created_at, snapshot_id) VALUES (?, ?, ?)",
+                (title, created_at, codebase.snapshot_id)
+            )
             connection.commit()
             chat_id = cursor.lastrowid
-            logger.info(f"Created new chat history with ID: {chat_id} and title: '{title}'")
+            history_cache.invalidate()
+            logger.info("Created new chat history with ID: %s and title: '%s'", chat_id, title)
 
-        timestamp = datetime.utcnow()
-        cursor.execute(
-            "INSERT INTO messages (chat_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
-            (chat_id, 'user', user_message, timestamp)
-        )
-        connection.commit()
-        logger.debug(f"Inserted user message into chat_id {chat_id}.")
+        plan = plan_chat_context(cursor, chat_id, user_message, codebase)
+        history_messages = fetch_messages_by_id(cursor, plan['included_ids'])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Context budget: %s", budget_header(plan['breakdown']))
+        # Nothing else is read; hand the connection back before waiting on the model
+        cursor.close()
+        connection.close()
+        cursor = connection = None
 
-        cursor.execute(
-            "SELECT sender, content FROM messages WHERE chat_id = ? ORDER BY timestamp ASC",
-            (chat_id,)
-        )
-        prior_messages = cursor.fetchall()
-        messages = []
-        if codebase_content:
-            assistant_message = f"You have access to the following codebase:\n\n{codebase_content}"
-            messages.append({"role": "assistant", "content": assistant_message})
-        for sender, content in prior_messages:
-            role = 'user' if sender == 'user' else 'assistant'
-            messages.append({"role": role, "content": content})
+        with trace.span('tokenize'):
+            user_message_tokens = token_ledger.count_text(user_message)
+        message_writer.enqueue(chat_id, 'user', user_message, datetime.utcnow(), user_message_tokens)
+        logger.debug("Queued user message for chat_id %s.", chat_id)
+
+        messages = context_budgeter.build_messages(plan, history_messages, user_message, codebase.prefix_message)
+        cached_key = None
+        if response_cache is not None:
+            cached_key = response_cache_key(plan, codebase, messages)
+            cached = response_cache.get(cached_key)
+            if cached is not None:
+                bot_response, output_token_count = cached
+                logger.info("Response cache hit for chat_id %s; replaying cached answer.", chat_id)
+                message_writer.enqueue(chat_id, 'bot', bot_response, datetime.utcnow(), output_token_count)
+
+                def replay_cached():
+                    try:
+                        stream_bytes_total.inc(len(bot_response.encode('utf-8')))
+                        yield bot_response
+                        with trace.span('db.persist'):
+                            message_writer.wait_for_chat(chat_id, MESSAGE_WRITE_WAIT)
+                        yield f"\n[TOKEN_COUNT: {output_token_count}]\n"
+                    finally:
+                        trace.finish()
+
+                trace.defer()
+                return Response(
+                    replay_cached(),
+                    mimetype='text/plain',
+                    headers={'X-Context-Budget': budget_header(plan['breakdown']), 'X-Response-Cache': 'hit'}
+                )
 
         api_payload = {
             "model": MODEL,
             "messages": messages,
+            "max_tokens": MAX_OUTPUT_TOKENS,
             "stream": True
         }
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {API_KEY}'
-        }
+        if API_STREAM_USAGE:
+            api_payload["stream_options"] = {"include_usage": True}
         logger.debug("Sending request to OpenAI API.")
-        openai_response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=headers,
-            json=api_payload,
-            stream=True
-        )
-        if openai_response.status_code != 200:
-            error_message = openai_response.json().get('error', {}).get('message', 'API request failed.')
-            logger.error(f"OpenAI API request failed: {error_message}")
-            return jsonify({'error': error_message}), openai_response.status_code
-        logger.info("OpenAI API request successful. Streaming response to client.")
+        tokens_total.inc(plan['breakdown']['total'], direction='in')
+        with trace.span('upstream.request'):
+            completion = completion_client.stream_chat(api_payload)
+        if completion.status_code != 200:
+            error_message = completion.error_message()
+            completion.close()
+            logger.error("OpenAI API request failed: %s", error_message)
+            return jsonify({'error': error_message}), completion.status_code
+        logger.info("OpenAI API request successful after %.3fs. Streaming response to client.", completion.timing['ttfb'])
 
         def generate_and_store():
-            bot_response = ""
-            output_token_count = 0
-            try:
-                encoding = tiktoken.encoding_for_model(MODEL)
-            except KeyError:
-                encoding = tiktoken.get_encoding('cl100k_base')
+            parts = []
+            failed = False
             try:
-                for chunk in openai_response.iter_lines():
-                    if chunk:
-                        if chunk.startswith(b'data: '):
-                            chunk = chunk[len(b'data: '):]
-                        if chunk == b'[DONE]':
-                            logger.debug("Received [DONE] from OpenAI stream.")
-                            break
-                        data = json.loads(chunk.decode('utf-8'))
-                        delta = data['choices'][0]['delta'].get('content', '')
-                        yield delta
-                        if delta:
-                            bot_response += delta
-                            tokens = encoding.encode(delta)
-                            output_token_count += len(tokens)
+                with trace.span('upstream.stream'):
+                    for text in coalesce_deltas(completion.iter_deltas(), STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS):
+                        if not parts and completion.timing['ttft'] is not None:
+                            trace.record('upstream.first_token', completion.timing['ttft'])
+                        parts.append(text)
+                        stream_bytes_total.inc(len(text.encode('utf-8')))
+                        yield text
+                logger.debug("Completion timing: %s", completion.timing)
+                observe_completion(completion)
+                bot_response = ''.join(parts)
                 if bot_response.strip():
-                    try:
-                        bot_conn = create_db_connection()
-                        bot_cursor = bot_conn.cursor()
-                        bot_timestamp = datetime.utcnow()
-                        bot_cursor.execute(
-                            "INSERT INTO messages (chat_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
-                            (chat_id, 'bot', bot_response, bot_timestamp)
-                        )
-                        bot_conn.commit()
-                        logger.debug(f"Inserted bot message into chat_id {chat_id}.")
-                        yield f"\n[TOKEN_COUNT: {output_token_count}]\n"
-                    except Error as e:
-                        logger.exception("Failed to insert bot message into the database.")
-                        yield f"\n[Error]: Failed to store bot message: {str(e)}"
-                    finally:
-                        if 'bot_cursor' in locals() and bot_cursor:
-                            bot_cursor.close()
-                        if 'bot_conn' in locals() and bot_conn:
-                            bot_conn.close()
+                    # Prefer the API's own count; otherwise encode the whole answer once
+                    output_token_count = completion.completion_tokens()
+                    if not output_token_count:
+                        with trace.span('tokenize'):
+                            output_token_count = token_ledger.count_text(bot_response)
+                    tokens_total.inc(output_token_count, direction='out')
+                    with trace.span('db.persist'):
+                        message_writer.enqueue(chat_id, 'bot', bot_response, datetime.utcnow(), output_token_count)
+                        logger.debug("Queued bot message for chat_id %s.", chat_id)
+                        if cached_key:
+                            response_cache.put(cached_key, bot_response, output_token_count)
+                        # The trailer ends the turn; once the client sees it, whichever worker takes
+                        # the next request must be able to read this message back.
+                        message_writer.wait_for_chat(chat_id, MESSAGE_WRITE_WAIT)
+                    yield f"\n[TOKEN_COUNT: {output_token_count}]\n"
                 else:
                     logger.warning("Bot response is empty. No insertion performed.")
                     yield "\n[TOKEN_COUNT: 0]\n"
             except Exception as e:
+                failed = True
                 logger.exception("Error while streaming and storing bot response.")
                 yield f"\n[Error]: {str(e)}"
+            finally:
+                trace.finish(error=failed)
 
-        return Response(generate_and_store(), mimetype='text/plain')
+        headers = {'X-Context-Budget': budget_header(plan['breakdown'])}
+        if cached_key:
+            headers['X-Response-Cache'] = 'miss'
+        trace.defer()
+        return Response(generate_and_store(), mimetype='text/plain', headers=headers)
 
     except Error as e:
         logger.exception("Database error during chat processing.")
@@ -394,19 +1160,86 @@ def chat():
         if connection:
             connection.close()
 
+def page_args(args, default_limit):
+    """
+    Reads the keyset pagination arguments '?before=<id>&limit=<n>' from request args.
+    """
+    before = args.get('before', type=int)
+    limit = args.get('limit', default_limit, type=int)
+    return before, max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+def fetch_history_page(cursor, before, limit):
+    """
+    Returns (histories, next_before) for the page of chats created before chat 'before', newest first.
+    Returns None when the 'before' chat does not exist.
+    """
+    if before is None:
+        cursor.execute(
+            "SELECT id, title, created_at FROM chat_history ORDER BY created_at DESC, id DESC LIMIT ?",
+            (limit + 1,)
+        )
+    else:
+        cursor.execute("SELECT created_at FROM chat_history WHERE id = ?", (before,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute(
+            "SELECT id, title, created_at FROM chat_history "
+            "WHERE created_at < ? OR (created_at = ? AND id < ?) "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (row['created_at'], row['created_at'], before, limit + 1)
+        )
+    histories = cursor.fetchall()
+    next_before = histories[limit - 1]['id'] if len(histories) > limit else None
+    return histories[:limit], next_before
+
+def fetch_message_page(cursor, chat_id, before, limit):
+    """
+    Returns (messages, next_before) for the latest page of messages of chat_id sent before message 'before',
+    in chronological order. Returns None when the 'before' message is not part of the chat.
+    """
+    if before is None:
+        cursor.execute(
+            "SELECT id, sender, content, timestamp FROM messages WHERE chat_id = ? "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (chat_id, limit + 1)
+        )
+    else:
+        cursor.execute("SELECT timestamp FROM messages WHERE id = ? AND chat_id = ?", (before, chat_id))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute(
+            "SELECT id, sender, content, timestamp FROM messages "
+            "WHERE chat_id = ? AND (timestamp < ? OR (timestamp = ? AND id < ?)) "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (chat_id, row['timestamp'], row['timestamp'], before, limit + 1)
+        )
+    messages = cursor.fetchall()
+    next_before = messages[limit - 1]['id'] if len(messages) > limit else None
+    return messages[:limit][::-1], next_before
+
 @app.route('/history', methods=['GET'])
 def get_history():
     """
-    Endpoint to retrieve a list of chat histories.
+    Endpoint to retrieve a page of chat histories, newest first.
+    Accepts '?before=<chat_id>&limit=<n>'; 'next_before' in the response is the cursor of the next page.
     """
     connection = None
     cursor = None
     try:
-        connection = create_db_connection()
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT id, title, created_at FROM chat_history ORDER BY created_at DESC")
-        histories = cursor.fetchall()
-        return jsonify({'histories': histories}), 200
+        before, limit = page_args(request.args, HISTORY_PAGE_SIZE)
+        page = history_cache.get((before, limit))
+        generation = history_cache.generation
+        if page is None:
+            connection = create_db_connection()
+            cursor = connection.cursor(dictionary=True)
+            page = fetch_history_page(cursor, before, limit)
+            if page is None:
+                return jsonify({'error': 'Unknown before cursor.'}), 400
+            history_cache.put((before, limit), page, generation)
+        histories, next_before = page
+        return jsonify({'histories': histories, 'next_before': next_before}), 200
     except Error as e:
         logger.exception("Error fetching chat histories.")
         return jsonify({'error': str(e)}), 500
@@ -423,26 +1256,29 @@ def get_history():
 def get_chat_history(chat_id):
     """
     Endpoint to retrieve messages for a specific chat history.
+    Returns the latest page of messages; '?before=<message_id>&limit=<n>' pages back through older ones.
     """
     connection = None
     cursor = None
     try:
+        before, limit = page_args(request.args, HISTORY_MESSAGE_PAGE_SIZE)
+        message_writer.wait_for_chat(chat_id, MESSAGE_WRITE_WAIT)
         connection = create_db_connection()
         cursor = connection.cursor(dictionary=True)
         cursor.execute("SELECT id, title, created_at FROM chat_history WHERE id = ?", (chat_id,))
         chat = cursor.fetchone()
         if not chat:
-            logger.warning(f"Chat history with id {chat_id} not found.")
+            logger.warning("Chat history with id %s not found.", chat_id)
             return jsonify({'error': 'Chat history not found.'}), 404
-        cursor.execute(
-            "SELECT sender, content, timestamp FROM messages WHERE chat_id = ? ORDER BY timestamp ASC",
-            (chat_id,)
-        )
-        messages = cursor.fetchall()
-        logger.debug(f"Retrieved {len(messages)} messages for chat_id {chat_id}.")
+        page = fetch_message_page(cursor, chat_id, before, limit)
+        if page is None:
+            return jsonify({'error': 'Unknown before cursor.'}), 400
+        messages, next_before = page
+        logger.debug("Retrieved %d messages for chat_id %s.", len(messages), chat_id)
         return jsonify({
             'chat': chat,
-            'messages': messages
+            'messages': messages,
+            'next_before': next_before
         }), 200
     except Error as e:
         logger.exception("Error fetching specific chat history.")
@@ -462,53 +1298,95 @@ def count_tokens_full_route():
     Endpoint to count the full input tokens including assistant message, conversation history, and new message.
     Expects a JSON payload with 'chat_id' (optional) and 'new_message'.
     """
-    try:
-        data = request.get_json()
-        chat_id = data.get('chat_id')
-        new_message = data.get('new_message', '').strip()
-        if not new_message:
-            return jsonify({'error': 'No new_message provided.'}), 400
+    return count_tokens_response('/count_tokens_full')
 
-        messages = []
+@app.route('/completion_stats', methods=['GET'])
+def completion_stats():
+    """
+    Endpoint to report completion API latency (time to first byte / first token) and retries.
+    """
+    return jsonify(completion_client.timings.stats()), 200
 
-        # Add assistant message with codebase_content
-        if codebase_content:
-            assistant_message = f"You have access to the following codebase:\n\n{codebase_content}"
-            messages.append({"role": "assistant", "content": assistant_message})
-            logger.debug("Added assistant message with codebase content to messages for token counting.")
+@app.route('/db_pool', methods=['GET'])
+def db_pool_stats():
+    """
+    Endpoint to report database connection pool metrics.
+    """
+    return jsonify(db_pool.stats()), 200
 
-        if chat_id:
-            connection = create_db_connection()
-            cursor = connection.cursor()
-            try:
-                cursor.execute(
-                    "SELECT sender, content FROM messages WHERE chat_id = ? ORDER BY timestamp ASC",
-                    (chat_id,)
-                )
-                prior_messages = cursor.fetchall()
-                for sender, content in prior_messages:
-                    role = 'user' if sender == 'user' else 'assistant'
-                    messages.append({"role": role, "content": content})
-                logger.debug(f"Added {len(prior_messages)} prior messages from chat_id {chat_id} to messages for token counting.")
-            except Error as e:
-                logger.exception("Database error while fetching messages for token counting.")
-                return jsonify({'error': 'Database error while fetching messages.'}), 500
-            finally:
-                cursor.close()
-                connection.close()
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Liveness endpoint: the process is up and serving requests.
+    """
+    return jsonify({'status': 'ok'}), 200
 
-        # Add the new user message
-        messages.append({"role": "user", "content": new_message})
-        logger.debug("Added new user message to messages for token counting.")
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """
+    Readiness endpoint: 200 once the database schema and tokenizer are ready, 503 before.
+    Includes the startup phase timings and the state of each startup check.
+    """
+    report = startup.report()
+    return jsonify(report), 200 if report['ready'] else 503
 
-        # Count tokens
-        token_count = count_tokens(messages, MODEL)
-        logger.debug(f"Total input tokens: {token_count}")
-        return jsonify({'input_token_count': token_count}), 200
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Endpoint to expose request, span, token and upstream latency metrics in the Prometheus text format.
+    """
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
-    except Exception as e:
-        logger.exception("Error in /count_tokens_full endpoint.")
-        return jsonify({'error': 'Failed to count tokens.'}), 500
+@app.route('/traces', methods=['GET'])
+def slow_traces():
+    """
+    Endpoint to list the spans of recent requests slower than trace_slow_threshold, most recent first.
+    """
+    return jsonify({'threshold': TRACE_SLOW_THRESHOLD, 'traces': tracer.slow_traces()}), 200
+
+@app.route('/response_cache', methods=['GET'])
+def response_cache_stats():
+    """
+    Endpoint to report response cache metrics.
+    """
+    if response_cache is None:
+        return jsonify({'backend': 'off'}), 200
+    return jsonify(response_cache.stats()), 200
+
+@app.route('/message_writer', methods=['GET'])
+def message_writer_stats():
+    """
+    Endpoint to report write-behind message persistence metrics.
+    """
+    return jsonify(message_writer.stats()), 200
+
+def start_codebase_watcher():
+    """
+    Keeps the default workspace current in the background when collector_watch is enabled in native mode.
+    With several worker processes only the one holding the watcher lock runs it.
+    """
+    global watcher_lock
+    if not (COLLECTOR_WATCH and COLLECTOR_MODE == 'native'):
+        return None
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    watcher_lock = open(os.path.join(SNAPSHOT_DIR, 'watcher.lock'), 'a')
+    try:
+        fcntl.flock(watcher_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        watcher_lock.close()
+        watcher_lock = None
+        logger.info("Codebase watcher is running in another worker process.")
+        return None
+    collector = native_collector(DEFAULT_WORKSPACE)
+    def on_change(stats):
+        install_codebase(collector.content(), stats['tokens'], DEFAULT_WORKSPACE)
+    logger.info("Watching '%s' for changes every %ss.", CODEBASE_DIR, COLLECTOR_WATCH_INTERVAL)
+    return CollectorWatcher(collector, on_change, interval=COLLECTOR_WATCH_INTERVAL).start()
+
+watcher_lock = None
+codebase_watcher = start_codebase_watcher()
+startup.mark('services')
+logger.info("Started in %s; database and tokenizer are loading in the background.", startup.summary())
 
 if __name__ == '__main__':
     logger.info("Running Flask app on port 5000.")
@@ -0,0 +1,223 @@
+import fcntl
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('PrompterApp')
+
+SNAPSHOT_FILE = re.compile(r'^([0-9a-f]{64})\.(txt\.gz|txt|json|index\.gz)$')
+
+
+class SnapshotStore:
+    """
+    Content-addressed on-disk store of codebase snapshots.
+
+    Each snapshot is stored gzip-compressed under its sha256, next to a small JSON
+    metadata file (name, size, token count) and, optionally, its pickled relevance
+    index. The current snapshot of every workspace is recorded in workspaces.json,
+    so a restarted process can serve the same codebases without re-collecting.
+
+    The store may be shared by several worker processes: workspaces.json is re-read
+    whenever its mtime changes and updated under a file lock. Content is read from an
+    uncompressed copy written on first read, so other workers need not decompress the
+    snapshot; each worker still holds its own decoded copy of the codebases it loads.
+
+    prune() deletes the snapshots no workspace or caller still refers to, keeping the
+    most recently used ones, so a watched codebase does not fill the disk.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._workspaces_mtime = None
+        self._workspaces = {}
+        self._reload_workspaces()
+
+    def put(self, content, name=None):
+        """
+        Stores content if it is not already present and returns its snapshot id.
+        """
+        data = content.encode('utf-8')
+        snapshot_id = hashlib.sha256(data).hexdigest()
+        if not os.path.exists(self._path(snapshot_id, 'txt.gz')):
+            self._write(self._path(snapshot_id, 'txt.gz'), gzip.compress(data, compresslevel=6))
+            self.update_meta(snapshot_id, name=name, bytes=len(data), created_at=time.time())
+            logger.info("Stored codebase snapshot %s (%s bytes).", snapshot_id[:12], len(data))
+        return snapshot_id
+
+    def exists(self, snapshot_id):
+        return os.path.exists(self._path(snapshot_id, 'txt.gz'))
+
+    def get_content(self, snapshot_id):
+        path = self._path(snapshot_id, 'txt')
+        try:
+            with open(path, 'rb') as f:
+                return f.read().decode('utf-8')
+        except FileNotFoundError:
+            pass  # Not read yet, or its copy was pruned
+        with open(self._path(snapshot_id, 'txt.gz'), 'rb') as f:
+            data = gzip.decompress(f.read())
+        self._write(path, data)
+        return data.decode('utf-8')
+
+    def get_meta(self, snapshot_id):
+        return self._read_json(self._path(snapshot_id, 'json'), {})
+
+    def update_meta(self, snapshot_id, **fields):
+        with self._lock:
+            meta = self.get_meta(snapshot_id)
+            meta.update({key: value for key, value in fields.items() if value is not None}, id=snapshot_id)
+            self._write(self._path(snapshot_id, 'json'), json.dumps(meta).encode('utf-8'))
+
+    def put_index(self, snapshot_id, index):
+        self._write(self._path(snapshot_id, 'index.gz'), gzip.compress(pickle.dumps(index), compresslevel=1))
+
+    def get_index(self, snapshot_id):
+        """
+        Returns the stored index of a snapshot, or None when absent or unreadable.
+        """
+        path = self._path(snapshot_id, 'index.gz')
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.loads(gzip.decompress(f.read()))
+        except Exception:
+            logger.warning("Ignoring unreadable index for snapshot %s.", snapshot_id[:12])
+            return None
+
+    def workspace_snapshot(self, workspace):
+        self._reload_workspaces()
+        return self._workspaces.get(workspace)
+
+    def set_workspace_snapshot(self, workspace, snapshot_id):
+        with self._lock, open(os.path.join(self.directory, 'workspaces.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            workspaces = self._read_json(self._workspaces_path(), {})
+            self._workspaces = dict(workspaces, **{workspace: snapshot_id})
+            self._write(self._workspaces_path(), json.dumps(self._workspaces).encode('utf-8'))
+            self._workspaces_mtime = os.stat(self._workspaces_path()).st_mtime_ns
+
+    def prune(self, keep_ids=(), keep_recent=10):
+        """
+        Deletes every snapshot except the current ones of the workspaces, those in keep_ids
+        and the keep_recent most recently stored or used. Kept snapshots other than those
+        lose their uncompressed copy, which is rewritten if they are read again.
+        Returns the number of snapshots deleted.
+        """
+        files = {}
+        for path in glob.glob(os.path.join(glob.escape(self.directory), '??', '*')):
+            match = SNAPSHOT_FILE.match(os.path.basename(path))
+            if match:
+                files.setdefault(match.group(1), {})[match.group(2)] = path
+        self._reload_workspaces()
+        by_use = sorted(files, key=lambda snapshot_id: self._last_used(files[snapshot_id]), reverse=True)
+        keep = set(self._workspaces.values()) | set(by_use[:max(1, keep_recent)])
+        deleted = 0
+        for snapshot_id, paths in files.items():
+            if snapshot_id in keep:
+                continue
+            if snapshot_id in keep_ids:
+                paths = {suffix: path for suffix, path in paths.items() if suffix == 'txt'}
+            else:
+                deleted += 1
+            for path in paths.values():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Pruned by another process
+        if deleted:
+            logger.info("Pruned %s codebase snapshots.", deleted)
+        return deleted
+
+    @staticmethod
+    def _last_used(paths):
+        """
+        Returns when a snapshot was last stored or installed; its metadata is rewritten on every install.
+        """
+        for suffix in ('json', 'txt.gz'):
+            try:
+                return os.stat(paths[suffix]).st_mtime
+            except (KeyError, FileNotFoundError):
+                continue
+        return 0
+
+    def _reload_workspaces(self):
+        try:
+            mtime = os.stat(self._workspaces_path()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._workspaces_mtime:
+            with self._lock:
+                self._workspaces = self._read_json(self._workspaces_path(), self._workspaces)
+                self._workspaces_mtime = mtime
+
+    def _path(self, snapshot_id, suffix):
+        return os.path.join(self.directory, snapshot_id[:2], f"{snapshot_id}.{suffix}")
+
+    def _workspaces_path(self):
+        return os.path.join(self.directory, 'workspaces.json')
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read_json(path, default):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+
+class SnapshotCache:
+    """
+    LRU cache of loaded snapshots. load(snapshot_id) builds the in-memory object on a miss.
+    """
+
+    def __init__(self, load, capacity=4):
+        self.load = load
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, snapshot_id):
+        with self._lock:
+            if snapshot_id in self._items:
+                self._items.move_to_end(snapshot_id)
+                return self._items[snapshot_id]
+            loading = self._loading.setdefault(snapshot_id, threading.Lock())
+        with loading:
+            with self._lock:
+                if snapshot_id in self._items:
+                    return self._items[snapshot_id]
+            try:
+                item = self.load(snapshot_id)
+                self.put(snapshot_id, item)
+            finally:
+                with self._lock:
+                    self._loading.pop(snapshot_id, None)
+            return item
+
+    def put(self, snapshot_id, item):
+        with self._lock:
+            self._items[snapshot_id] = item
+            self._items.move_to_end(snapshot_id)
+            while len(self._items) > self.capacity:
+                evicted, _ = self._items.popitem(last=False)
+                logger.debug("Evicted codebase snapshot %s from memory.", evicted[:12])
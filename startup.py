@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('PrompterApp')
+
+
+class StartupTracker:
+    """
+    Times the phases of process startup and tracks the readiness checks that finish
+    in the background.
+
+    mark(name) closes a synchronous phase. background(name, task) runs task on a
+    thread, retrying errors of error_types with capped exponential backoff until it
+    succeeds; any other exception marks the check failed, with the error shown in
+    report(). The process is ready once every background task has succeeded.
+    """
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = {}
+        self.checks = {}
+        self._last_mark = self.started
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        with self._lock:
+            self.phases[name] = now - self._last_mark
+            self._last_mark = now
+
+    def background(self, name, task, backoff=0.5, max_backoff=30.0, error_types=(Exception,)):
+        with self._lock:
+            self.checks[name] = {'ready': False, 'failed': False, 'attempts': 0, 'error': None}
+        threading.Thread(
+            target=self._run, args=(name, task, backoff, max_backoff, error_types),
+            name=f'startup-{name}', daemon=True
+        ).start()
+
+    def ready(self):
+        with self._lock:
+            return all(check['ready'] for check in self.checks.values())
+
+    def report(self):
+        with self._lock:
+            return {
+                'ready': all(check['ready'] for check in self.checks.values()),
+                'uptime': time.perf_counter() - self.started,
+                'checks': {name: dict(check) for name, check in self.checks.items()},
+                'phases': dict(self.phases),
+            }
+
+    def summary(self):
+        """
+        Returns the synchronous phase timings as one log-friendly line.
+        """
+        with self._lock:
+            phases = ', '.join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+            return f"{(self._last_mark - self.started) * 1000:.0f}ms ({phases})"
+
+    def _run(self, name, task, backoff, max_backoff, error_types):
+        started = time.perf_counter()
+        delay = backoff
+        while True:
+            with self._lock:
+                self.checks[name]['attempts'] += 1
+            try:
+                task()
+                break
+            except error_types as e:
+                with self._lock:
+                    self.checks[name]['error'] = str(e)
+                logger.warning("Startup task '%s' failed (%s); retrying in %.1fs.", name, e, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, max_backoff)
+            except Exception as e:
+                with self._lock:
+                    self.checks[name].update(failed=True, error=f"{type(e).__name__}: {e}")
+                logger.exception("Startup task '%s' failed and will not be retried; the process cannot become ready.", name)
+                return
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.checks[name].update(ready=True, error=None, seconds=elapsed)
+        logger.info("Startup task '%s' finished in %.0fms.", name, elapsed * 1000)
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('PrompterApp')
+
+REPLY_PRIMING_TOKENS = 3  # Every reply is primed with <|start|>assistant<|message|>
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def set_encoding_cache_dir(directory):
+    """
+    Makes tiktoken read and store encoding files in directory. Once it holds the
+    model's encoding, loading it needs no network access.
+    """
+    os.makedirs(directory, exist_ok=True)
+    os.environ['TIKTOKEN_CACHE_DIR'] = directory
+
+
+def get_encoding(model):
+    """
+    Returns the tiktoken encoding for the model, resolving it only once per process.
+    tiktoken itself is imported on first use, keeping it off the import path of the app.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    with _encodings_lock:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                logger.warning("Model %s not found. Using cl100k_base encoding.", model)
+                encoding = tiktoken.get_encoding('cl100k_base')
+            _encodings[model] = encoding
+    return encoding
+
+
+def message_overhead(model):
+    """
+    Returns (tokens_per_message, tokens_per_name) for the model's chat format.
+    """
+    if model.startswith("gpt-4"):
+        return 3, 1
+    if model.startswith("gpt-3.5-turbo"):
+        return 4, -1
+    return 3, 1
+
+
+class TokenLedger:
+    """
+    Token accounting for chat inputs.
+
+    The encoded length of the codebase prompt is cached by content hash and
+    message token counts are stored alongside the messages, so counting a
+    request only encodes the new draft and sums cached values.
+    """
+
+    def __init__(self, model, max_prompts=8):
+        self.model = model
+        self.max_prompts = max_prompts
+        self._prompt_counts = OrderedDict()
+        self._role_counts = {}
+        self._lock = threading.Lock()
+
+    def count_text(self, text):
+        """
+        Returns the number of tokens in a single piece of text. Special-token markers such
+        as <|endoftext|> are counted as ordinary text, as the API treats them in messages.
+        """
+        return len(get_encoding(self.model).encode_ordinary(text))
+
+    def count_texts(self, texts, num_threads=8):
+        """
+        Returns the token counts of several texts, encoded in parallel by tiktoken's thread pool.
+        """
+        if len(texts) < 2:
+            return [self.count_text(text) for text in texts]
+        return [len(tokens) for tokens in get_encoding(self.model).encode_ordinary_batch(texts, num_threads=num_threads)]
+
+    def prompt_tokens(self, content):
+        """
+        Returns the token count of a (large) prompt, cached by its content hash.
+        """
+        key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        with self._lock:
+            if key in self._prompt_counts:
+                self._prompt_counts.move_to_end(key)
+                return self._prompt_counts[key]
+        tokens = self.count_text(content)
+        with self._lock:
+            self._prompt_counts[key] = tokens
+            while len(self._prompt_counts) > self.max_prompts:
+                self._prompt_counts.popitem(last=False)
+        logger.debug("Cached token count %d for prompt %.12s.", tokens, key)
+        return tokens
+
+    def remember_prompt_tokens(self, content, tokens):
+        """
+        Records an already known token count for a prompt, e.g. one summed incrementally per file.
+        """
+        key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        with self._lock:
+            self._prompt_counts[key] = tokens
+            self._prompt_counts.move_to_end(key)
+            while len(self._prompt_counts) > self.max_prompts:
+                self._prompt_counts.popitem(last=False)
+
+    def message_tokens(self, role, content_tokens):
+        """
+        Returns the cost of one chat message given the token count of its content.
+        """
+        role_tokens = self._role_counts.get(role)
+        if role_tokens is None:
+            role_tokens = self.count_text(role)
+            self._role_counts[role] = role_tokens
+        tokens_per_message, _ = message_overhead(self.model)
+        return tokens_per_message + role_tokens + content_tokens
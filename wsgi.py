@@ -0,0 +1,23 @@
+"""
+Production entry point for Prompter.
+
+Serves server.py's Flask app under gunicorn with one worker process per core
+(see gunicorn.conf.py). Workers share no memory; the state every worker must
+agree on lives outside them:
+
+  * codebase snapshots, the current snapshot of each workspace and the history
+    list version marker are files under snapshot_dir (each worker loads its own
+    copy of the codebases it serves);
+  * codebase load jobs are rows of the codebase_jobs table, so any worker can
+    report on (or join) a load another worker is running;
+  * token counts are stored with the snapshots and messages they belong to;
+  * messages are persisted before a reply's [TOKEN_COUNT] trailer is sent, and
+    spilled messages go to one journal that any worker can replay.
+
+Only one worker runs the codebase watcher. Run with:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The asyncio serving mode scales the same way:  uvicorn asgi_server:app --workers 4
+"""
+from server import app  # noqa: F401